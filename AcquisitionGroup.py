@@ -1,15 +1,28 @@
 import time
-import PySpin
+from drivers import PySpin
 import os
 
 import threading
-from Camera import Camera
+import json
+import numpy as np
+from Camera import Camera, DLC_UPDATE_EACH
+from CameraProcess import ProcessCamera, get_serial_number
 from Nidaq import Nidaq
 from Mic import Mic
+from utils.encoder_profiles import DEFAULT_ENCODER_PROFILE, benchmark as benchmark_encoder
+from utils.raw_store import Transcoder, raw_store_path
+from utils.pose_service import PoseService
+from utils.live_triangulation import LiveTriangulator
+from utils.stream_server import StreamServer
+from utils.shared_preview import SharedPreviewWriter
+from utils.event_log import EventLog
 
 # import ProcessingGroup as pg
 # import RigStatus
 CAM_LIST = [17391304, 17391290, 19287342, 19412282]
+CAMERA_PROCESSES = False  # capture and save each camera in its own process, see CameraProcess.py
+STREAM_PORT = None  # serve every child's display on this one port instead of one port each, see utils/stream_server.py
+SHARED_PREVIEWS = False  # also publish every child's preview in shared memory for local clients, see utils/shared_preview.py
 
 
 def rearrange_cameras(cameras: list):
@@ -21,7 +34,8 @@ def rearrange_cameras(cameras: list):
 
 class AcquisitionGroup:
   # def __init__(self, frame_rate=30, audio_settings=None):
-  def __init__(self, status, hostname='localhost', ports=5002):
+  def __init__(self, status, hostname='localhost', ports=5002, camera_processes=CAMERA_PROCESSES,
+               stream_port=STREAM_PORT, shared_previews=SHARED_PREVIEWS):
     self._system = PySpin.System.GetInstance()
     self._camlist = self._system.GetCameras()
     self.nCameras = self._camlist.GetSize()
@@ -29,19 +43,42 @@ class AcquisitionGroup:
     self.nChildren = self.nCameras + 2
     if not isinstance(ports, list):
       ports = [ports + i for i in range(self.nChildren)]
-
-    cameras = [Camera(self, self._camlist, i, status['frame rate'].current, (hostname, ports[i]))
-               for i in range(self.nCameras)]
+    addresses = [(hostname, port) for port in ports]
+    self.stream_server = None
+    self.pose_3d_stream = None
+    if stream_port is not None:
+      # the children do not listen themselves, they publish to the server
+      self.stream_server = StreamServer((hostname, stream_port))
+      addresses = [None] * self.nChildren
+
+    if camera_processes:
+      # the cameras are only opened inside their own processes
+      serial_numbers = [get_serial_number(self._camlist.GetByIndex(i)) for i in range(self.nCameras)]
+      cameras = [ProcessCamera(self, serial_numbers[i], status['frame rate'].current, addresses[i])
+                 for i in range(self.nCameras)]
+    else:
+      cameras = [Camera(self, self._camlist, i, status['frame rate'].current, addresses[i])
+                 for i in range(self.nCameras)]
 
     self.cameras = rearrange_cameras(cameras)
     self.camera_order = CAM_LIST
-    self.mic = Mic(self, status['sample frequency'].current, status['spectrogram'].current, (
-        hostname, ports[-2]))
+    self.mic = Mic(self, status['sample frequency'].current, status['spectrogram'].current, addresses[-2])
     self.nidaq = Nidaq(self, status['frame rate'].current,
-                       status['sample frequency'].current, status['spectrogram'].current, (
-                           hostname, ports[-1]))
+                       status['sample frequency'].current, status['spectrogram'].current, addresses[-1],
+                       read_time=status['nidaq read time'].current)
 
     self.children = self.cameras + [self.mic] + [self.nidaq]
+    if self.stream_server is not None:
+      for child in self.children:
+        child.display_stream = self.stream_server.add_stream(child.name)
+      for camera in self.cameras:
+        # DLC points, markers and status text, for previews set to send overlays as metadata
+        camera.overlay_stream = self.stream_server.add_stream(f'{camera.name} overlays')
+      self.pose_3d_stream = self.stream_server.add_stream('pose 3d')
+    if shared_previews:
+      # remote clients still use TCP
+      for child in self.children:
+        child.shared_preview = SharedPreviewWriter(child.name)
 
     self._processors = [None] * self.nChildren
     self._runners = [None] * self.nChildren
@@ -49,6 +86,24 @@ class AcquisitionGroup:
     self._displayers = [None] * self.nChildren
     self.filepaths = None
     #self._starters
+    self.frame_rate = status['frame rate'].current
+    self.encoder_profile = DEFAULT_ENCODER_PROFILE
+    self.encoder_benchmarks = {}  # profile: result of utils.encoder_profiles.benchmark, measured once per session
+    self._benchmark_lock = threading.Lock()  # guards encoder_benchmarks and _benchmarking
+    self._benchmarking = set()  # profiles being measured on a background thread, see benchmark_encoder()
+    self.file_mode = 'encode'
+    self.benchmark_encoder()  # before the first recording, rather than when it starts
+    self.transcoder = Transcoder(print=self.print)  # encodes raw stores after stop(), see set_file_mode
+    self.events = EventLog()  # e.g. live call detections, see Nidaq.do_process
+    try:
+      # 3D keypoints from the cameras' DLC Live poses, see utils/live_triangulation.py
+      self.triangulator = LiveTriangulator(status['frame rate'].current, on_points=self.send_points)
+    except (OSError, KeyError) as e:
+      self.print(f'no live 3D keypoints, the calibration could not be loaded: {e}')
+      self.triangulator = None
+    self._triangulating = None  # whether enough cameras run DLC Live for add_pose() to triangulate
+    self.poses = PoseService(update_each=DLC_UPDATE_EACH, print=self.print,  # DLC Live for all cameras
+                             on_pose=self.add_pose if self.triangulator is not None else None)
 
     self.started = False
     self.processing = False
@@ -77,7 +132,7 @@ class AcquisitionGroup:
     self.print('detected %d cameras' % self.nCameras)
 
     for i,child, fp, disp in zip(list(range(len(self.cameras))),self.cameras, self.filepaths[: -2], isDisplayed[: -2]):
-      self._starters[i]=threading.Thread(target=child.start,kwargs={'filepath':fp,'display':disp})
+      self._starters[i]=threading.Thread(target=child.start,kwargs={'filepath':fp,'display':disp},name=f'{child.name} start')
       self._starters[i].start()
       #child.start(filepath=fp, display=disp)
       self.print('started camera ' + child.device_serial_number)
@@ -90,6 +145,10 @@ class AcquisitionGroup:
     # ^ this is false, triggering happens in ag.run() ??
     self.nidaq.start(filepath=self.filepaths[-1], display=False)
     self.print('started nidaq')
+    if self.filepaths[-1]:
+      self.events.open(os.path.join(os.path.dirname(self.filepaths[-1]), 'events.jsonl'))
+    if self.triangulator is not None:
+      self.triangulator.reset()
 
     self.started = True
 
@@ -104,15 +163,18 @@ class AcquisitionGroup:
     # self._runners[-1].start()
 
     # else:
+    for starter in self._starters:
+      if starter is not None:
+        starter.join()  # a camera that is not running yet would end its runner straight away
     for i, child in enumerate(self.children):
       if self._runners[i] is None or not self._runners[i].is_alive():
-        self._runners[i] = threading.Thread(target=child.run)
+        self._runners[i] = threading.Thread(target=child.run, name=f'{child.name} run')
         #threading.setprofile(child.run) # for profiler
         print('start running child %d'%i)
         self._runners[i].start()
       if self._displayers[i] is None or not self._displayers[i].is_alive():
         #if i != 4:  # temporaray solution for not displaying nidaq spectrogram
-          self._displayers[i] = threading.Thread(target=child.display)
+          self._displayers[i] = threading.Thread(target=child.display, name=f'{child.name} display')
           #threading.setprofile(child.display)# for profiler
           self._displayers[i].start()
           print('start displaying child %d' % i)
@@ -124,32 +186,37 @@ class AcquisitionGroup:
     self.print('finished AcquisitionGroup.run')
 
   def process(self, i, options):
-    # if it's recording, process() shouldn't be run. except dlc
-    if not all(self.filepaths) or options['mode'] == 'DLC':
+    # if it's recording, process() shouldn't be run. except dlc and call detection
+    if not all(self.filepaths) or options['mode'] in ('DLC', 'calls'):
       if self._processors[i] is None or not self._processors[i].is_alive():
 
         # turn on top camera processing
 
-        if options['mode'] == 'extrinsic':
+        if options['mode'] == 'DLC':
+          # no thread per camera: the camera subscribes to self.poses, see utils/pose_service.py
+          self.children[i].processing = options
+        elif options['mode'] == 'extrinsic':
           # turn on all cameras
           for j, camera in enumerate(self.cameras):
             camera.processing = options
             self._processors[j] = threading.Thread(
-                target=camera.run_processing)
+                target=camera.run_processing, name=f'{camera.name} process')
             self._processors[j].start()
         else:
           self.children[i].processing = options
           self._processors[i] = threading.Thread(
-              target=self.children[i].run_processing)
+              target=self.children[i].run_processing, name=f'{self.children[i].name} process')
           self._processors[i].start()
     self.processing = True
 
   # TODO: this should be refined depending on future changes to processing
   def stop_processing(self, i):
     self.children[i].processing = None
-    self._processors[i].join()
+    if self._processors[i] is not None:
+      self._processors[i].join()
 
   def stop(self):
+    recorded = self.started and self.filepaths is not None
 
     for i,cam in enumerate(self.cameras):
       self._starters[i].join()
@@ -165,6 +232,13 @@ class AcquisitionGroup:
     self.processing = False
     self.running = False
     self.started = False
+    self.events.close()
+
+    if recorded and self.file_mode == 'raw store':
+      # the raw stores are complete now; encode them in the background, all cameras in parallel
+      for cam, fp in zip(self.cameras, self.filepaths[: -2]):
+        if fp is not None:
+          self.transcoder.submit(raw_store_path(fp), fp, self.encoder_profile)
 
     self.print('finished AcquisitionGroup.stop()')
 
@@ -173,6 +247,104 @@ class AcquisitionGroup:
     self.start(filepaths, isDisplayed)
     self.run()
 
+  def set_encoder_profile(self, profile):
+    # takes effect with the next recording
+    self.encoder_profile = profile
+    for camera in self.cameras:
+      camera.encoder_profile = profile
+    self.benchmark_encoder()
+
+  def set_file_mode(self, mode):
+    # 'encode' while recording, or 'raw store': write raw frames and transcode them after stop()
+    # takes effect with the next recording
+    self.file_mode = mode
+    for camera in self.cameras:
+      camera.file_mode = mode
+    self.benchmark_encoder()
+
+  def set_mic_file_format(self, file_format):
+    # 'tdms', 'wav' or 'flac', see utils/audio_writer.py; takes effect with the next recording
+    self.mic.file_format = file_format
+
+  def set_preview(self, i, **settings):
+    # crop, scale, encoding, quality, rate and overlays of camera i's live preview, see utils/preview.py
+    self.cameras[i].preview.configure(**settings)
+
+  def benchmark_encoder(self):
+    # measure the selected profile on a background thread, once per session; the benchmark runs
+    # ffmpeg for seconds, so it never runs on the caller's (e.g. a status callback's) thread
+    if self.file_mode == 'raw store':
+      return  # nothing is encoded while recording
+    profile = self.encoder_profile
+    with self._benchmark_lock:
+      if profile in self.encoder_benchmarks or profile in self._benchmarking:
+        return
+      self._benchmarking.add(profile)
+    threading.Thread(target=self._benchmark_encoder, args=(profile,),
+                     name=f'{profile} encoder benchmark', daemon=True).start()
+
+  def _benchmark_encoder(self, profile):
+    camera = self.cameras[0]
+    self.print(f'benchmarking encoder profile {profile} on {self.nCameras} streams')
+    try:
+      result = benchmark_encoder(profile, camera.width, camera.height, streams=self.nCameras)
+    except Exception as e:
+      self.print(f'could not benchmark encoder profile {profile}: {e}')
+      result = None
+    with self._benchmark_lock:
+      self._benchmarking.discard(profile)
+      if result is not None:
+        self.encoder_benchmarks[profile] = result
+    if result is not None and profile == self.encoder_profile:
+      self.check_encoder(self.frame_rate)
+
+  def check_encoder(self, frame_rate):
+    # whether this machine can encode every camera at frame_rate with the selected profile
+    # only reads the result of benchmark_encoder(); None while it is still being measured
+    if self.file_mode == 'raw store':
+      return None  # nothing is encoded while recording
+    with self._benchmark_lock:
+      result = self.encoder_benchmarks.get(self.encoder_profile)
+    if result is None:
+      self.print(f'encoder profile {self.encoder_profile} is still being benchmarked')
+      return None
+    if result['fps'] < frame_rate:
+      self.print(f"WARNING: encoder profile {self.encoder_profile} sustains only {result['fps']:.1f} fps "
+                 f"per camera on this machine, frames will back up at {frame_rate} fps")
+    return result
+
+  @property
+  def metrics(self):
+    # per-child performance counters and histograms since the last start()
+    metrics = {child.name: child.metrics.snapshot for child in self.children}
+    if self.triangulator is not None:
+      metrics['pose 3d'] = self.triangulator.metrics.snapshot
+    return metrics
+
+  def add_pose(self, camera, data_count, info, pose):
+    # PoseService's on_pose: 3D keypoints need DLC Live on at least two calibrated cameras
+    cameras = [c for c in self.poses.subscribers if str(c.device_serial_number) in self.triangulator.calibration]
+    triangulating = len(cameras) >= 2
+    if triangulating != self._triangulating:
+      self._triangulating = triangulating
+      if triangulating:
+        self.print(f'live 3D keypoints from {len(cameras)} cameras')
+      else:
+        self.print(f'no live 3D keypoints: DLC Live runs on {len(cameras)} calibrated camera(s) and triangulation '
+                   f'needs at least 2 (side cameras are analyzed once DLC_LIVE_SIDE_MODEL_PATH is set)')
+    if triangulating:
+      self.triangulator.add_pose(camera, data_count, info, pose)
+
+  def send_points(self, result):
+    # the triangulator's on_points: every frame of 3D keypoints as json on the 'pose 3d' stream,
+    # keyed to the camera frame id, with null for keypoints that are not known
+    if self.pose_3d_stream is None or not len(self.pose_3d_stream):
+      return
+    points = np.where(np.isnan(result['points']), None, np.round(result['points'], 4)).tolist()
+    payload = json.dumps({'frame id': result['frame id'], 'bodyparts': result['bodyparts'], 'points': points,
+                          'cameras': result['cameras'].tolist()}).encode()
+    self.pose_3d_stream.send(payload, result['frame id'], result['host time'], 'json', np.uint8, (len(payload),))
+
   def print(self, *args):
     print(*args)
 
@@ -180,6 +352,11 @@ class AcquisitionGroup:
   #   #send a message to the gui that a step ahs been completed
 
   def __del__(self):
+    if self.stream_server is not None:
+      self.stream_server.close()
+    for child in self.children:
+      if child.shared_preview is not None:
+        child.shared_preview.close()
     del self.children
     self._camlist.Clear()
     self._system.ReleaseInstance()
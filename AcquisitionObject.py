@@ -1,14 +1,47 @@
 import threading
 import socket
+import select
 import time
 import numpy as np
 import os
-from utils.tcp_utils import initTCP, getConnections, sendData, doShutdown
+import json
+from utils.tcp_utils import initTCP, getConnections, doShutdown, FrameSender
+from utils.ring_buffer import FrameRing, RING_SLOTS
+from utils.frame_pool import PooledFrame
+from utils.metrics import Metrics
+from utils.preview import Preview, length_prefixed
+from utils.writer import AsyncWriter, WRITER_DEPTH
 
 BUFFER_TIME = .005  # time in seconds allowed for overhead
+DATA_TIMEOUT = .5  # longest time in seconds a consumer blocks before re-checking its state
+ACCEPT_TIMEOUT = .5  # longest time in seconds the displayer blocks waiting for a first client
+
+
+def _worker_flag(name):
+  # attribute that wakes wait_for() whenever a worker thread starts or finishes
+  def getter(self):
+    return self._workers[name]
+
+  def setter(self, value):
+    with self._workers_cond:
+      self._workers[name] = value
+      self._workers_cond.notify_all()
+  return property(getter, setter)
 
 
 class AcquisitionObject:
+  # True if capture() blocks until the device has new data (e.g. hardware triggered frames)
+  # in that case run() does not pace itself with sleep()
+  capture_blocks = False
+
+  # what save() does through new_writer() when the writer thread falls behind, see utils/writer.py
+  writer_policy = 'block'
+  writer_depth = WRITER_DEPTH
+
+  _has_runner = _worker_flag('runner')
+  _has_processor = _worker_flag('processor')
+  _has_displayer = _worker_flag('displayer')
+
   #############
   # LIFECYCLE METHODS TO BE OVERLOADED, LISTED IN ORDER:
   #############
@@ -54,8 +87,14 @@ class AcquisitionObject:
   def predisplay(self, data):
     # set up data for displaying, e.g. cv2.puttext or cv2.drawline
     # data is the raw data from capture, so it may need to be reshaped, etc.
+    # only draw overlays when self.burn_overlays, otherwise display() sends overlay() to the clients
     return data
 
+  def overlay(self):
+    # annotations of the current results as a json-friendly dict {'results seq', 'items'},
+    # see utils/image_draw_utils.draw_overlay(); None when there is nothing to draw
+    return None
+
   def end_run(self):
     # any cleanup that needs to be done after running goes here
     pass
@@ -85,13 +124,16 @@ class AcquisitionObject:
     self.data_size = data_size
 
     self._running_lock = threading.Lock()
+    self._running_cond = threading.Condition(self._running_lock)
     self._running = False
 
     self._file_lock = threading.Lock()
     self._file = None
 
     self._data_lock = threading.Lock()
-    self._data = None
+    # notified whenever a new frame is published or display is toggled
+    self._data_cond = threading.Condition(self._data_lock)
+    self._data = None  # FrameRing while displaying, else None
     self.filepath = None
 
     self._processing_lock = threading.Lock()
@@ -100,19 +142,32 @@ class AcquisitionObject:
 
     self._results_lock = threading.Lock()
     self._results = None
+    self._results_count = 0  # sequence number of the frame the results were computed on
 
+    self._workers_cond = threading.Condition()
+    self._workers = {}
     self._has_runner = False
+    self._last_capture = None
     self._has_processor = False
     # self._has_filepath = False
     self._has_displayer = False
 
     self.address = address
-    self._sock = initTCP(address)  # TODO: move elsewhere
-    self._recipients = []
+    # no address means the object never displays itself (e.g. a camera capturing in a worker process)
+    self._sock = initTCP(address) if address is not None else None  # TODO: move elsewhere
+    self._sender = None  # FrameSender to the display clients, started by the first display()
+    self.display_stream = None  # set when the group serves all children on one port, see utils/stream_server.py
+    self.overlay_stream = None  # stream for overlay() when the preview sends overlays as metadata
+    self.shared_preview = None  # SharedPreviewWriter for clients on this machine, see utils/shared_preview.py
+    self.preview = Preview()  # how frames are cropped, scaled and encoded for the clients
+    self.display_count = 0  # sequence number of the data handed to predisplay()
 
     self.parent = parent
     self.is_top = False
 
+    self.name = type(self).__name__.lower()  # key for this child in AcquisitionGroup.metrics
+    self.metrics = Metrics()
+
   @property
   def running(self):
     with self._running_lock:
@@ -130,6 +185,7 @@ class AcquisitionObject:
         if self._running:
           self.end_run()
           self._running = False
+          self._running_cond.notify_all()
 
   @property
   def file(self):
@@ -153,29 +209,74 @@ class AcquisitionObject:
 
   @property
   def data(self):
+    # read-only view of the newest frame; no copy is made
     with self._data_lock:
       if self._data is None:
         return None
-      else:
-        return self._data.copy()
+      return self._data.latest()[0]
 
   @property
   def data_count(self):
     with self._data_lock:
-      return self._data_count
+      if self._data is None:
+        return 0
+      return self._data.seq
 
   @property
   def data_and_count(self):
+    # read-only view of the newest frame and its sequence number
+    # the view stays valid until the writer laps it, see data_lapped()
     with self._data_lock:
       if self._data is None:
         return None, 0
-      else:
-        return self._data.copy(), self._data_count
+      return self._data.latest()
+
+  def data_at(self, data_count):
+    # read-only view of the frame with this sequence number, None once it has been overwritten
+    with self._data_lock:
+      if self._data is None:
+        return None
+      return self._data.get(data_count)
+
+  def data_info(self, data_count):
+    # metadata published with the frame (e.g. the camera frame id, see utils/frame_index.py), or None
+    with self._data_lock:
+      if self._data is None:
+        return None
+      return self._data.info(data_count)
+
+  def data_lapped(self, data_count):
+    # True if the frame with this sequence number has been (or is being) overwritten
+    with self._data_lock:
+      if self._data is None:
+        return True
+      return self._data.lapped(data_count)
+
+  def data_time(self, data_count):
+    # host time at which the frame with this sequence number was published, None once it has been overwritten
+    with self._data_lock:
+      if self._data is None:
+        return None
+      return self._data.timestamp(data_count)
+
+  def wait_for_data(self, last_count, timeout=DATA_TIMEOUT):
+    # block until a frame newer than last_count is published, display is switched off, or timeout
+    # returns the current data_count, which equals last_count if nothing new arrived
+    def current_count():
+      return 0 if self._data is None else self._data.seq
+
+    with self._data_cond:
+      self._data_cond.wait_for(lambda: current_count() != last_count, timeout)
+      return current_count()
 
   @property
   def new_data(self):
     return np.empty(self.data_size)
 
+  def new_ring(self):
+    data = self.new_data
+    return FrameRing(n_slots=RING_SLOTS, shape=data.shape, dtype=data.dtype)
+
   @data.setter
   def data(self, data):
     if isinstance(data, bool):
@@ -183,19 +284,34 @@ class AcquisitionObject:
         with self._data_lock:
           if self._data is not None:
             self.end_display()
-          self._data = self.new_data
+            self._data.clear()
+          self._data = self.new_ring()
           self.prepare_display()
-          self._data_count = 0
+          self._data_cond.notify_all()
       else:
         with self._data_lock:
           if self._data is not None:
             self.end_display()
+            self._data.clear()  # hand pooled frames back to the runner
           self._data = None
-          self._data_count = 0
+          self._data_cond.notify_all()
     else:
       with self._data_lock:
-        self._data = data
-        self._data_count += 1
+        if self._data is None:
+          if not self._running:
+            return  # a late frame from a runner that is being stopped
+          self._data = self.new_ring()
+        ring = self._data
+      # the copy into the ring slot happens outside _data_lock so readers are never blocked on it
+      # a PooledFrame is not copied at all, the ring just keeps a reference
+      if isinstance(data, PooledFrame):
+        ring.put(data, None if data.info is None else data.info['host_time'])
+      else:
+        ring.write(data)
+      with self._data_lock:
+        if self._data is not ring:
+          ring.clear()  # display was switched off in the meantime
+        self._data_cond.notify_all()
 
   @property
   def displaying(self):
@@ -232,6 +348,22 @@ class AcquisitionObject:
     with self._results_lock:
       self._results = results
 
+  @property
+  def results_and_count(self):
+    with self._results_lock:
+      return self._results, self._results_count
+
+  @results_and_count.setter
+  def results_and_count(self, results_and_count):
+    with self._results_lock:
+      self._results, self._results_count = results_and_count
+
+  @property
+  def burn_overlays(self):
+    # overlays are drawn into the frames unless the clients asked for them as metadata; the
+    # per-child ports carry bare frames only, so metadata needs the group's stream server
+    return self.overlay_stream is None or self.preview.settings['overlays'] == 'burned'
+
   @property
   def run_interval(self):
     return self._run_interval
@@ -275,6 +407,7 @@ class AcquisitionObject:
     self._data_size = data_size
 
   def start(self, filepath=None, display=False):
+    self.metrics.reset()
     self.filepath = filepath
     self.file = filepath
     self.data = display
@@ -287,13 +420,8 @@ class AcquisitionObject:
     self.data = False
 
   def wait_for(self):
-    self.print(f"runner {self._has_runner}")
-    self.print(f"processor {self._has_processor}")
-    self.print(f"_data {self._data is None}")
-    self.print(f"displayer {self._has_displayer}")
-    while self._has_runner or self._has_processor or self._has_displayer:
-      check_time = time.time()
-      self.sleep(check_time, factor=.2)
+    with self._workers_cond:
+      self._workers_cond.wait_for(lambda: not any(self._workers.values()))
 
   def sleep(self, last, factor=1.):
     pause_time = factor*(last + self.run_interval - time.time()-0.005)
@@ -305,50 +433,109 @@ class AcquisitionObject:
       return  # only 1 runner at a time
 
     self._has_displayer = True
+    if self.display_stream is None and self._sender is None:
+      self._sender = FrameSender(name=f'{self.name} sender')
+    clients = self._sender if self.display_stream is None else self.display_stream
 
-    last_count = -1
-    try:
-      data, data_count = self.data_and_count
-    except:
-      self._has_displayer = False
-      return
-
-    last_data_time = time.time()
+    last_count = 0
 
     while self._data is not None:
       # NOTE: I don't love how when we have no recipients we keep requesting the data anyways.
       # that's why I elected to check if self._data is none instead
       # we don't have the thread lock but should be okay for just reading None status?
 
-      if len(self._recipients) == 0:
-        self.sleep(time.time())
-        getConnections(self._sock, self._recipients, block=False)
-      else:
-        self.sleep(last_data_time)
-        data, data_count = self.data_and_count
+      local = self.shared_preview is not None and self.shared_preview.has_readers
+      if len(clients) == 0 and not local:
+        if self.display_stream is not None:
+          self.display_stream.wait_for_subscribers(ACCEPT_TIMEOUT)
+        else:
+          # block on the listening socket instead of polling it
+          select.select([self._sock], [], [], ACCEPT_TIMEOUT)
+          self._accept_clients()
+        continue
 
-      if data_count > last_count:
-        last_data_time = time.time()
-        last_count = data_count
+      # only look at the frame once its sequence number has moved on
+      if self.wait_for_data(last_count) == last_count:
+        continue
+
+      data, data_count = self.data_and_count
+      if data is None:
+        continue
 
-        data = self.predisplay(data)  # do any additional frame workup
+      if last_count > 0 and data_count > last_count + 1:
+        self.metrics.count('display skipped', data_count - last_count - 1)
+      last_count = data_count
+      if not self.preview.due():
+        self.metrics.count('preview rate limited')
+        continue
 
-        getConnections(self._sock, self._recipients,
-                       block=False)  # check for new clients
-        sendData(data.astype(np.uint8).tobytes(), self._recipients)
+      start = time.perf_counter()
+      self.display_count = data_count
+      data = self.predisplay(data)  # do any additional frame workup
+      self.metrics.observe('predisplay', time.perf_counter() - start)
+
+      # encoded once, however many clients get it
+      start = time.perf_counter()
+      payload, encoding, image = self.preview.render(data)
+      self.metrics.observe('preview encode', time.perf_counter() - start)
+
+      start = time.perf_counter()
+      timestamp = self.data_time(data_count)
+      timestamp = time.time() if timestamp is None else timestamp
+      if local:
+        # local clients always get the unencoded image, copying it costs them less than decoding
+        self.shared_preview.write(image, data_count, timestamp)
+      if self.display_stream is not None:
+        # framed with the sequence number, capture time, encoding and shape
+        self.display_stream.send(payload, data_count, timestamp, encoding, np.uint8, image.shape)
+      else:
+        self._accept_clients()  # check for new clients
+        shape = image.shape if self.display_reshaped else None  # raw frames of another shape carry it
+        self._sender.send(length_prefixed(payload, encoding, shape))  # each client gets it once it has taken the previous one
+      if not self.burn_overlays and len(self.overlay_stream):
+        self.send_overlay(data_count, timestamp)
+      self.metrics.observe('display send', time.perf_counter() - start)
+      self.metrics.count('displayed')
+      self.metrics.gauge('recipients', len(clients))
+      self.metrics.gauge('clients', clients.stats)  # delivered fps, bytes and skipped frames per client
     self._has_displayer = False
 
+  @property
+  def display_reshaped(self):
+    # whether displayed frames may differ from the shape the clients know from the status
+    return self.preview.reshapes
+
+  def send_overlay(self, data_count, timestamp):
+    # overlay() as a json frame keyed to the displayed frame's sequence number; it is in full
+    # resolution pixels, the preview's roi and scale tell the client how to map it onto the frame
+    overlay = self.overlay()
+    if overlay is None:
+      return
+    settings = self.preview.settings
+    overlay['roi'], overlay['scale'] = settings['roi'], settings['scale']
+    payload = json.dumps(overlay).encode()
+    self.overlay_stream.send(payload, data_count, timestamp, 'json', np.uint8, (len(payload),))
+    self.metrics.count('overlays sent')
+
+  def _accept_clients(self):
+    connections = []
+    getConnections(self._sock, connections, block=False)
+    for conn, addr in connections:
+      self._sender.add(conn, addr)
+
   def run(self):  # performed only by ag._runners
     if self._has_runner:
       return  # only 1 runner at a time
 
     self._has_runner = True
+    self._last_capture = None
     data = self.new_data
     capture = self.capture(data)
     data_time = time.time() - self.run_interval
 
     while True:
-      self.sleep(data_time)
+      if not self.capture_blocks:
+        self.sleep(data_time)
 
       with self._running_lock:
         # try to capture the next data segment
@@ -359,13 +546,19 @@ class AcquisitionObject:
           self._has_runner = False
           return
 
+      self.observe_capture()
+
       # save the current data to temp
       with self._file_lock:
         if self._file is not None:
+          start = time.perf_counter()
           self.save(data)
+          self.metrics.observe('save', time.perf_counter() - start)
 
       # buffer the current data
       self.data = data
+      if isinstance(data, PooledFrame):
+        data.release()  # the ring keeps its own reference
 
   def run_processing(self):  # performed only by ag._processors
     if self._has_processor:
@@ -373,33 +566,53 @@ class AcquisitionObject:
 
     self._has_processor = True
 
-    results_time = time.time() - self.process_interval
     last_data_count = 0
 
     while True:
-      self.sleep(results_time)
-      try:
+      # don't touch the frame unless it is new
+      data, data_count = None, self.wait_for_data(last_data_count)
+      if data_count != last_data_count:
         data, data_count = self.data_and_count
-      except:
-        continue
-
-      if data_count == last_data_count:
-        results_time = time.time()
-        continue
 
       with self._processing_lock:
-        if self._processing:
-          results_time = time.time()
-          results, process = self.do_process(
-              data, data_count, self._processing)
-          if process is not None:
-            self._processing = process
-        else:
+        if not self._processing:
           self._has_processor = False
           return
+        if data is None:
+          last_data_count = data_count
+          continue
+        start = time.perf_counter()
+        results, process = self.do_process(
+            data, data_count, self._processing)
+        self.metrics.observe('process', time.perf_counter() - start)
+        if process is not None:
+          self._processing = process
+
+      # time from the frame being published to its results being available
+      data_time = self.data_time(data_count)
+      if data_time is not None:
+        self.metrics.observe('process latency', time.time() - data_time)
+      if last_data_count > 0 and data_count > last_data_count + 1:
+        self.metrics.count('process skipped', data_count - last_data_count - 1)
+      self.metrics.count('processed')
+      last_data_count = data_count
 
       # buffer the current data
-      self.results = results
+      self.results_and_count = results, data_count
+
+  def new_writer(self, write, batch=None):
+    # bounded writer thread feeding write(); call from open_file() and close it in close_file()
+    return AsyncWriter(write, depth=self.writer_depth, policy=self.writer_policy, spill_path=f'{self.filepath}.spill',
+                       metrics=self.metrics, name=f'{self.name} writer', batch=batch)
+
+  def observe_capture(self, n=1, now=None):
+    # called by the runner after each capture: counts captured chunks and their interval jitter
+    # now is the time.perf_counter() of the capture, if it was not just now
+    now = time.perf_counter() if now is None else now
+    if self._last_capture is not None:
+      self.metrics.observe('capture interval', now - self._last_capture)
+    self._last_capture = now
+    self.metrics.count('captured', n)
 
   def rmdir(self, path):
     for root, dirs, files in os.walk(path, topdown=False):
@@ -415,5 +628,8 @@ class AcquisitionObject:
   def __del__(self):
     self.stop()
     self.wait_for()
-    doShutdown(self._sock, self._recipients)
+    if self._sender is not None:
+      self._sender.close()
+    if self._sock is not None:
+      doShutdown(self._sock, [])
     self.close()
@@ -1,25 +1,33 @@
 import cv2
-import PySpin
+from drivers import PySpin
 import numpy as np
-import ffmpeg
 from utils.calibration_utils import Calib
 import pandas as pd
-from dlclive import DLCLive, Processor
 from AcquisitionObject import AcquisitionObject
-from utils.image_draw_utils import draw_dots
+from utils.image_draw_utils import dots_overlay, draw_overlay, text_overlay
+from utils.frame_index import FRAME_INDEX_DTYPE, FrameIndexWriter, frame_index_path, frame_info
+from utils.frame_pool import FramePool
+from utils.ring_buffer import RING_SLOTS
+from utils.writer import write_buffers
+from utils.encoder_profiles import DEFAULT_ENCODER_PROFILE, open_encoder, profile_path
+from utils.raw_store import RawStoreWriter, raw_store_path
 import os
 import time
 
 
 FRAME_TIMEOUT = 10  # time in milliseconds to wait for pyspin to retrieve the frame
 FRAME_BUFFER = 3 # frames buffer for display and save
+WRITE_BATCH = 8  # frames handed to the encoder pipe per system call
+POOL_TIMEOUT = 1  # seconds to wait for a free frame before giving the writer time to catch up
 DLC_RESIZE = 0.6  # resize the frame by this factor for DLC
-DLC_UPDATE_EACH = 3  # frame interval for DLC update
+DLC_UPDATE_EACH = 3  # camera frames between DLC updates, see utils/pose_service.py
 TOP_CAM='17391304'
 TEMP_PATH = r'C:\Users\SchwartzLab\PycharmProjects\bahavior_rig\config'
 N_BUFFER=2000
+CHUNK_ENTRIES = ['FrameID', 'Timestamp']  # chunk data attached to every image, see enable_chunk_data
 
 class Camera(AcquisitionObject):
+  capture_blocks = True  # GetNextImage() waits for the hardware trigger
 
   def __init__(self, parent, camlist, index, frame_rate, address):
 
@@ -38,10 +46,15 @@ class Camera(AcquisitionObject):
 
     # set the buffer
     self.set_buffer(nbuffer_frame=N_BUFFER)
+    self._chunk_data = self.enable_chunk_data()
+    self._last_frame_id = None
 
     AcquisitionObject.__init__(
         self, parent, frame_rate, (self.width, self.height), address)
     self.is_top = True if self.device_serial_number == TOP_CAM else False
+    self.name = f'camera {self.device_serial_number}'
+    self.encoder_profile = DEFAULT_ENCODER_PROFILE  # see utils/encoder_profiles.py
+    self.file_mode = 'encode'  # or 'raw store', see utils/raw_store.py
 
     self.save_count=0
     self.capture_count=0
@@ -73,7 +86,20 @@ class Camera(AcquisitionObject):
 
     print('Buffer count now set to: %d' % buffer_count.GetValue())
 
+  def enable_chunk_data(self):
+    # ask the camera to attach its own frame counter and timestamp to every image
+    try:
+      self._spincam.ChunkModeActive.SetValue(True)
+      for entry in CHUNK_ENTRIES:
+        self._spincam.ChunkSelector.SetValue(getattr(PySpin, f'ChunkSelector_{entry}'))
+        self._spincam.ChunkEnable.SetValue(True)
+      return True
+    except PySpin.SpinnakerException as e:
+      print(f'Could not enable chunk data: {e}. Falling back to stream frame IDs.')
+      return False
+
   def prepare_run(self):  # TODO: prepare_run?
+    self._last_frame_id = None  # the camera restarts its frame counter
     self._spincam.BeginAcquisition()
 
   def end_run(self):
@@ -86,17 +112,10 @@ class Camera(AcquisitionObject):
     process = {}
 
     if options['mode'] == 'DLC':
-      # process['modelpath'] = options
+      # no processing thread of its own: the group's pose service runs the model and sets self.results
       process['mode'] = 'DLC'
-      process['processor'] = Processor()
-      process['DLCLive'] = DLCLive(
-          model_path=options['modelpath'],
-          processor=process['processor'],
-          display=False,
-          resize=DLC_RESIZE,
-          dynamic=(True,0.7,40))
-      process['frame0'] = True
-      process['frame_num']=0
+      process['modelpath'] = options['modelpath']
+      self.parent.poses.subscribe(self, options['modelpath'], lambda: self.open_dlc(options['modelpath']))
       return process
     else:  # mode should be 'intrinsic' or 'extrinsic'
       process['mode'] = options['mode']
@@ -115,8 +134,7 @@ class Camera(AcquisitionObject):
 
   def end_processing(self, process):
     if process['mode'] == 'DLC':
-      process['DLCLive'].close()
-      process['frame0'] = False
+      self.parent.poses.unsubscribe(self)
       status = 'DLC Live turned off'
     else:
       status = process['calibrator'].save_temp_config(
@@ -126,17 +144,17 @@ class Camera(AcquisitionObject):
     # TODO:status should be put on the screen!
     return status
 
+  def open_dlc(self, model_path):
+    from dlclive import DLCLive, Processor  # only needed when DLC Live is switched on
+    return DLCLive(
+        model_path=model_path,
+        processor=Processor(),
+        display=False,
+        resize=DLC_RESIZE,
+        dynamic=(True,0.7,40))
+
   def do_process(self, data, data_count, process):
-    if process['mode'] == 'DLC':
-      process['frame_num'] = process['frame_num'] + 1
-      if process['frame0']:
-        process['DLCLive'].init_inference(frame=data)
-        process['frame0'] = False
-        pose = process['DLCLive'].get_pose(data)
-        return pose, process
-      else:
-        return process['DLCLive'].get_pose(data), None
-    elif process['mode'] == 'intrinsic':
+    if process['mode'] == 'intrinsic':
       result = process['calibrator'].in_calibrate(
           data, data_count, self.device_serial_number)
       return result, None
@@ -154,75 +172,147 @@ class Camera(AcquisitionObject):
       return  # only 1 runner at a time
 
     self._has_runner = True
+    self._last_capture = None
     data = self.new_data
     capture = self.capture(data)
     data_time = time.time() - self.run_interval
 
     while True:
-      self.sleep(data_time)
+      if not self.capture_blocks:
+        self.sleep(data_time)
 
       with self._running_lock:
         # try to capture the next data segment
         if self._running:
           data_time = time.time()
-          data = next(capture)
+          data, info = next(capture)
         else:
           self._has_runner = False
           return
 
       # check if the data chunk is emtpy or not
       if len(data)>0:
+        self.observe_capture(len(data))
         # save the current data to temp
         with self._file_lock:
           if self._file is not None:
-            self.save(data)
+            start = time.perf_counter()
+            self.save(data, info)
+            self.metrics.observe('save', time.perf_counter() - start)
 
-        # buffer the current data
+        # buffer the current data; the ring keeps a reference to the frame, nothing is copied
         self.data = data[-1]
+        for frame in data:
+          frame.release()  # the writer and the ring hold on to what they still need
 
   def capture(self, data):
+    # every frame is copied exactly once, from the driver's buffer into a recycled PooledFrame; from there
+    # it is only passed by reference, to the writer (save), the display ring (self.data) and back to the pool
+    pool = FramePool(self.writer_depth + RING_SLOTS + FRAME_BUFFER + 2, (self.height, self.width), np.uint8,
+                     FRAME_INDEX_DTYPE)
+    data_list = []
+    info_list = []
     while True:
       get_all = False
-      data_list = []
+      data_list.clear()  # the runner is done with the previous batch by the time it asks for the next one
+      info_list.clear()
       while not get_all and len(data_list)<FRAME_BUFFER:
+        frame = pool.acquire(timeout=POOL_TIMEOUT)
+        if frame is None:
+          self.metrics.count('pool exhausted')  # every frame is waiting for the writer: leave the rest in the camera buffer
+          break
         try:
           im = self._spincam.GetNextImage() #TODO: add a timeout
           if im.IsIncomplete():
+            # skip the frame but keep capturing; its id still counts, so it is not also reported as dropped
             status = im.GetImageStatus()
+            self.frame_info(im)
             im.Release()
-            raise Exception(f"Image incomplete with image status {status} ...")
-          data = im.GetNDArray()
-          data_list.append(data)
+            frame.release()
+            self.metrics.count('incomplete')
+            self.print(f'Image incomplete with image status {status}, skipped')
+            continue
+          np.copyto(frame.array, im.GetNDArray())  # GetNDArray() wraps the driver's buffer, which Release() recycles
+          self.frame_info(im, frame.info)
           im.Release()
 
         except PySpin.SpinnakerException as e:
+          frame.release()
+          self.metrics.count('spinnaker errors')
           self.print(f'Error in spinnaker: {e}. Assumed innocuous.')
           get_all = True
           continue
 
-      yield data_list
+        data_list.append(frame)
+        info_list.append(frame.info)
+
+      yield data_list, info_list
+
+  def frame_info(self, im, out=None):
+    host_time = time.time()
+    if self._chunk_data:
+      chunk = im.GetChunkData()
+      frame_id, device_time = chunk.GetFrameID(), chunk.GetTimestamp()
+    else:
+      frame_id, device_time = im.GetFrameID(), im.GetTimeStamp()
+
+    if self._last_frame_id is not None and frame_id > self._last_frame_id + 1:
+      self.metrics.count('dropped', frame_id - self._last_frame_id - 1)
+    self._last_frame_id = frame_id
+    return frame_info(frame_id, device_time, host_time, out)
 
   def open_file(self, filepath):
     # path = os.path.join(filepath, f'{self.device_serial_number}.mp4')
-    self.print(f'saving camera data to {filepath}')
-    return ffmpeg \
-        .input('pipe:', format='rawvideo', pix_fmt='gray', s=f'{self.width}x{self.height}', framerate=self.run_rate) \
-        .output(filepath, vcodec='libx265') \
-        .overwrite_output() \
-        .global_args('-loglevel', 'error') \
-        .run_async(pipe_stdin=True, quiet=True)
-    # .run_async(pip_stdin=True)
+    if self.file_mode == 'raw store':
+      # no encoding while recording: AcquisitionGroup transcodes the store after stop()
+      fileObj = RawStoreWriter(raw_store_path(filepath), (self.height, self.width), np.uint8, self.run_rate)
+      self.print(f'saving raw camera frames to {fileObj.path}')
+      def write(frames):
+        for frame in frames:
+          fileObj.append(frame)
+      write_metric = 'raw write'
+    else:
+      filepath = profile_path(filepath, self.encoder_profile)
+      self.print(f'saving camera data to {filepath} with encoder profile {self.encoder_profile}')
+      fileObj = open_encoder(filepath, self.width, self.height, self.run_rate, self.encoder_profile)
+      # .run_async(pip_stdin=True)
+      # a slow write here means ffmpeg is not keeping up (pipe backpressure)
+      write, write_metric = lambda frames: write_buffers(fileObj.stdin, frames), 'pipe write'
+
+    # sidecar with the frame id / timestamps of every saved frame
+    self._frame_index = FrameIndexWriter(frame_index_path(filepath))
+
+    def write_frames(frames, infos):
+      start = time.perf_counter()
+      write(frames)
+      self.metrics.observe(write_metric, (time.perf_counter() - start) / len(frames))  # per frame, whatever the batch
+      now = time.time()
+      for info in infos:
+        self.metrics.observe('encoder lag', now - info['host_time'])  # capture to encoder input
+        self._frame_index.append(info)
+        self.metrics.count('saved')
+
+    self._writer = self.new_writer(write_frames, batch=WRITE_BATCH)
+    return fileObj
 
   def close_file(self, fileObj):
+    self._writer.close()  # flush whatever the encoder has not taken yet
+    self._writer = None
+    self._frame_index.close()
+    if isinstance(fileObj, RawStoreWriter):
+      fileObj.close()
+      return
     fileObj.stdin.close()
     # fileObj.kill()
     fileObj.wait()
     self.print('done waiting for ffmpeg')
     # TODO: figure out how to gracefully close this
 
-  def save(self, data):
-    for a in data:
-      self._file.stdin.write(a.tobytes())
+  def save(self, data, info):
+    # hand the frames to the writer thread, so an encoder stall never holds up GetNextImage()
+    # the writer keeps a reference to each frame until it is written instead of copying it
+    for frame, i in zip(data, info):
+      self._writer.submit_frame(frame, i)
 
   def get_camera_properties(self):
     nodemap_tldevice = self._spincam.GetTLDeviceNodeMap()
@@ -233,49 +323,57 @@ class Camera(AcquisitionObject):
     width = PySpin.CIntegerPtr(nodemap.GetNode('Width')).GetValue()
     return device_serial_number, height, width
 
+  def overlay(self):
+    # what predisplay() draws on the current results, as a json-friendly dict, see draw_overlay()
+    process = self.processing
+    results, results_count = self.results_and_count
+    if process is None or results is None:
+      return None
+    items = []
+    if process['mode'] == 'DLC':
+      items.append(dots_overlay(results))
+      items.append(text_overlay(f"frame number {results_count}", (50, 50), 4.0, (255, 0, 125)))
+    else:
+      items.append(text_overlay(f"Performing {process['mode']} calibration", (50, 50), 4.0, (255, 0, 125)))
+
+      if str(self.device_serial_number) != str(TOP_CAM) and process['mode'] == 'intrinsic':
+        if 'calibrator' in process.keys() and results['corners'] is not None:
+          items.append({'type': 'chessboard', 'pattern': [process['calibrator'].x, process['calibrator'].y],
+                        'corners': np.asarray(results['corners']).reshape(-1, 2).tolist(),
+                        'found': bool(results['ret'])})
+      else:
+        if len(results['corners']) != 0:
+          items.append({'type': 'markers',
+                        'corners': [np.asarray(c).reshape(4, 2).tolist() for c in results['corners']],
+                        'ids': None if results['ids'] is None else np.asarray(results['ids']).reshape(-1).tolist(),
+                        'color': 225})
+
+      if process['mode'] == 'alignment':
+        if results['allDetected']:
+          text = 'Enough corners detected! Ready to go'
+        else:
+          text = "Not enough corners! Please adjust the camera"
+        items.append(text_overlay(text, (500, 1000), 2.0, (255, 0, 255)))
+      if process['mode'] == 'extrinsic':
+        if results['ids'] is None:
+          items.append(text_overlay('Missing board or intrinsic calibration file', (500, 1000), 2.0, (255, 0, 255)))
+    # results_count is the frame the results were computed on, usually a little behind the displayed one
+    return {'results seq': results_count, 'items': items}
+
   def predisplay(self, frame):
-    # TODO: still get frame as input? but should return some kind of dictionary? or array?
-    # TODO: where does this get called from?
     # TODO: make sure text is not overlapping
-    process = self.processing
     #######
     # data_count = self.data_count
     # cv2.putText(frame,str(data_count),(50, 50),cv2.FONT_HERSHEY_PLAIN,3.0,255,2)
     # print(f'sent frame {data_count}')
     #######
-    if process is not None:
-      results = self.results
-      if results is not None:
-        if process['mode'] == 'DLC':
-          draw_dots(frame, results)
-          cv2.putText(frame, f"frame number {process['frame_num']}", (50, 50),
-                      cv2.FONT_HERSHEY_PLAIN, 4.0, (255, 0, 125), 2)
-        else:
-          cv2.putText(frame, f"Performing {process['mode']} calibration", (50, 50),
-                      cv2.FONT_HERSHEY_PLAIN, 4.0, (255, 0, 125), 2)
-
-          if str(self.device_serial_number) != str(TOP_CAM) and process['mode'] == 'intrinsic':
-            if 'calibrator' in process.keys():
-              cv2.drawChessboardCorners(
-                  frame, (process['calibrator'].x, process['calibrator'].y), results['corners'], results['ret'])
-          else:
-            if len(results['corners']) != 0:
-              cv2.aruco.drawDetectedMarkers(
-                  frame, results['corners'], results['ids'], borderColor=225)
-
-          if process['mode'] == 'alignment':
-            if results['allDetected']:
-              text = 'Enough corners detected! Ready to go'
-            else:
-              text = "Not enough corners! Please adjust the camera"
-
-            cv2.putText(frame, text, (500, 1000),
-                        cv2.FONT_HERSHEY_PLAIN, 2.0, (255, 0, 255), 2)
-          if process['mode'] == 'extrinsic':
-            if results['ids'] is None:
-              text = 'Missing board or intrinsic calibration file'
-              cv2.putText(frame, text, (500, 1000),
-                          cv2.FONT_HERSHEY_PLAIN, 2.0, (255, 0, 255), 2)
+    if not self.burn_overlays:
+      return frame  # display() sends overlay() to the clients instead
+    overlay = self.overlay()
+    if overlay is not None:
+      # the frame is a read-only view into the ring, so draw on a private copy
+      frame = frame.copy()
+      draw_overlay(frame, overlay)
     return frame #gets drawn to screen
 
 
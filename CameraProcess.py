@@ -0,0 +1,214 @@
+import multiprocessing as mp
+import queue
+import threading
+import time
+
+import numpy as np
+from drivers import PySpin
+
+from AcquisitionObject import AcquisitionObject
+from Camera import Camera, TOP_CAM
+from utils.encoder_profiles import DEFAULT_ENCODER_PROFILE
+from utils.frame_index import FRAME_INDEX_DTYPE
+from utils.metrics import Metrics
+from utils.ring_buffer import SharedFrameRing
+
+COMMAND_TIMEOUT = 30  # time in seconds to wait for a camera process to acknowledge a command
+METRICS_TIMEOUT = 1  # time in seconds a metrics snapshot waits for the camera process, e.g. behind a start
+MP_CONTEXT = mp.get_context('spawn')  # PySpin state must never be forked into a child
+
+
+def get_serial_number(spincam):
+  # readable without Init(), so the parent can enumerate cameras without opening them
+  nodemap_tldevice = spincam.GetTLDeviceNodeMap()
+  return PySpin.CStringPtr(nodemap_tldevice.GetNode('DeviceSerialNumber')).GetValue()
+
+
+class _WorkerParent:
+  # stands in for the AcquisitionGroup inside a camera process
+  def __init__(self, send):
+    self.send = send
+
+  def print(self, *args):
+    self.send(('print', ' '.join([str(arg) for arg in args])))
+
+
+def camera_worker(serial_number, frame_rate, conn):
+  # entry point of a camera process: owns the PySpin camera, captures and saves,
+  # and publishes every frame to a SharedFrameRing that the parent process reads
+  send_lock = threading.Lock()
+
+  def send(message):
+    with send_lock:
+      conn.send(message)
+
+  system = PySpin.System.GetInstance()
+  camlist = system.GetCameras()
+  index = [get_serial_number(camlist.GetByIndex(i))
+           for i in range(camlist.GetSize())].index(str(serial_number))
+  camera = Camera(_WorkerParent(send), camlist, index, frame_rate, None)
+
+  # the frame infos travel along, so the parent can match frames across cameras by frame id
+  ring = SharedFrameRing((camera.height, camera.width), np.uint8, create=True, info_dtype=FRAME_INDEX_DTYPE)
+  ring.on_publish = lambda seq: send(('seq', seq))  # wakes the parent's displayer/processor
+  camera.new_ring = lambda: ring
+  send(('ready', camera.device_serial_number, camera.height, camera.width, ring.name))
+
+  runner = None
+  while True:
+    try:
+      command = conn.recv()
+    except EOFError:
+      command = ('close',)  # the parent went away: release the camera anyway
+    if command[0] == 'start':
+      camera.encoder_profile, camera.file_mode = command[2:4]
+      camera.start(filepath=command[1], display=True)
+      runner = threading.Thread(target=camera.run, name=f'{camera.name} run')
+      runner.start()
+      send(('started',))
+    elif command[0] == 'stop':
+      camera.stop()
+      if runner is not None:
+        runner.join()
+        runner = None
+      send(('stopped',))
+    elif command[0] == 'metrics':
+      send(('metrics', camera.metrics.snapshot))
+    elif command[0] == 'close':
+      break
+
+  camera.stop()
+  del camera
+  ring.close()
+  camlist.Clear()
+  system.ReleaseInstance()
+  try:
+    send(('closed',))
+  except OSError:
+    pass
+
+
+class _ProcessMetrics(Metrics):
+  # display/processing metrics of the parent merged with the capture/save metrics of the camera process
+
+  def __init__(self, camera):
+    Metrics.__init__(self)
+    self._camera = camera
+
+  @property
+  def snapshot(self):
+    local = Metrics.snapshot.fget(self)
+    try:
+      # another command (e.g. start, which opens the encoder) may hold the pipe for a while: report
+      # the parent's metrics rather than wait for it
+      remote = self._camera.command(('metrics',), 'metrics', timeout=METRICS_TIMEOUT, lock_timeout=METRICS_TIMEOUT)[1]
+    except Exception:
+      return local
+    for key in ['counters', 'rates', 'gauges', 'histograms']:
+      local[key] = {**remote[key], **local[key]}
+    return local
+
+
+class ProcessCamera(Camera):
+  # a Camera whose capture and save loop runs in its own process, out of reach of the GIL held by
+  # display, processing and the other children. Frames come back through shared memory, so
+  # display() and run_processing() work exactly as for an in-process Camera.
+
+  def __init__(self, parent, serial_number, frame_rate, address):
+    self._conn, child_conn = MP_CONTEXT.Pipe()
+    self._replies = queue.Queue()
+    self._command_lock = threading.Lock()
+    self._process = MP_CONTEXT.Process(
+        target=camera_worker, args=(serial_number, frame_rate, child_conn), daemon=True)
+    self._process.start()
+
+    # the camera process reports the frame geometry once the camera is initialized
+    while True:
+      if not self._conn.poll(COMMAND_TIMEOUT):
+        raise Exception(f'Camera process for {serial_number} did not start')
+      message = self._conn.recv()
+      if message[0] == 'print':
+        parent.print(message[1])
+      elif message[0] == 'ready':
+        break
+    _, self.device_serial_number, self.height, self.width, ring_name = message
+    self._ring = SharedFrameRing((self.height, self.width), np.uint8, name=ring_name, info_dtype=FRAME_INDEX_DTYPE)
+
+    AcquisitionObject.__init__(
+        self, parent, frame_rate, (self.width, self.height), address)
+    self.is_top = True if self.device_serial_number == TOP_CAM else False
+    self.name = f'camera {self.device_serial_number}'
+    self.encoder_profile = DEFAULT_ENCODER_PROFILE
+    self.file_mode = 'encode'
+    self.metrics = _ProcessMetrics(self)
+
+    self._listener = threading.Thread(target=self._listen, daemon=True)
+    self._listener.start()
+
+  def _listen(self):
+    while True:
+      try:
+        message = self._conn.recv()
+      except (EOFError, OSError):
+        return
+      if message[0] == 'seq':
+        with self._data_lock:
+          self._data_cond.notify_all()
+      elif message[0] == 'print':
+        self.print(message[1])
+      else:
+        self._replies.put(message)
+        if message[0] == 'closed':
+          return
+
+  def command(self, command, reply, timeout=COMMAND_TIMEOUT, lock_timeout=None):
+    # lock_timeout: longest wait for a command already in flight, None waits for as long as it takes
+    if not self._command_lock.acquire(timeout=-1 if lock_timeout is None else lock_timeout):
+      raise Exception(f'Camera process {self.device_serial_number} is busy, {command[0]} not sent')
+    try:
+      self._conn.send(command)
+      deadline = time.time() + timeout
+      while True:
+        try:
+          message = self._replies.get(timeout=max(deadline - time.time(), 0))
+        except queue.Empty:
+          raise Exception(f'Camera process {self.device_serial_number} did not reply to {command[0]}')
+        if message[0] == reply:
+          return message
+        # a reply left over from a command that timed out earlier
+    finally:
+      self._command_lock.release()
+
+  def new_ring(self):
+    return self._ring
+
+  def open_file(self, filepath):
+    # the camera process opens the encoder; here we only remember where it goes
+    return filepath
+
+  def close_file(self, fileObj):
+    pass
+
+  def prepare_run(self):
+    self.command(('start', self.filepath, self.encoder_profile, self.file_mode), 'started')
+
+  def end_run(self):
+    self.command(('stop',), 'stopped')
+
+  def run(self):
+    # capture happens in the camera process, so just block until we are stopped
+    if self._has_runner:
+      return
+    self._has_runner = True
+    with self._running_cond:
+      self._running_cond.wait_for(lambda: not self._running)
+    self._has_runner = False
+
+  def close(self):
+    if self._process.is_alive():
+      self.command(('close',), 'closed')
+    self._process.join()
+    self._ring.close()
+
+  def __del__(self):
+    AcquisitionObject.__del__(self)
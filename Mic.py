@@ -1,10 +1,13 @@
 import numpy as np
 from AcquisitionObject import AcquisitionObject
-import pyaudio
-import nptdms
-from scipy import signal, interpolate
+from drivers import pyaudio
 import scipy.io.wavfile as wavfile
 from utils.audio_processing import read_audio
+from utils.audio_pyramid import AudioPyramidWriter, pyramid_path
+from utils.audio_writer import AudioWriter, audio_path
+from utils.ring_buffer import ChunkRing
+from utils.spectrogram import spectrogram_from_settings
+import threading
 import time
 
 BUFFER_TIME = .005  # time in seconds allowed for overhead
@@ -12,6 +15,8 @@ AUDIO_INPUT_CHANNEL = 'Dev1/ai2'
 CHANNEL_NAME = 'channel_0'
 N_CHANNELS = 1
 DUTY_CYCLE = .01  # the fraction of time with the trigger high
+WRITE_BATCH = 8  # queued callbacks handed to the audio file at once
+CHUNK_SLOTS = 64  # callbacks the ring holds before the callback has to drop chunks
 
 
 class Mic(AcquisitionObject):
@@ -25,6 +30,12 @@ class Mic(AcquisitionObject):
     self.format = pyaudio.paFloat32
     self.index = None
     self.stream = None
+    self.file_format = 'tdms'  # see utils/audio_writer.py, takes effect with the next recording
+    self._audio_file = None
+    self._pyramid = None  # browsable summary of the recording, see utils/audio_pyramid.py
+    self._chunks = None  # ChunkRing filled by the PortAudio callback, emptied by run()
+    self._chunk_ready = threading.Event()  # set by the callback after each push, and by end_run()
+    self._stream_stopped = False  # set by end_run() once the callback can no longer push
 
     AcquisitionObject.__init__(
         self, parent, self.run_rate, int(self.sample_rate // self.run_rate), address)
@@ -39,36 +50,16 @@ class Mic(AcquisitionObject):
     self.duty_cycle = DUTY_CYCLE
 
   def parse_settings(self, audio_settings):
-    self._nfft = int(audio_settings['frequency resolution'].current)
-    self._window = int(
-        audio_settings['pixel duration'].current * self.sample_rate)
-    self._overlap = int(
-        audio_settings['pixel fractional overlap'].current * self._window)
     self.run_rate = audio_settings['read rate'].current
-
-    _, _, spectrogram = signal.spectrogram(
-        np.zeros((int(self.sample_rate // self.run_rate),)), self.sample_rate, nperseg=self._window,
-        noverlap=self._overlap)
-
-    self._nx = spectrogram.shape[1]
-
-    self._xq = np.linspace(0, 1, num=self._nx)
-    self._yq = np.linspace(0, int(self.sample_rate / 2),
-                           num=int(self._window / 2 + 1))
-
-    if audio_settings['log scaling'].current:
-      self._zq = np.logspace(int(np.log10(audio_settings['minimum frequency'].current)), int(
-          np.log10(audio_settings['maximum frequency'].current)), num=int(audio_settings['frequency resolution'].current))
-    else:
-      self._zq = np.linspace(int(np.log10(audio_settings['minimum frequency'].current)), int(
-          audio_settings['maximum frequency'].current),
-          num=int(audio_settings['frequency resolution'].current))
-
-    self._freq_correct = audio_settings['noise correction'].current
-    self.print(f'_nx is {self._nx} and _nfft is {self._nfft}')
+    # replaced as a whole, so the displayer never uses half of an update
+    self._spectrogram = spectrogram_from_settings(self.sample_rate, self.run_rate, audio_settings, flip=True)
+    self.print(f'spectrogram of {len(self._spectrogram.frequencies)} x {self._spectrogram.columns} pixels')
 
   def start(self, filepath=None, display=False):
     if self.index is not None:
+      self._chunks = ChunkRing(CHUNK_SLOTS, int(self.sample_rate // self.run_rate) * self.channels)
+      self._chunk_ready.clear()
+      self._stream_stopped = False
       self.stream = self.audio.open(format=self.format,
                                     channels=self.channels,
                                     input_device_index=self.index,
@@ -93,61 +84,76 @@ class Mic(AcquisitionObject):
           return
       self._has_runner = True
       self.stream.start_stream()
-      data_time = time.time() - self.run_interval
+      # the PortAudio callback only queues the chunks; publishing and saving them happens here
+      dropped = 0
       while True:
-          self.sleep(data_time)
-          with self._running_lock:
-              # try to capture the next data segment
-              if not self._running:
-                  self._has_runner = False
-                  return
+          self._chunk_ready.clear()  # before pop(), so a chunk pushed after it sets the event again
+          chunk = self._chunks.pop()
+          if chunk is None:
+              if self._stream_stopped:  # end_run() has stopped the stream, so nothing is pushed after this
+                  break
+              self._chunk_ready.wait()  # woken by the callback as soon as a chunk is in
+              continue
+          self.handle_chunk(*chunk)
+          self._chunks.release()
+          if self._chunks.dropped != dropped:
+              self.metrics.count('ring overflow', self._chunks.dropped - dropped)
+              dropped = self._chunks.dropped
+          self.metrics.gauge('ring queued', self._chunks.queued)
+      self._has_runner = False
 
   def capture_chunk(self, in_data, frame_count, time_info, status):
-    self.data = np.fromstring(in_data, dtype=np.float32)
-    if self._has_runner:
-      data_chunk = nptdms.ChannelObject(self.group_name,
-                                        self.channel_name,
-                                        self.data,
-                                        properties={})
-
-      if self.filepath is not None:
-        with nptdms.TdmsWriter(self.filepath, 'a') as writer:
-          writer.write_segment([data_chunk])
-
-    return (self.data, pyaudio.paContinue)
+    # runs on PortAudio's thread: no allocations, no file access, and no lock but the Event's, which
+    # is only ever held for a moment
+    self._chunks.push(np.frombuffer(in_data, dtype=np.float32), status)
+    self._chunk_ready.set()
+    return (None, pyaudio.paContinue)
+
+  def handle_chunk(self, data, capture_time, status):
+    self.observe_capture(now=capture_time)
+    if status & pyaudio.paInputOverflow:
+      self.metrics.count('input overflow')
+    self.data = data  # copied into the display ring
+    with self._file_lock:
+      if self._file is not None:
+        self.save(data)
+
+  def open_file(self, filepath):
+    # one file for the whole recording, written in segments on the writer thread
+    self._audio_file = AudioWriter(audio_path(filepath, self.file_format), self.file_format, self.sample_rate,
+                                   self.channels, self.group_name, self.channel_name)
+    self._pyramid = AudioPyramidWriter(pyramid_path(filepath), self.sample_rate)
+    self._writer = self.new_writer(self.write_chunks, batch=WRITE_BATCH)
+    return filepath
+
+  def save(self, data):
+    # only queues the chunk; the file write happens on the writer thread, outside the audio callback
+    self._writer.submit(data)
+
+  def write_chunks(self, chunks, infos):
+    start = time.perf_counter()
+    for data in chunks:
+      self._audio_file.write(data)
+      self._pyramid.write(data.reshape(-1, self.channels)[:, 0])
+    self.metrics.observe('save', time.perf_counter() - start)
+
+  def close_file(self, fileObj):
+    self._writer.close()
+    self._writer = None
+    self._audio_file.close()
+    self._audio_file = None
+    self._pyramid.close()
+    self._pyramid = None
+
+  @property
+  def display_reshaped(self):
+    return super().display_reshaped or self._spectrogram.reshapes
 
   def predisplay(self, data):
     '''
-    Calculate the spectrogram of the data and send to connected browsers.
-    There are many ways to approach this, in particular by using wavelets or by using
-    overlapping FFTs. For now just trying non-overlapping FFTs ~ the simplest approach.
+    Spectrogram of the newest chunks, continued from the previous chunk, see utils/spectrogram.py
     '''
-
-
-    _, _, spectrogram = signal.spectrogram(
-        self.data, self.sample_rate, nperseg=self._window, noverlap=self._overlap)
-
-    #self.print(self._xq.shape, self._yq.shape,
-    #          spectrogram.shape, self._zq.shape)
-    interpSpect = interpolate.RectBivariateSpline(
-        self._yq, self._xq, spectrogram)(self._zq, self._xq)  # TODO: try linear instead of spline, univariate instead of bivariate
-
-    if self._freq_correct:
-      interpSpect *= self._zq[:, np.newaxis]
-      # corrects for 1/f noise by multiplying with f
-
-    thisMin = np.amin(interpSpect, axis=(0, 1))
-    interpSpect -= thisMin
-
-    thisMax = np.amax(interpSpect, axis=(0, 1))
-
-    if thisMax > 0:
-      interpSpect /= thisMax  # normalized to [0,1]
-
-    # interpSpect = mpl.cm.viridis(interpSpect) * 255  # colormap
-    interpSpect = interpSpect * 255  # TODO: decide how to handle colormapping?
-    interpSpect=np.flipud(interpSpect)
-    return interpSpect.astype(np.uint8)
+    return self._spectrogram.push(data, self.display_count)
 
   def end_run(self):
     self.print('starting end run for mic')
@@ -155,6 +161,8 @@ class Mic(AcquisitionObject):
     self.stream.close()
     # self.audio.terminate()
     self.stream = None
+    self._stream_stopped = True  # stop_stream() waits for a callback in progress, so no more pushes
+    self._chunk_ready.set()
     '''
     if self.filepath:
       self.print('reading audio')
@@ -168,5 +176,3 @@ class Mic(AcquisitionObject):
 
   def close(self):
     self.audio.terminate()
-
-#TODO: close_file(self) ???
\ No newline at end of file
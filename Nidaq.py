@@ -1,32 +1,48 @@
+import time
+
 import numpy as np
-from scipy import signal, interpolate
 
-import nidaqmx
-from nidaqmx.stream_readers import AnalogSingleChannelReader as AnalogReader
+from drivers import nidaqmx, AnalogSingleChannelReader as AnalogReader
 from AcquisitionObject import AcquisitionObject
+from utils.frame_pool import FramePool
+from utils.ring_buffer import RING_SLOTS
 import scipy.io.wavfile as wavfile
 from utils.audio_processing import read_audio
+from utils.spectrogram import spectrogram_from_settings
+from utils.call_detector import CallDetector
+from utils.audio_pyramid import AudioPyramidWriter, pyramid_path
 # import RigStatus
 
 AUDIO_INPUT_CHANNEL = 'Dev1/ai1'
 AUDIO_INPUT_GAIN = 1e4
 PC_BUFFER_TIME_IN_SECONDS = 60  # buffer before python
+READ_BUFFERS = 2  # chunks being read or handed to the ring, on top of the RING_SLOTS the ring holds
 DUTY_CYCLE = .01  # the fraction of time with the trigger high
+WRITE_BATCH = 4  # queued chunks added to the pyramid at once
 TRIGGER_OUTPUT_CHANNEL = 'Dev1/ctr0'
+# published with every chunk: the index of its first sample on the DAQ's sample clock (0 is the first
+# sample of the run) and the host time its read returned
+CHUNK_INFO_DTYPE = np.dtype([('sample', np.int64), ('host_time', np.float64)])
 
 
 class Nidaq(AcquisitionObject):
+  capture_blocks = True  # read_many_sample() waits until the whole chunk is available
   # def __init__(self, frame_rate, audio_settings):
     # Nidaq(status['frame_rate'].current, status['sample frequency'].current,
     #  status['read rate'].current, status['spectrogram'].current)
-  def __init__(self, parent, frame_rate, sample_rate, spectrogram_settings, address):
+  def __init__(self, parent, frame_rate, sample_rate, spectrogram_settings, address, read_time=None):
+    # read_time is the duration of each read from the DAQ in seconds; by default one chunk per
+    # spectrogram image (1 / read rate). The spectrogram keeps its width either way
 
     self.sample_rate = int(sample_rate)
     self.parent = parent
     self.parse_settings(spectrogram_settings)
 
-    AcquisitionObject.__init__(
-        self, parent, self.run_rate, (int(self.sample_rate // self.run_rate), 1), address)
+    if read_time is None:
+      chunk = int(self.sample_rate // spectrogram_settings['read rate'].current)
+    else:
+      chunk = int(self.sample_rate * read_time)
+    AcquisitionObject.__init__(self, parent, self.sample_rate / chunk, (chunk, 1), address)
 
     # TODO: verify that we are not violating the task state model: https://zone.ni.com/reference/en-XX/help/370466AH-01/mxcncpts/taskstatemodel/
     # specifically, if we change logging mode, do we need to re-commit the task??
@@ -58,50 +74,43 @@ class Nidaq(AcquisitionObject):
     self.trigger_task.control(nidaqmx.constants.TaskMode.TASK_COMMIT)
 
     self._log_mode = [False, False]  # [isLogging, isDisplaying]
+    self._pyramid = None  # browsable summary of the recording, see utils/audio_pyramid.py
+    self._writer = None  # feeds the pyramid on its own thread, see save()
     # self._filepath = ''
 
   def parse_settings(self, spectrogram_settings):
-    self._nfft = int(spectrogram_settings['frequency resolution'].current)
-    self._window = int(
-        spectrogram_settings['pixel duration'].current * self.sample_rate)
-    self._overlap = int(
-        spectrogram_settings['pixel fractional overlap'].current * self._window)
-    self.run_rate = spectrogram_settings['read rate'].current
-
-    _, _, spectrogram = signal.spectrogram(
-        np.zeros((int(self.sample_rate // self.run_rate),)), self.sample_rate, nperseg=self._window, noverlap=self._overlap)
-    self._nx = spectrogram.shape[1]
-    # self._nx = int(np.round(np.floor(self.sample_rate-self._overlap) /
-    #                         (self._window-self._overlap) / self.run_rate))
-    self._xq = np.linspace(0, 1, num=self._nx)
-    self._yq = np.linspace(0, int(self.sample_rate/2),
-                           num=int(self._window/2 + 1))
-    if spectrogram_settings['log scaling'].current:
-      self._zq = np.logspace(int(np.log10(spectrogram_settings['minimum frequency'].current)), int(
-          np.log10(spectrogram_settings['maximum frequency'].current)), num=int(spectrogram_settings['frequency resolution'].current))
-    else:
-      self._zq = np.linspace(int(spectrogram_settings['minimum frequency'].current), int(
-          spectrogram_settings['maximum frequency'].current), num=int(spectrogram_settings['frequency resolution'].current))
-
-    self._freq_correct = spectrogram_settings['noise correction'].current
-    self.print(f'_nx is {self._nx} and _nfft is {self._nfft}')
+    # replaced as a whole, so the displayer never uses half of an update
+    self._spectrogram = spectrogram_from_settings(
+        self.sample_rate, spectrogram_settings['read rate'].current, spectrogram_settings)
+    self.print(f'spectrogram of {len(self._spectrogram.frequencies)} x {self._spectrogram.columns} pixels')
 
   def open_file(self, filePath):
     self._log_mode[0] = True
     # NOTE: whatever we return here becomes self.file
     # return os.path.join(filePath, 'nidaq.tdms')
     self.print(f'Saving nidaq data to {filePath}')
+    # DAQmx logs the samples itself; the runner only adds the pyramid, see save()
+    self._pyramid = AudioPyramidWriter(pyramid_path(filePath), self.sample_rate)
+    self._writer = self.new_writer(self.write_pyramid, batch=WRITE_BATCH)
     return filePath
 
+  def save(self, data):
+    # only copies the chunk into the writer's queue; its FFTs run on the writer thread, off the DAQ reads
+    self._writer.submit(data.array[:, 0])
+
+  def write_pyramid(self, chunks, infos):
+    start = time.perf_counter()
+    for data in chunks:
+      self._pyramid.write(data)
+    self.metrics.observe('save', time.perf_counter() - start)
+
   def prepare_display(self):
     self._log_mode[1] = True
 
   def prepare_run(self):
     if self._log_mode[0]:
-      if self._log_mode[1]:
-        log_mode = nidaqmx.constants.LoggingMode.LOG_AND_READ
-      else:
-        log_mode = nidaqmx.constants.LoggingMode.LOG
+      # run() always reads, so plain LOG (which forbids reads) would kill the runner thread
+      log_mode = nidaqmx.constants.LoggingMode.LOG_AND_READ
     else:
       log_mode = nidaqmx.constants.LoggingMode.OFF
 
@@ -116,44 +125,66 @@ class Nidaq(AcquisitionObject):
     self.print('audio on')
 
   def prepare_processing(self, options):
-    # in the future if we use deepsqueak for real-time annotation, we would set up for that here
-    pass
+    # live call detection on the incoming audio, see utils/call_detector.py
+    return {**options, 'detector': CallDetector(self.sample_rate)}
+
+  def do_process(self, data, data_count, process):
+    info = self.data_info(data_count)
+    if info is None:
+      self.metrics.count('detection lapped')  # overwritten while being read: its sample index is gone
+      return [], None
+    start_sample = int(info['sample'])
+    next_sample = process['detector'].next_sample
+    if next_sample is not None and start_sample > next_sample:
+      # chunks the detector never saw, e.g. while processing fell behind; it ends any call in progress
+      self.metrics.count('detection skipped', (start_sample - next_sample) // self.data_size[0])
+    events = process['detector'].process(data[:, 0], start_sample)
+    self.log_calls(events, info)
+    return events, None
+
+  def log_calls(self, events, info=None):
+    # adds the host time of each event, estimated from when the read of its chunk (info) returned,
+    # and hands them to the group's event log (the GUI and, while recording, the session's events.jsonl)
+    for event in events:
+      if info is not None:
+        chunk_end = int(info['sample']) + self.data_size[0]
+        event['host time'] = float(info['host_time']) - (chunk_end - event['sample']) / self.sample_rate
+      self.parent.events.append({'source': self.name, **event})
+      if event['event'] == 'call offset':
+        self.metrics.count('calls')
 
   def capture(self, data):
+    # every chunk is read straight into a recycled PooledFrame and passed on by reference: the ring
+    # holds the chunks that the display and processing threads may be looking at, and a chunk only
+    # goes back to the pool (to be read into again) once the ring has lapped it
+    pool = FramePool(RING_SLOTS + READ_BUFFERS, self.data_size, np.float64, CHUNK_INFO_DTYPE)
+    in_stream = self.audio_task.in_stream
+    sample = 0
     while True:
+      frame = pool.acquire()  # never waits: nothing but the ring holds on to chunks
+      # what is waiting in the DAQ's buffer before this read; once it nears input_buf_size
+      # (PC_BUFFER_TIME_IN_SECONDS) the driver starts overwriting samples we have not read
+      available = in_stream.avail_samp_per_chan
+      self.metrics.gauge('daq backlog', available / self.sample_rate)
+      self.metrics.gauge('daq buffer fill', available / in_stream.input_buf_size)
       self._audio_reader.read_many_sample(
-          data[:, 0],
+          frame.array[:, 0],
           number_of_samples_per_channel=self.data_size[0]
       )
-      yield data
+      frame.info['sample'] = sample
+      frame.info['host_time'] = time.time()
+      sample += self.data_size[0]
+      yield frame
+
+  @property
+  def display_reshaped(self):
+    return super().display_reshaped or self._spectrogram.reshapes
 
   def predisplay(self, data):
     '''
-    Calculate the spectrogram of the data and send to connected browsers.
-    There are many ways to approach this, in particular by using wavelets or by using
-    overlapping FFTs. For now just trying non-overlapping FFTs ~ the simplest approach.
+    Spectrogram of the newest chunks, continued from the previous chunk, see utils/spectrogram.py
     '''
-    _, _, spectrogram = signal.spectrogram(
-        data[:, 0], self.sample_rate, nperseg=self._window, noverlap=self._overlap)
-
-    # print(self._xq.shape, self._yq.shape, spectrogram.shape, self._zq.shape)
-    interpSpect = interpolate.RectBivariateSpline(
-        self._yq, self._xq, spectrogram)(self._zq, self._xq)  # TODO: try linear instead of spline, univariate instead of bivariate
-
-    if self._freq_correct:
-      interpSpect *= self._zq[:, np.newaxis]
-      # corrects for 1/f noise by multiplying with f
-
-    thisMin = np.amin(interpSpect, axis=(0, 1))
-    interpSpect -= thisMin
-
-    thisMax = np.amax(interpSpect, axis=(0, 1))
-    if thisMax != 0:
-      interpSpect /= thisMax  # normalized to [0,1]
-
-    # interpSpect = mpl.cm.viridis(interpSpect) * 255  # colormap
-    interpSpect = interpSpect * 255  # TODO: decide how to handle colormapping?
-    return interpSpect
+    return self._spectrogram.push(data[:, 0], self.display_count)
 
   def end_run(self):
     self.audio_task.stop()
@@ -172,7 +203,10 @@ class Nidaq(AcquisitionObject):
   def close_file(self, fileObj):
     self._log_mode[0] = False
     self._filepath = ''
+    self._writer.close()
+    self._writer = None
+    self._pyramid.close()
+    self._pyramid = None
 
   def end_processing(self, process):
-    # in the future we would teardown deepsqueak here
-    pass
+    self.log_calls(process['detector'].close())
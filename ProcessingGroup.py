@@ -387,11 +387,11 @@ class ProcessingGroup:
 	def audio_processing(self):
 		BK_filepath=os.path.join(self.rootpath,'B&K_audio.tdms')
 		dodo_filepath=os.path.join(self.rootpath, 'dodo_audio.tdms')
-		BK_audio=read_audio(BK_filepath)
-		dodo_audio=read_audio(os.path.join(dodo_filepath))
-
-		wavfile.write(BK_filepath[:-4] + 'wav', int(sample_rate), BK_audio[0])
-		wavfile.write(dodo_filepath[:-4] + 'wav', int(sample_rate), dodo_audio[0])
+		# the mic may have recorded straight to wav or flac (see utils/audio_writer.py), then there is no tdms to convert
+		for filepath in (BK_filepath, dodo_filepath):
+			if os.path.exists(filepath):
+				audio=read_audio(filepath)
+				wavfile.write(filepath[:-4] + 'wav', int(sample_rate), audio[0])
 		print("saved audio file")
 
 	def dsqk_analysis(self):
@@ -0,0 +1,112 @@
+'''
+Frame-sized allocations and time per frame on the capture path, before and after the frame pool.
+
+Both paths take a simulated camera's images and run them through what Camera does with every frame:
+hand it to the writer, write it to the encoder pipe (here /dev/null) and publish it for display.
+The legacy path is Camera as it was before utils/frame_pool.py: a list of GetNDArray() arrays per
+batch, a copy into the AsyncWriter's buffer, a tobytes() copy for the pipe and a copy into the ring.
+The pooled path copies the driver's buffer into a PooledFrame once, writes it with write_buffers()
+and hands the same frame to the ring.
+
+The steps run synchronously (the writer thread's work inline) so tracemalloc can attribute every
+allocation to the frame that caused it: the peak growth of traced memory while one frame goes
+through, in frames. Time per frame is measured in a second pass without tracing. The trigger runs
+far faster than the loop, so the camera never waits and the time is the cost of the path itself.
+
+usage: python -m benchmarks.capture_allocations [width] [height] [frames]
+'''
+import os
+import sys
+import time
+import tracemalloc
+
+os.environ['BEHAVIOR_RIG_SIMULATE'] = '1'
+
+import numpy as np
+
+from drivers import PySpin, sim_clock
+from utils.ring_buffer import FrameRing
+from utils.writer import write_buffers
+
+TRIGGER_RATE = 1e5  # Hz, far beyond what the loop can take
+PORT = 5095
+
+
+class _Parent:
+  def print(self, *args):
+    pass
+
+
+def legacy_path(camera, out):
+  # Camera.capture/run/save/open_file before the frame pool
+  from Camera import FRAME_BUFFER
+  buffers = [np.empty((camera.height, camera.width), np.uint8) for _ in range(FRAME_BUFFER)]  # AsyncWriter's
+  ring = FrameRing()
+  while True:
+    data_list = []
+    info_list = []
+    while len(data_list) < FRAME_BUFFER:
+      im = camera._spincam.GetNextImage()
+      data_list.append(im.GetNDArray())
+      info_list.append(camera.frame_info(im))
+      im.Release()
+    ring.write(data_list[-1])  # self.data = data[-1]
+    for buffer, data in zip(buffers, data_list):
+      np.copyto(buffer, data)  # AsyncWriter.submit
+      out.write(buffer.tobytes())  # write_frame
+      yield 1
+
+
+def pooled_path(camera, out):
+  ring = FrameRing()
+  capture = camera.capture(None)
+  while True:
+    data, info = next(capture)
+    ring.put(data[-1])
+    for frame in data:
+      write_buffers(out, [frame.array])  # the writer thread's write_frames
+      frame.release()
+      yield 1
+
+
+def measure(path, camera, n_frames):
+  with open(os.devnull, 'wb') as out:
+    steps = path(camera, out)
+    next(steps)  # warm up: first allocations of pools, rings and buffers
+    frame_bytes = camera.width * camera.height
+    tracemalloc.start()
+    allocated = frames = 0
+    while frames < n_frames:
+      tracemalloc.reset_peak()
+      before, _ = tracemalloc.get_traced_memory()
+      frames += next(steps)
+      _, peak = tracemalloc.get_traced_memory()
+      allocated += peak - before
+    tracemalloc.stop()
+
+    start = time.perf_counter()
+    frames = 0
+    while frames < n_frames:
+      frames += next(steps)
+    seconds = time.perf_counter() - start
+  return allocated / frames / frame_bytes, seconds / frames
+
+
+if __name__ == '__main__':
+  width = int(sys.argv[1]) if len(sys.argv) > 1 else 1280
+  height = int(sys.argv[2]) if len(sys.argv) > 2 else 1024
+  n_frames = int(sys.argv[3]) if len(sys.argv) > 3 else 300
+  sim_clock.configure(camera_serials=sim_clock.settings['camera serials'][:1], width=width, height=height)
+  sim_clock.trigger.arm(TRIGGER_RATE)
+  sim_clock.trigger.start()
+
+  from Camera import Camera
+  system = PySpin.System.GetInstance()
+  camera = Camera(_Parent(), system.GetCameras(), 0, 30, ('localhost', PORT))
+  camera.prepare_run()
+  camera._running = True
+  for name, path in [('legacy', legacy_path), ('pooled', pooled_path)]:
+    frames_allocated, seconds = measure(path, camera, n_frames)
+    print(f'{name:>7}: {frames_allocated:5.2f} frame-sized allocations per frame, {seconds * 1e3:6.2f} ms per frame')
+  camera.end_run()
+  sim_clock.trigger.stop()
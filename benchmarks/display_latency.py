@@ -0,0 +1,123 @@
+'''
+Capture-to-display latency of the event driven display loop versus the old sleep-polling loop.
+
+A synthetic AcquisitionObject publishes a small frame at the camera frame rate, stamped with its
+capture time, and a local TCP client is connected so that display() actually sends. The latency
+is measured in predisplay(), i.e. the moment the displayer picks the frame up.
+
+usage: python -m benchmarks.display_latency [frame rate] [seconds]
+'''
+import socket
+import sys
+import threading
+import time
+
+import numpy as np
+
+from AcquisitionObject import AcquisitionObject
+from utils.tcp_utils import getConnections, sendData
+
+HOST = 'localhost'
+PORT = 5090
+
+
+class _Parent:
+  def print(self, *args):
+    print(*args)
+
+
+class SyntheticObject(AcquisitionObject):
+  capture_blocks = True  # capture() sleeps like a hardware trigger would
+
+  def __init__(self, frame_rate, address):
+    AcquisitionObject.__init__(self, _Parent(), frame_rate, (16,), address)
+    self.frame_rate = frame_rate
+    self.latencies = []
+
+  def capture(self, data):
+    next_time = time.time()
+    while True:
+      next_time += 1 / self.frame_rate
+      time.sleep(max(0, next_time - time.time()))
+      data[0] = time.time()
+      yield data
+
+  def predisplay(self, data):
+    self.latencies.append(time.time() - data[0])
+    return data
+
+
+class PollingObject(SyntheticObject):
+  # the sleep-polling loops as they were before wait_for_data()
+  capture_blocks = False
+
+  def __init__(self, frame_rate, address):
+    SyntheticObject.__init__(self, frame_rate, address)
+    self._recipients = []  # sendData() as it was before FrameSender
+
+  def display(self):
+    self._has_displayer = True
+    last_count = -1
+    data, data_count = self.data_and_count
+    last_data_time = time.time()
+
+    while self._data is not None:
+      if len(self._recipients) == 0:
+        self.sleep(time.time())
+        getConnections(self._sock, self._recipients, block=False)
+      else:
+        self.sleep(last_data_time)
+        data, data_count = self.data_and_count
+
+      if data_count > last_count and data is not None:
+        last_data_time = time.time()
+        last_count = data_count
+        data = self.predisplay(np.array(data))
+        sendData(data.astype(np.uint8).tobytes(), self._recipients)
+    self._has_displayer = False
+
+
+def _drain(address, stop):
+  conn = socket.create_connection(address)
+  conn.settimeout(.1)
+  while not stop.is_set():
+    try:
+      conn.recv(1 << 16)
+    except socket.timeout:
+      pass
+  conn.close()
+
+
+def measure(cls, frame_rate, duration, port):
+  obj = cls(frame_rate, (HOST, port))
+  obj.start(display=True)
+  stop = threading.Event()
+  threads = [threading.Thread(target=obj.run), threading.Thread(target=obj.display),
+             threading.Thread(target=_drain, args=((HOST, port), stop))]
+  start_cpu = time.process_time()
+  for t in threads:
+    t.start()
+  time.sleep(duration)
+  obj.stop()
+  stop.set()
+  for t in threads:
+    t.join()
+  cpu = time.process_time() - start_cpu
+
+  latencies = np.array(obj.latencies[1:]) * 1e3  # first frame waits for the client to connect
+  return {
+      'frames': len(latencies),
+      'median_ms': float(np.median(latencies)),
+      'p95_ms': float(np.percentile(latencies, 95)),
+      'max_ms': float(np.max(latencies)),
+      'cpu_s': cpu,
+  }
+
+
+if __name__ == '__main__':
+  frame_rate = float(sys.argv[1]) if len(sys.argv) > 1 else 30
+  duration = float(sys.argv[2]) if len(sys.argv) > 2 else 5
+  for i, (name, cls) in enumerate([('polling', PollingObject), ('event', SyntheticObject)]):
+    result = measure(cls, frame_rate, duration, PORT + i)
+    print(f"{name:>8}: {result['frames']} frames, median {result['median_ms']:.2f} ms, "
+          f"p95 {result['p95_ms']:.2f} ms, max {result['max_ms']:.2f} ms, cpu {result['cpu_s']:.2f} s")
@@ -0,0 +1,21 @@
+'''
+Sustainable frame rate of every encoder profile on this machine, for synthetic gray frames.
+
+This is the measurement AcquisitionGroup.benchmark_encoder() makes in the background for the
+selected profile, run for all profiles at once. With more than one stream, that many encoders run
+side by side, as they do with one encoder per camera.
+
+usage: python -m benchmarks.encoders [width] [height] [streams] [seconds]
+'''
+import sys
+
+from utils.encoder_profiles import ENCODER_PROFILES, BENCHMARK_TIME, benchmark
+
+if __name__ == '__main__':
+  width = int(sys.argv[1]) if len(sys.argv) > 1 else 1280
+  height = int(sys.argv[2]) if len(sys.argv) > 2 else 1024
+  streams = int(sys.argv[3]) if len(sys.argv) > 3 else 1
+  seconds = float(sys.argv[4]) if len(sys.argv) > 4 else BENCHMARK_TIME
+  for profile in ENCODER_PROFILES:
+    result = benchmark(profile, width, height, streams, seconds)
+    print(f"{profile:>15}: {result['fps']:7.1f} fps per stream, {result['bytes per frame'] / 1e3:7.1f} kB per frame")
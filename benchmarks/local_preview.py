@@ -0,0 +1,143 @@
+'''
+CPU cost of serving raw camera previews to a GUI on the same machine: localhost TCP (FrameSender)
+versus shared memory (utils/shared_preview.py).
+
+Four synthetic cameras publish full resolution gray frames at 30 fps the way display() does, and one
+client process reads every stream. Reported are the CPU seconds per second of both the publishing
+and the client process, and the frames the client received per stream and second.
+
+usage: python -m benchmarks.local_preview [cameras] [frame rate] [seconds] [width] [height]
+'''
+import multiprocessing
+import socket
+import sys
+import threading
+import time
+
+import numpy as np
+
+from utils.shared_preview import SharedPreviewReader, SharedPreviewWriter
+from utils.tcp_utils import FrameSender
+
+HOST = 'localhost'
+PORT = 5120
+
+
+def _names(cameras):
+  return [f'benchmark camera {i}' for i in range(cameras)]
+
+
+def _read_tcp(address, frame_bytes, stop, counts, i):
+  conn = socket.create_connection(address)
+  buffer = bytearray(frame_bytes)
+  view = memoryview(buffer)
+  received = 0
+  while not stop.is_set():
+    n = conn.recv_into(view[received:])
+    if not n:
+      break
+    received += n
+    if received == frame_bytes:
+      counts[i] += 1
+      received = 0
+  conn.close()
+
+
+def _read_shared(name, stop, counts, i):
+  reader = SharedPreviewReader(name)
+  out = None
+  last_seq = 0
+  while not stop.is_set():
+    frame = reader.wait(last_seq, timeout=.1, out=out)
+    if frame is not None:
+      last_seq, _, out = frame
+      counts[i] += 1
+  reader.close()
+
+
+def client(transport, cameras, frame_bytes, seconds, results):
+  # runs in its own process, like a GUI would
+  stop = threading.Event()
+  counts = [0] * cameras
+  if transport == 'tcp':
+    threads = [threading.Thread(target=_read_tcp, args=((HOST, PORT + i), frame_bytes, stop, counts, i))
+               for i in range(cameras)]
+  else:
+    threads = [threading.Thread(target=_read_shared, args=(name, stop, counts, i))
+               for i, name in enumerate(_names(cameras))]
+  for thread in threads:
+    thread.start()
+  time.sleep(1)  # connect and warm up
+  start_counts, start_cpu, start = list(counts), time.process_time(), time.time()
+  time.sleep(seconds)
+  elapsed = time.time() - start
+  results.put({'cpu': (time.process_time() - start_cpu) / elapsed,
+               'fps': [(c - s) / elapsed for c, s in zip(counts, start_counts)]})
+  stop.set()
+  for thread in threads:
+    thread.join()
+
+
+def publish(transport, cameras, frame_rate, seconds, width, height):
+  rng = np.random.default_rng(0)
+  frames = [rng.integers(0, 256, (height, width), dtype=np.uint8) for _ in range(4)]
+  if transport == 'tcp':
+    sockets = [socket.create_server((HOST, PORT + i), reuse_port=False) for i in range(cameras)]
+    senders = [FrameSender(name=f'sender {i}') for i in range(cameras)]
+  else:
+    writers = [SharedPreviewWriter(name) for name in _names(cameras)]
+
+  results = multiprocessing.Queue()
+  process = multiprocessing.Process(target=client, args=(transport, cameras, width * height, seconds, results))
+  process.start()
+  if transport == 'tcp':
+    for sock, sender in zip(sockets, senders):
+      sender.add(*sock.accept())
+
+  stop = threading.Event()
+
+  def camera(i):
+    seq = 0
+    next_time = time.time()
+    while not stop.is_set():
+      next_time += 1 / frame_rate
+      time.sleep(max(0, next_time - time.time()))
+      seq += 1
+      image = frames[seq % len(frames)]
+      if transport == 'tcp':
+        senders[i].send(image.tobytes())  # what display() sends for a raw preview
+      elif writers[i].has_readers:
+        writers[i].write(image, seq, time.time())
+
+  threads = [threading.Thread(target=camera, args=(i,)) for i in range(cameras)]
+  for thread in threads:
+    thread.start()
+  time.sleep(1)
+  start_cpu, start = time.process_time(), time.time()
+  result = results.get()
+  server_cpu = (time.process_time() - start_cpu) / (time.time() - start)
+  stop.set()
+  for thread in threads:
+    thread.join()
+  process.join()
+  if transport == 'tcp':
+    for sender, sock in zip(senders, sockets):
+      sender.close()
+      sock.close()
+  else:
+    for writer in writers:
+      writer.close()
+  return {'server cpu': server_cpu, 'client cpu': result['cpu'], 'fps': result['fps']}
+
+
+if __name__ == '__main__':
+  cameras = int(sys.argv[1]) if len(sys.argv) > 1 else 4
+  frame_rate = float(sys.argv[2]) if len(sys.argv) > 2 else 30
+  seconds = float(sys.argv[3]) if len(sys.argv) > 3 else 5
+  width = int(sys.argv[4]) if len(sys.argv) > 4 else 1280
+  height = int(sys.argv[5]) if len(sys.argv) > 5 else 1024
+  print(f'{cameras} x {width}x{height} @ {frame_rate:g} fps, raw previews, one local client')
+  for transport in ('tcp', 'shared memory'):
+    result = publish(transport, cameras, frame_rate, seconds, width, height)
+    print(f"{transport:>14}: publisher {result['server cpu']:.2f} cores, client {result['client cpu']:.2f} cores, "
+          f"received {', '.join(f'{fps:.1f}' for fps in result['fps'])} fps")
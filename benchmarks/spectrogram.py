@@ -0,0 +1,84 @@
+'''
+Time per chunk of the audio previews: the old predisplay() of Mic and Nidaq against utils/spectrogram.py.
+
+The old path ran scipy.signal.spectrogram on every chunk from scratch and resampled the result onto
+the display frequencies with a RectBivariateSpline built for that chunk. The new path carries the
+overlap over from the previous chunk, runs one batched real FFT and maps the bins with a sparse matrix.
+Both use the settings in initialStatus['spectrogram'] and chunks of white noise with a frequency sweep.
+
+Also reported is how closely the two images agree (correlation of their pixels) for one chunk, and
+the cost and bytes per chunk of the scrolling mode, which sends only the new columns.
+
+usage: python -m benchmarks.spectrogram [sample rate] [chunks]
+'''
+import copy
+import sys
+import time
+
+import numpy as np
+from scipy import signal, interpolate
+
+from initialStatus import initialStatus
+from RigStatus import RigStatus
+from utils.spectrogram import Spectrogram, spectrogram_from_settings
+
+
+def legacy(data, sample_rate, window, overlap, yq, xq, zq):
+  # Nidaq.predisplay before utils/spectrogram.py, with noise correction
+  _, _, spectrogram = signal.spectrogram(data, sample_rate, nperseg=window, noverlap=overlap)
+  image = interpolate.RectBivariateSpline(yq, xq, spectrogram)(zq, xq)
+  image *= zq[:, np.newaxis]
+  image -= np.amin(image)
+  peak = np.amax(image)
+  if peak != 0:
+    image /= peak
+  return (image * 255).astype(np.uint8)
+
+
+if __name__ == '__main__':
+  sample_rate = int(sys.argv[1]) if len(sys.argv) > 1 else 250000
+  chunks = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+  settings = RigStatus(copy.deepcopy(initialStatus))['spectrogram'].current
+  run_rate = settings['read rate'].current
+  chunk = int(sample_rate // run_rate)
+  engine = spectrogram_from_settings(sample_rate, run_rate, settings)
+
+  window, overlap = engine.window, engine.window - engine.hop
+  _, _, spectrogram = signal.spectrogram(np.zeros(chunk), sample_rate, nperseg=window, noverlap=overlap)
+  xq = np.linspace(0, 1, num=spectrogram.shape[1])
+  yq = np.linspace(0, sample_rate // 2, num=window // 2 + 1)
+  zq = engine.frequencies
+
+  # white noise with a sweep from 20 to 45 kHz in every chunk, a little like a USV
+  rng = np.random.default_rng(0)
+  t = np.arange(chunk) / sample_rate
+  sweep = signal.chirp(t, 2e4, t[-1], 4.5e4)
+  data = [(.2 * rng.standard_normal(chunk) + sweep).astype(np.float32) for _ in range(chunks)]
+  print(f'{chunks} chunks of {chunk} samples at {sample_rate} Hz, {len(zq)} frequencies')
+
+  start = time.perf_counter()
+  for d in data:
+    old = legacy(d, sample_rate, window, overlap, yq, xq, zq)
+  old_time = (time.perf_counter() - start) / chunks
+
+  start = time.perf_counter()
+  for seq, d in enumerate(data, 1):
+    new = engine.push(d, seq)
+  new_time = (time.perf_counter() - start) / chunks
+
+  print(f'  legacy: {old_time * 1e3:7.2f} ms per chunk, image {old.shape}')
+  print(f'  engine: {new_time * 1e3:7.2f} ms per chunk, image {new.shape}')
+  columns = min(old.shape[1], new.shape[1])
+  r = np.corrcoef(old[:, -columns:].ravel(), new[:, -columns:].ravel())[0, 1]
+  print(f'  pixel correlation on the last chunk: {r:.3f}')
+
+  for colormap in ('gray', 'viridis'):
+    scrolling = Spectrogram(sample_rate, window, overlap, zq, engine.columns, freq_correct=True, scrolling=True,
+                            colormap=colormap)
+    start = time.perf_counter()
+    sent = 0
+    for seq, d in enumerate(data, 1):
+      sent += scrolling.push(d, seq).nbytes
+    scroll_time = (time.perf_counter() - start) / chunks
+    print(f'  scrolling, {colormap:>7}: {scroll_time * 1e3:5.2f} ms and {sent / chunks / 1e3:.0f} kB per chunk '
+          f'(full images: {new.nbytes / 1e3:.0f} kB)')
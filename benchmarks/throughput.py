@@ -0,0 +1,400 @@
+'''
+Sustained acquisition throughput of the whole AcquisitionGroup on the simulated drivers.
+
+Every configuration of the matrix (cameras x resolution x frame rate x encoder x display clients x
+processing x camera processes) runs in a fresh interpreter with BEHAVIOR_RIG_SIMULATE=1, records
+to a temporary directory for a fixed time and reports, per camera, the achieved capture/save/display
+rates, dropped frames and encoder lag, plus the CPU time of every thread and child process and the
+peak memory. A configuration is sustained when every camera saves at least SUSTAINED_FRACTION of its
+frame rate without dropping a frame.
+
+Results are written as JSON, together with the commit they were measured on, so that two versions
+can be compared with --compare. CPU per thread and memory are read from /proc (Linux only).
+
+usage:
+  python -m benchmarks.throughput [--cameras 1 2 4] [--resolutions 640x512 1280x1024]
+      [--frame-rates 15 30] [--encoders x265 'x264 ultrafast'] [--file-modes encode 'raw store'] [--clients 0 1] [--processing none dlc]
+      [--camera-processes 0 1] [--seconds 10] [--dlc-model PATH] [--output FILE]
+  python -m benchmarks.throughput --compare OLD.json NEW.json
+'''
+import argparse
+import copy
+import itertools
+import json
+import os
+import platform
+import resource
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import numpy as np
+
+from utils.encoder_profiles import ENCODER_PROFILES, DEFAULT_ENCODER_PROFILE
+from utils.raw_store import CAMERA_FILE_MODES
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+HOST = 'localhost'
+PORT = 5100  # first display port; each run moves up by MAX_CHILDREN to stay clear of TIME_WAIT sockets
+MAX_CHILDREN = 8
+SAMPLE_INTERVAL = .5  # seconds between metric/cpu/memory samples during a run
+WARMUP = 2  # seconds recorded before the measurement window opens
+RUN_OVERHEAD = 120  # seconds allowed for setup and teardown of a run before it is killed
+SUSTAINED_FRACTION = .99
+RESULT_PREFIX = 'THROUGHPUT RESULT '
+SIM_SERIALS = ['17391304', '17391290', '19287342', '19412282']  # the order of AcquisitionGroup.CAM_LIST
+CLOCK_TICKS = os.sysconf('SC_CLK_TCK') if hasattr(os, 'sysconf') else 100
+PAGE_SIZE = os.sysconf('SC_PAGE_SIZE') if hasattr(os, 'sysconf') else 4096
+
+
+#############
+# /proc readers
+#############
+
+def _read_stat(path):
+  # (comm, ppid, cpu seconds) from a /proc/<pid>[/task/<tid>]/stat file
+  with open(path) as f:
+    stat = f.read()
+  comm = stat[stat.index('(') + 1:stat.rindex(')')]
+  fields = stat[stat.rindex(')') + 2:].split()
+  return comm, int(fields[1]), (int(fields[11]) + int(fields[12])) / CLOCK_TICKS
+
+
+def _rss(pid):
+  with open(f'/proc/{pid}/statm') as f:
+    return int(f.read().split()[1]) * PAGE_SIZE
+
+
+def thread_cpu():
+  # cpu seconds of every live python thread of this process, by thread name
+  cpu = {}
+  for thread in threading.enumerate():
+    try:
+      seconds = _read_stat(f'/proc/self/task/{thread.native_id}/stat')[2]
+    except (OSError, TypeError):
+      continue
+    cpu[thread.name] = cpu.get(thread.name, 0) + seconds
+  return cpu
+
+
+def descendants():
+  # {pid: (comm, cpu seconds, rss bytes)} of all processes started from this one (camera processes, ffmpeg)
+  parents = {}
+  for entry in os.listdir('/proc') if os.path.isdir('/proc') else []:
+    if entry.isdigit():
+      try:
+        parents[int(entry)] = _read_stat(f'/proc/{entry}/stat')[1]
+      except OSError:
+        pass
+  found = {}
+  frontier = [os.getpid()]
+  while frontier:
+    parent = frontier.pop()
+    for pid, ppid in parents.items():
+      if ppid == parent and pid not in found:
+        try:
+          comm, _, cpu = _read_stat(f'/proc/{pid}/stat')
+          found[pid] = (comm, cpu, _rss(pid))
+        except OSError:
+          continue
+        frontier.append(pid)
+  return found
+
+
+def own_rss():
+  try:
+    return _rss('self')
+  except OSError:
+    return 0
+
+
+#############
+# one run, in its own interpreter
+#############
+
+class _Client:
+  # a display client that reads and discards everything a child sends
+  def __init__(self, address):
+    self._stop = threading.Event()
+    self._thread = threading.Thread(target=self._drain, args=(address,), name='benchmark client', daemon=True)
+    self._thread.start()
+
+  def _drain(self, address):
+    conn = socket.create_connection(address)
+    conn.settimeout(.1)
+    while not self._stop.is_set():
+      try:
+        if not conn.recv(1 << 20):
+          break
+      except socket.timeout:
+        pass
+    conn.close()
+
+  def close(self):
+    self._stop.set()
+    self._thread.join()
+
+
+def _counters(metrics, name):
+  return metrics['counters'].get(name, 0)
+
+
+def run_config(config):
+  # records one configuration and returns its result dict; must run in a fresh interpreter
+  os.environ['BEHAVIOR_RIG_SIMULATE'] = '1'
+  from drivers import sim_clock
+  width, height = config['resolution']
+  sim_clock.configure(camera_serials=SIM_SERIALS[:config['cameras']], width=width, height=height)
+
+  from AcquisitionGroup import AcquisitionGroup
+  from RigStatus import RigStatus
+  from initialStatus import initialStatus
+
+  status = copy.deepcopy(initialStatus)
+  status['frame rate']['current'] = config['frame rate']
+  ag = AcquisitionGroup(RigStatus(status), hostname=HOST, ports=config['port'],
+                        camera_processes=config['camera processes'])
+  ag.set_encoder_profile(config['encoder'])
+  ag.set_file_mode(config['file mode'])
+
+  directory = tempfile.mkdtemp(prefix='throughput_')
+  filepaths = [os.path.join(directory, f'{camera.device_serial_number}.MOV') for camera in ag.cameras]
+  filepaths += [os.path.join(directory, 'mic.tdms'), os.path.join(directory, 'nidaq.tdms')]
+  ag.start(filepaths=filepaths)
+  ag.run()
+
+  clients = [_Client(camera.address) for camera in ag.cameras for _ in range(config['clients'])]
+  if config['processing'] == 'dlc':
+    for i in range(len(ag.cameras)):
+      ag.process(i, {'mode': 'DLC', 'modelpath': config['dlc model']})
+
+  time.sleep(WARMUP)
+  samples = []
+  start_cpu, start_children = thread_cpu(), descendants()
+  window_end = time.time() + config['seconds']
+  while True:
+    samples.append({'time': time.time(), 'metrics': ag.metrics,
+                    'rss': own_rss() + sum(rss for _, _, rss in descendants().values())})
+    if samples[-1]['time'] >= window_end:
+      break
+    time.sleep(min(SAMPLE_INTERVAL, max(window_end - time.time(), 0)))
+  end_cpu, end_children = thread_cpu(), descendants()
+
+  stop_start = time.time()
+  for client in clients:
+    client.close()
+  ag.stop()
+  drain_time = time.time() - stop_start
+  final = ag.metrics
+  transcode_start = time.time()
+  ag.transcoder.wait()
+  transcode_time = time.time() - transcode_start
+  for camera in ag.cameras:
+    if hasattr(camera, '_process'):
+      camera.close()
+  shutil.rmtree(directory, ignore_errors=True)
+
+  window = samples[-1]['time'] - samples[0]['time']
+  first, last = samples[0]['metrics'], samples[-1]['metrics']
+  cameras = {}
+  for camera in ag.cameras:
+    name = camera.name
+
+    def rate(counter):
+      return (_counters(last[name], counter) - _counters(first[name], counter)) / window
+
+    lag = final[name]['histograms'].get('encoder lag', {'count': 0})
+    cameras[name] = {
+        'capture fps': rate('captured'),
+        'save fps': rate('saved'),
+        'display fps': rate('displayed'),
+        'process fps': rate('processed'),
+        'dropped': _counters(final[name], 'dropped'),
+        'incomplete': _counters(final[name], 'incomplete'),
+        'writer dropped': _counters(final[name], 'writer dropped'),
+        'encoder lag ms': {k: lag[k] for k in ['count', 'mean', 'p50', 'p95', 'max'] if k in lag},
+        'max backlog': max(_counters(s['metrics'][name], 'captured') - _counters(s['metrics'][name], 'saved')
+                           for s in samples),
+        'unsaved at stop': _counters(final[name], 'captured') - _counters(final[name], 'saved'),
+    }
+
+  threads = {k: v - start_cpu.get(k, 0) for k, v in end_cpu.items()}
+  processes = {f'{comm} {pid}': cpu - (start_children[pid][1] if pid in start_children else 0)
+               for pid, (comm, cpu, _) in end_children.items()}
+  usage, children_usage = resource.getrusage(resource.RUSAGE_SELF), resource.getrusage(resource.RUSAGE_CHILDREN)
+  sustained = all(c['save fps'] >= SUSTAINED_FRACTION * config['frame rate'] and
+                  c['dropped'] + c['incomplete'] + c['writer dropped'] == 0 for c in cameras.values())
+  return {
+      'window': window,
+      'sustained': sustained,
+      'cameras': cameras,
+      'mic': {'input overflow': _counters(final['mic'], 'input overflow')},
+      'cpu': {
+          'threads': {k: v / window for k, v in sorted(threads.items())},  # fraction of one core
+          'processes': {k: v / window for k, v in sorted(processes.items())},
+          'encoders': sum(v for k, v in processes.items() if k.startswith('ffmpeg')) / window,
+      },
+      'memory': {
+          'peak sampled rss': max(s['rss'] for s in samples),
+          'max rss self': usage.ru_maxrss * 1024,  # ru_maxrss is in kB on Linux
+          'max rss children': children_usage.ru_maxrss * 1024,
+      },
+      'drain time': drain_time,
+      'transcode time': transcode_time,  # after stop(), raw store mode only
+  }
+
+
+#############
+# the matrix, in the parent interpreter
+#############
+
+def matrix(args):
+  configs = []
+  axes = itertools.product(args.cameras, args.resolutions, args.frame_rates, args.encoders, args.file_modes,
+                           args.clients, args.processing, args.camera_processes)
+  for i, (cameras, resolution, frame_rate, encoder, file_mode, clients, processing, processes) in enumerate(axes):
+    configs.append({
+        'cameras': cameras,
+        'resolution': [int(x) for x in resolution.split('x')],
+        'frame rate': frame_rate,
+        'encoder': encoder,
+        'file mode': file_mode,
+        'clients': clients,
+        'processing': processing,
+        'camera processes': bool(processes),
+        'seconds': args.seconds,
+        'dlc model': args.dlc_model,
+        'port': PORT + (i % 100) * MAX_CHILDREN,
+    })
+  return configs
+
+
+def launch(config):
+  command = [sys.executable, '-m', 'benchmarks.throughput', '--run', json.dumps(config)]
+  try:
+    out = subprocess.run(command, cwd=REPO_ROOT, capture_output=True, text=True,
+                         timeout=config['seconds'] + WARMUP + RUN_OVERHEAD)
+  except subprocess.TimeoutExpired:
+    return {'error': 'timed out'}
+  for line in out.stdout.splitlines():
+    if line.startswith(RESULT_PREFIX):
+      return json.loads(line[len(RESULT_PREFIX):])
+  return {'error': (out.stderr or out.stdout).strip().splitlines()[-20:]}
+
+
+def describe(config):
+  return (f"{config['cameras']} x {config['resolution'][0]}x{config['resolution'][1]} @ {config['frame rate']} fps, "
+          f"{config['encoder']} ({config.get('file mode', 'encode')}), {config['clients']} clients, processing {config['processing']}, "
+          f"{'camera processes' if config['camera processes'] else 'threads'}")
+
+
+def summary(result):
+  if 'error' in result:
+    return 'FAILED'
+  cameras = result['cameras'].values()
+  lag = max(c['encoder lag ms'].get('p95', 0) for c in cameras)
+  return (f"{'sustained' if result['sustained'] else 'NOT sustained'}: "
+          f"save {min(c['save fps'] for c in cameras):.1f} fps, "
+          f"dropped {sum(c['dropped'] for c in cameras)}, encoder lag p95 {lag:.0f} ms, "
+          f"cpu {sum(result['cpu']['threads'].values()) + sum(result['cpu']['processes'].values()):.2f} cores, "
+          f"peak rss {result['memory']['peak sampled rss'] / 2**20:.0f} MB")
+
+
+def version():
+  try:
+    commit = subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=REPO_ROOT, capture_output=True, text=True).stdout.strip()
+  except OSError:
+    commit = ''
+  return {
+      'commit': commit,
+      'date': time.strftime('%Y-%m-%dT%H:%M:%S'),
+      'python': platform.python_version(),
+      'numpy': np.__version__,
+      'platform': platform.platform(),
+      'cpus': os.cpu_count(),
+  }
+
+
+def best(runs):
+  # highest sustained pixel rate for every combination of the axes that are not about size
+  groups = {}
+  for run in runs:
+    config, result = run['config'], run['result']
+    if not result.get('sustained'):
+      continue
+    key = (config['encoder'], config.get('file mode', 'encode'), config['clients'], config['processing'], config['camera processes'])
+    pixels = config['cameras'] * config['resolution'][0] * config['resolution'][1] * config['frame rate']
+    if key not in groups or pixels > groups[key][0]:
+      groups[key] = (pixels, config)
+  return [config for _, config in groups.values()]
+
+
+def _key(config):
+  return json.dumps({'file mode': 'encode', **{k: v for k, v in config.items() if k != 'port'}}, sort_keys=True)
+
+
+def compare(old_path, new_path):
+  with open(old_path) as f:
+    old = json.load(f)
+  with open(new_path) as f:
+    new = json.load(f)
+  print(f"old: {old['version']['commit'][:10]} {old['version']['date']}")
+  print(f"new: {new['version']['commit'][:10]} {new['version']['date']}")
+  old_runs = {_key(run['config']): run['result'] for run in old['runs']}
+  for run in new['runs']:
+    before = old_runs.get(_key(run['config']))
+    if before is None:
+      continue
+    print(describe(run['config']))
+    print(f'  old {summary(before)}')
+    print(f"  new {summary(run['result'])}")
+
+
+def main():
+  parser = argparse.ArgumentParser(description='AcquisitionGroup throughput on the simulated drivers')
+  parser.add_argument('--cameras', type=int, nargs='+', default=[1, 2, 4])
+  parser.add_argument('--resolutions', nargs='+', default=['640x512', '1280x1024'])
+  parser.add_argument('--frame-rates', type=float, nargs='+', default=[15, 30])
+  parser.add_argument('--encoders', nargs='+', default=[DEFAULT_ENCODER_PROFILE], choices=list(ENCODER_PROFILES))
+  parser.add_argument('--file-modes', nargs='+', default=['encode'], choices=list(CAMERA_FILE_MODES))
+  parser.add_argument('--clients', type=int, nargs='+', default=[0, 1])
+  parser.add_argument('--processing', nargs='+', default=['none'], choices=['none', 'dlc'])
+  parser.add_argument('--camera-processes', type=int, nargs='+', default=[0])
+  parser.add_argument('--seconds', type=float, default=10)
+  parser.add_argument('--dlc-model', default=None)
+  parser.add_argument('--output', default=None)
+  parser.add_argument('--compare', nargs=2, metavar=('OLD', 'NEW'))
+  parser.add_argument('--run', help=argparse.SUPPRESS)
+  args = parser.parse_args()
+
+  if args.run:
+    print(RESULT_PREFIX + json.dumps(run_config(json.loads(args.run))), flush=True)
+    os._exit(0)  # do not wait for the daemon threads of the acquisition
+  if args.compare:
+    compare(*args.compare)
+    return
+  if 'dlc' in args.processing and args.dlc_model is None:
+    parser.error('--processing dlc needs --dlc-model')
+
+  output = args.output or f"throughput-{time.strftime('%Y%m%d-%H%M%S')}.json"
+  results = {'version': version(), 'runs': []}
+  for config in matrix(args):
+    print(describe(config), flush=True)
+    result = launch(config)
+    print(f'  {summary(result)}', flush=True)
+    results['runs'].append({'config': config, 'result': result})
+    with open(output, 'w') as f:  # rewritten after every run, so an interrupted sweep keeps its results
+      json.dump(results, f, indent=1)
+
+  print('highest sustained load:')
+  for config in best(results['runs']):
+    print(f'  {describe(config)}')
+  print(f'results written to {output}')
+
+
+if __name__ == '__main__':
+  main()
@@ -1,6 +1,6 @@
 # from setup import ag, status
 from utils import path_operation_utils as pop
-from utils.dlc_utils import DLC_LIVE_MODEL_PATH
+from utils.dlc_utils import DLC_LIVE_MODEL_PATH, DLC_LIVE_SIDE_MODEL_PATH
 
 
 # serialNumbers=[19287342,19412282,17391304,17391290]
@@ -25,6 +25,7 @@ def initCallbacks(ag, status):
       for i in range(ag.nCameras):
         camera_list.append(ag.cameras[i].device_serial_number)
       filepaths = pop.reformat_filepath('', rootfilename, camera_list)
+      ag.check_encoder(status['frame rate'].current)
 
       ag.stop()
       ag.start(filepaths=filepaths)
@@ -32,6 +33,9 @@ def initCallbacks(ag, status):
       ag.run()
       status['initialization'].immutable()
       status['calibration'].immutable()
+      status['encoder profile'].immutable()
+      status['camera file mode'].immutable()
+      status['mic file format'].immutable()
       # TODO: make rootfilename and notes immutable here? and mutable below? for safety
     else:
       ag.print('got stop message')
@@ -41,6 +45,9 @@ def initCallbacks(ag, status):
 
       status['initialization'].mutable()
       status['calibration'].mutable()
+      status['encoder profile'].mutable()
+      status['camera file mode'].mutable()
+      status['mic file format'].mutable()
       status['rootfilename']('')  # to make sure we don't accidentally
 
   status['recording'].callback(recording)
@@ -62,6 +69,40 @@ def initCallbacks(ag, status):
 
   status['notes'].callback(notes)
 
+  def encoder_profile(state):
+    ag.set_encoder_profile(state)
+    ag.check_encoder(status['frame rate'].current)  # reports the cached result; a new profile is measured in the background
+
+  status['encoder profile'].callback(encoder_profile)
+
+  def camera_file_mode(state):
+    ag.set_file_mode(state)
+    ag.check_encoder(status['frame rate'].current)
+
+  status['camera file mode'].callback(camera_file_mode)
+
+  def mic_file_format(state):
+    ag.set_mic_file_format(state)
+
+  status['mic file format'].callback(mic_file_format)
+
+  def camera_preview(i):
+    def preview(state):
+      settings = status[f'camera {i}'].current
+      serial_numbers = [str(camera.device_serial_number) for camera in ag.cameras]
+      serial_number = str(settings['serial number'].current)
+      ag.set_preview(serial_numbers.index(serial_number) if serial_number in serial_numbers else i,
+                     scale=settings['preview scale'].current,
+                     roi=settings['preview roi'].current,
+                     encoding=settings['preview encoding'].current,
+                     quality=settings['preview quality'].current,
+                     max_fps=settings['preview max fps'].current,
+                     overlays=settings['preview overlays'].current)
+    return preview
+
+  for i in range(ag.nCameras):
+    status[f'camera {i}'].callback(camera_preview(i))
+
   def calibration(state):
 
     if state['is calibrating']:
@@ -103,22 +144,34 @@ def initCallbacks(ag, status):
   def spectrogram(state):
     ag.print(f'applying new status from state: {state}')
     ag.mic.parse_settings(status['spectrogram'].current)
-    # TODO: trying to update _nx or _nfft will cause an error
-    # that means we can only update log scaling and noise correction
-
-    # TODO: update the port number... if _nx or _nfft change
+    ag.nidaq.parse_settings(status['spectrogram'].current)
+    # the spectrograms are rebuilt whole; a new frequency resolution changes the shape of the frames sent
 
   status['spectrogram'].callback(spectrogram)
 
   # TODO: following should be refined to handle different analyses types, modes, etc.
   def analyze(state):
     ag.print(f'toggling analysis')
+    # every camera with a model, all run by the group's pose service
+    for i, camera in enumerate(ag.cameras):
+      model_path = DLC_LIVE_MODEL_PATH if camera.is_top else DLC_LIVE_SIDE_MODEL_PATH
+      if model_path is None:
+        continue
+      if state:
+        ag.process(i, {'mode': 'DLC', 'modelpath': model_path})
+      else:
+        ag.stop_processing(i)  # stops processing without stopping acquisition
+
+  status['analyzing'].callback(analyze)
+
+  def call_detection(state):
+    nidaq = ag.children.index(ag.nidaq)
     if state:
-      ag.process(0, {'mode': 'DLC','modelpath':DLC_LIVE_MODEL_PATH})
+      ag.process(nidaq, {'mode': 'calls'})
     else:
-      ag.stop_processing(0)  # stops processing without stopping acquisition
+      ag.stop_processing(nidaq)
 
-  status['analyzing'].callback(analyze)
+  status['call detection'].callback(call_detection)
 
   '''
   def LED(state):
@@ -0,0 +1,21 @@
+'''
+Hardware driver selection.
+
+Acquisition code imports PySpin, nidaqmx and pyaudio from here instead of directly. With
+BEHAVIOR_RIG_SIMULATE=1 in the environment (set before the first import), the stand-ins in
+drivers/sim_*.py are used instead, so the real AcquisitionGroup runs without the rig.
+'''
+import os
+
+SIMULATE = os.environ.get('BEHAVIOR_RIG_SIMULATE', '') == '1'
+
+if SIMULATE:
+  from drivers import sim_pyspin as PySpin
+  from drivers import sim_nidaqmx as nidaqmx
+  from drivers.sim_nidaqmx import AnalogSingleChannelReader
+  from drivers import sim_pyaudio as pyaudio
+else:
+  import PySpin
+  import nidaqmx
+  from nidaqmx.stream_readers import AnalogSingleChannelReader
+  import pyaudio
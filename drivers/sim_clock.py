@@ -0,0 +1,104 @@
+import atexit
+import json
+import os
+import random
+import time
+from multiprocessing import shared_memory
+
+import numpy as np
+
+POLL_TIME = .01  # seconds between checks while a simulated device waits for something
+
+# settings shared by the simulated devices; change them with configure() before creating the AcquisitionGroup
+settings = {
+    'camera serials': ['17391304', '17391290', '19287342', '19412282'],
+    'width': 1280,
+    'height': 1024,
+    'drop probability': 0.,  # chance that a triggered frame never reaches the host
+    'incomplete probability': 0.,  # chance that a frame arrives but is flagged incomplete
+    'stall probability': 0.,  # chance that a device read stalls
+    'stall time': .2,  # seconds added by a stall
+    'overflow probability': 0.,  # chance that a mic callback reports paInputOverflow
+    'mic sample rate': None,  # None: use whatever rate the stream is opened with
+}
+
+
+def configure(**kwargs):
+  # e.g. configure(drop_probability=.01, stall_time=.5); underscores stand for spaces
+  for k, v in kwargs.items():
+    key = k.replace('_', ' ')
+    if key not in settings:
+      raise KeyError(f'Unknown simulation setting {k}')
+    settings[key] = v
+  # spawned camera processes pick the settings up from the environment
+  os.environ['BEHAVIOR_RIG_SIM_SETTINGS'] = json.dumps(settings)
+
+
+settings.update(json.loads(os.environ.get('BEHAVIOR_RIG_SIM_SETTINGS', '{}')))
+
+
+def chance(setting):
+  p = settings[setting]
+  return p > 0 and random.random() < p
+
+
+def maybe_stall():
+  if chance('stall probability'):
+    time.sleep(settings['stall time'])
+
+
+class TriggerClock:
+  # the counter output that triggers the cameras: armed by the nidaq trigger task, started
+  # together with the audio task, exactly like the real start trigger.
+  # [rate, t0] live in a small shared memory block so cameras in worker processes see the same pulses
+
+  def __init__(self):
+    # spawned worker processes inherit the id, and with it the block
+    name = 'brsim_' + os.environ.setdefault('BEHAVIOR_RIG_SIM_ID', str(os.getpid()))
+    try:
+      self._shm = shared_memory.SharedMemory(name=name, create=True, size=16)
+      atexit.register(self._shm.unlink)
+    except FileExistsError:
+      self._shm = shared_memory.SharedMemory(name=name)
+    self._state = np.ndarray((2,), dtype=np.float64, buffer=self._shm.buf)  # rate, t0 (0 = off)
+
+  @property
+  def rate(self):
+    return self._state[0]
+
+  @property
+  def t0(self):
+    return self._state[1]
+
+  def arm(self, rate):
+    self._state[:] = [rate, 0]
+
+  def start(self):
+    if self.rate > 0 and self.t0 == 0:
+      self._state[1] = time.time()
+
+  def stop(self):
+    self._state[:] = 0
+
+  def wait_for_pulse(self, index, cancelled):
+    # blocks until trigger pulse `index` (0-based) fires; returns its time, or None if cancelled()
+    while not cancelled():
+      rate, t0 = self._state
+      if t0 > 0:
+        pulse_time = t0 + index / rate
+        delay = pulse_time - time.time()
+        if delay <= 0:
+          return pulse_time
+        time.sleep(min(delay, POLL_TIME))
+      else:
+        time.sleep(POLL_TIME)
+    return None
+
+  def pulses_since_start(self):
+    rate, t0 = self._state
+    if t0 == 0:
+      return 0
+    return int((time.time() - t0) * rate) + 1
+
+
+trigger = TriggerClock()
@@ -0,0 +1,167 @@
+# stand-in for the parts of nidaqmx used by Nidaq: a continuous analog input task clocked in real time,
+# with optional TDMS logging, and a counter output task that drives the simulated camera trigger
+import enum
+import threading
+import time
+
+import numpy as np
+
+from drivers import sim_clock
+
+CALL_PERIOD = .02  # seconds: a simulated 'call' (sweep) every this often
+
+
+class _Constants:
+  class AcquisitionType(enum.Enum):
+    FINITE = 10178
+    CONTINUOUS = 10123
+
+  class TaskMode(enum.Enum):
+    TASK_COMMIT = 3
+
+  class LoggingMode(enum.Enum):
+    OFF = 10231
+    LOG = 15844
+    LOG_AND_READ = 15842
+
+  class LoggingOperation(enum.Enum):
+    CREATE_OR_REPLACE = 15848
+
+
+constants = _Constants
+
+
+class DaqError(Exception):
+  pass
+
+
+class _Channels:
+  def __init__(self, task):
+    self._task = task
+    self.names = []
+
+  def add_ai_voltage_chan(self, physical_channel, **kwargs):
+    self.names.append(physical_channel)
+
+  def add_co_pulse_chan_freq(self, counter, freq=1., duty_cycle=.5, **kwargs):
+    self.names.append(counter)
+    self._task._pulse_freq = freq
+
+
+class _Timing:
+  def __init__(self, task):
+    self._task = task
+
+  def cfg_samp_clk_timing(self, rate, sample_mode=None, **kwargs):
+    self._task._sample_rate = rate
+
+  def cfg_implicit_timing(self, sample_mode=None, **kwargs):
+    pass
+
+
+class _StartTrigger:
+  def cfg_dig_edge_start_trig(self, trigger_source, **kwargs):
+    pass
+
+
+class _Triggers:
+  def __init__(self):
+    self.start_trigger = _StartTrigger()
+
+
+class _InStream:
+  def __init__(self, task):
+    self._task = task
+    self.input_buf_size = 0
+    self.logging_file_path = None
+    self.logging_mode = constants.LoggingMode.OFF
+
+  def configure_logging(self, file_path, logging_mode=constants.LoggingMode.LOG, operation=None, **kwargs):
+    self.logging_file_path = file_path
+    self.logging_mode = logging_mode
+
+  @property
+  def avail_samp_per_chan(self):
+    return self._task._available()
+
+
+class Task:
+  def __init__(self, new_task_name=''):
+    self.ai_channels = _Channels(self)
+    self.co_channels = _Channels(self)
+    self.timing = _Timing(self)
+    self.triggers = _Triggers()
+    self.in_stream = _InStream(self)
+    self._sample_rate = None
+    self._pulse_freq = None
+    self._t0 = None
+    self._read = 0  # samples handed out so far
+    self._lock = threading.Lock()
+    self._log = None
+
+  def control(self, action):
+    pass
+
+  def start(self):
+    if self._pulse_freq is not None:
+      # counter output: armed now, fires once the audio task starts (its StartTrigger)
+      sim_clock.trigger.arm(self._pulse_freq)
+      return
+    with self._lock:
+      self._t0 = time.time()
+      self._read = 0
+      if self.in_stream.logging_mode != constants.LoggingMode.OFF and self.in_stream.logging_file_path:
+        import nptdms
+        self._log = nptdms.TdmsWriter(self.in_stream.logging_file_path, 'w')
+        self._log.open()
+    sim_clock.trigger.start()
+
+  def stop(self):
+    if self._pulse_freq is not None:
+      sim_clock.trigger.stop()
+      return
+    with self._lock:
+      self._t0 = None
+      if self._log is not None:
+        self._log.close()
+        self._log = None
+
+  def close(self):
+    self.stop()
+
+  def _available(self):
+    with self._lock:
+      if self._t0 is None:
+        return 0
+      return int((time.time() - self._t0) * self._sample_rate) - self._read
+
+  def _read_samples(self, out, n):
+    # blocks until n samples have been 'acquired', then fills out with noise and periodic sweeps
+    if self._t0 is None:
+      raise DaqError('Task is not running')
+    if self.in_stream.logging_mode == constants.LoggingMode.LOG:
+      raise DaqError('Reading is not allowed in LOG mode')
+    delay = (self._read + n) / self._sample_rate - (time.time() - self._t0)
+    if delay > 0:
+      time.sleep(delay)
+    sim_clock.maybe_stall()
+
+    t = (self._read + np.arange(n)) / self._sample_rate
+    phase = np.mod(t, CALL_PERIOD) / CALL_PERIOD
+    sweep = np.sin(2 * np.pi * (3e4 + 4e4 * phase) * t) * (phase < .3)
+    out[:n] = .05 * np.random.standard_normal(n) + .5 * sweep
+    with self._lock:
+      self._read += n
+      if self._log is not None:
+        import nptdms
+        self._log.write_segment([nptdms.ChannelObject('Dev1/ai1', 'channel_0', out[:n].copy())])
+    return n
+
+
+class AnalogSingleChannelReader:
+  def __init__(self, task_in_stream):
+    self._task = task_in_stream._task
+
+  def read_many_sample(self, data, number_of_samples_per_channel=None, timeout=10.):
+    n = len(data) if number_of_samples_per_channel is None else number_of_samples_per_channel
+    return self._task._read_samples(data, n)
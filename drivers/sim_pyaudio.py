@@ -0,0 +1,73 @@
+# stand-in for the parts of pyaudio used by Mic: an 'UltraMic' input device whose stream
+# calls the callback from its own thread in real time with float32 noise
+import threading
+import time
+
+import numpy as np
+
+from drivers import sim_clock
+
+paFloat32 = 1
+paInt16 = 8
+paContinue = 0
+paComplete = 1
+paAbort = 2
+paInputUnderflow = 1
+paInputOverflow = 2
+
+
+class Stream:
+  def __init__(self, rate, channels, frames_per_buffer, stream_callback, **kwargs):
+    self._rate = sim_clock.settings['mic sample rate'] or rate
+    self._channels = channels
+    self._frames = frames_per_buffer
+    self._callback = stream_callback
+    self._active = False
+    self._thread = None
+
+  def start_stream(self):
+    self._active = True
+    self._thread = threading.Thread(target=self._run, daemon=True)
+    self._thread.start()
+
+  def _run(self):
+    period = self._frames / self._rate
+    t0 = time.time()
+    n = 0
+    while self._active:
+      n += 1
+      delay = t0 + n * period - time.time()
+      if delay > 0:
+        time.sleep(delay)
+      sim_clock.maybe_stall()
+      status = paInputOverflow if sim_clock.chance('overflow probability') else 0
+      chunk = (.05 * np.random.standard_normal(self._frames * self._channels)).astype(np.float32)
+      _, flag = self._callback(chunk.tobytes(), self._frames, {'input_buffer_adc_time': time.time()}, status)
+      if flag != paContinue:
+        break
+    self._active = False
+
+  def is_active(self):
+    return self._active
+
+  def stop_stream(self):
+    self._active = False
+    if self._thread is not None and self._thread is not threading.current_thread():
+      self._thread.join()
+
+  def close(self):
+    self.stop_stream()
+
+
+class PyAudio:
+  def get_device_count(self):
+    return 1
+
+  def get_device_info_by_index(self, index):
+    return {'index': index, 'name': 'UltraMic 250K (simulated)', 'maxInputChannels': 1}
+
+  def open(self, **kwargs):
+    return Stream(**kwargs)
+
+  def terminate(self):
+    pass
@@ -0,0 +1,242 @@
+# stand-in for the parts of PySpin used by Camera and AcquisitionGroup
+# cameras only produce frames while the simulated nidaq trigger runs, see sim_clock.TriggerClock
+import threading
+
+import numpy as np
+
+from drivers import sim_clock
+
+AcquisitionMode_SingleFrame = 0
+AcquisitionMode_Continuous = 2
+TriggerMode_Off = 0
+TriggerMode_On = 1
+TriggerSource_Line0 = 0
+ChunkSelector_FrameID = 1
+ChunkSelector_Timestamp = 2
+IMAGE_NO_ERROR = 0
+IMAGE_DATA_INCOMPLETE = 7
+SIM_DRIVER_BUFFERS = 8  # image buffers the simulated driver cycles through
+
+
+class SpinnakerException(Exception):
+  pass
+
+
+class _Node:
+  # generic GenICam node: integer, string, boolean or enumeration
+  def __init__(self, value=None, maximum=None, entries=None, name=''):
+    self._value = value
+    self._maximum = maximum
+    self._entries = entries or {}
+    self._name = name
+
+  def GetValue(self):
+    return self._value
+
+  def SetValue(self, value):
+    if self._maximum is not None and value > self._maximum:
+      raise SpinnakerException(f'{value} is above the maximum {self._maximum}')
+    self._value = value
+
+  def GetMax(self):
+    return self._maximum
+
+  def GetIntValue(self):
+    return self._value
+
+  def SetIntValue(self, value):
+    self._value = value
+
+  def GetCurrentEntry(self):
+    for name, value in self._entries.items():
+      if value == self._value:
+        return _Node(value, name=name)
+    return _Node(self._value, name=str(self._value))
+
+  def GetEntryByName(self, name):
+    return _Node(self._entries[name], name=name)
+
+  def GetDisplayName(self):
+    return self._name
+
+
+def CStringPtr(node):
+  return node
+
+
+CIntegerPtr = CEnumerationPtr = CEnumEntryPtr = CBooleanPtr = CStringPtr
+
+
+class _NodeMap:
+  def __init__(self, nodes):
+    self._nodes = nodes
+
+  def GetNode(self, name):
+    return self._nodes[name]
+
+
+class _ChunkData:
+  def __init__(self, frame_id, timestamp):
+    self._frame_id = frame_id
+    self._timestamp = timestamp
+
+  def GetFrameID(self):
+    return self._frame_id
+
+  def GetTimestamp(self):
+    return self._timestamp
+
+
+class ImagePtr:
+  def __init__(self, array, frame_id, timestamp, status):
+    self._array = array
+    self._frame_id = frame_id
+    self._timestamp = timestamp
+    self._status = status
+
+  def IsIncomplete(self):
+    return self._status != IMAGE_NO_ERROR
+
+  def GetImageStatus(self):
+    return self._status
+
+  def GetNDArray(self):
+    return self._array
+
+  def GetFrameID(self):
+    return self._frame_id
+
+  def GetTimeStamp(self):
+    return self._timestamp
+
+  def GetChunkData(self):
+    return _ChunkData(self._frame_id, self._timestamp)
+
+  def Release(self):
+    self._array = None
+
+
+class CameraPtr:
+  def __init__(self, serial_number):
+    settings = sim_clock.settings
+    self._serial_number = serial_number
+    self._width = settings['width']
+    self._height = settings['height']
+    self._tl_device = _NodeMap({'DeviceSerialNumber': _Node(serial_number)})
+    self._nodemap = _NodeMap({'Width': _Node(self._width), 'Height': _Node(self._height)})
+    self._tl_stream = _NodeMap({
+        'StreamBufferHandlingMode': _Node(0, entries={'OldestFirst': 0, 'NewestOnly': 1}),
+        'StreamBufferCountMode': _Node(0, entries={'Auto': 0, 'Manual': 1}),
+        'StreamBufferCountManual': _Node(10, maximum=10000),
+    })
+    self.AcquisitionMode = _Node(AcquisitionMode_Continuous)
+    self.TriggerMode = _Node(TriggerMode_Off)
+    self.TriggerSource = _Node(TriggerSource_Line0)
+    self.ChunkModeActive = _Node(False)
+    self.ChunkSelector = _Node(ChunkSelector_FrameID)
+    self.ChunkEnable = _Node(False)
+
+    # a static gradient with the frame counter burned into the top rows
+    self._pattern = np.tile(np.arange(self._width, dtype=np.uint8), (self._height, 1))
+    # like the real driver, images are filled into a fixed set of buffers that GetNDArray() wraps
+    self._buffers = [np.empty_like(self._pattern) for _ in range(SIM_DRIVER_BUFFERS)]
+    self._next_buffer = 0
+    self._initialized = False
+    self._acquiring = False
+    self._next_pulse = 0
+    self._first_pulse = 0
+
+  def Init(self):
+    self._initialized = True
+
+  def DeInit(self):
+    self._acquiring = False
+    self._initialized = False
+
+  def IsInitialized(self):
+    return self._initialized
+
+  def GetTLDeviceNodeMap(self):
+    return self._tl_device
+
+  def GetNodeMap(self):
+    return self._nodemap
+
+  def GetTLStreamNodeMap(self):
+    return self._tl_stream
+
+  def BeginAcquisition(self):
+    if not self._initialized:
+      raise SpinnakerException('Camera is not initialized')
+    # pulses that fired before acquisition started are never seen by the camera
+    self._first_pulse = self._next_pulse = sim_clock.trigger.pulses_since_start()
+    self._acquiring = True
+
+  def EndAcquisition(self):
+    self._acquiring = False
+
+  def GetNextImage(self, timeout=None):
+    while True:
+      if not self._acquiring:
+        raise SpinnakerException('Camera is not streaming')
+      # the stream buffer only holds so many frames: if the host falls further behind, the oldest are lost
+      buffer_count = self._tl_stream.GetNode('StreamBufferCountManual').GetValue()
+      self._next_pulse = max(self._next_pulse, sim_clock.trigger.pulses_since_start() - buffer_count)
+      pulse = self._next_pulse
+      pulse_time = sim_clock.trigger.wait_for_pulse(pulse, lambda: not self._acquiring)
+      if pulse_time is None:
+        raise SpinnakerException('Acquisition stopped while waiting for an image')
+      self._next_pulse += 1
+      if sim_clock.chance('drop probability'):
+        continue  # the frame id still advances, like a frame lost on the bus
+      break
+
+    sim_clock.maybe_stall()
+    frame = self._buffers[self._next_buffer]
+    self._next_buffer = (self._next_buffer + 1) % len(self._buffers)
+    np.copyto(frame, self._pattern)  # stands in for the DMA transfer from the camera
+    frame[:16] = pulse % 256
+    status = IMAGE_DATA_INCOMPLETE if sim_clock.chance('incomplete probability') else IMAGE_NO_ERROR
+    return ImagePtr(frame, pulse - self._first_pulse, int(pulse_time * 1e9), status)
+
+
+class CameraList:
+  def __init__(self, cameras):
+    self._cameras = cameras
+
+  def GetSize(self):
+    return len(self._cameras)
+
+  def GetByIndex(self, index):
+    return self._cameras[index]
+
+  def GetBySerial(self, serial_number):
+    for camera in self._cameras:
+      if camera._serial_number == str(serial_number):
+        return camera
+    raise SpinnakerException(f'No camera with serial number {serial_number}')
+
+  def Clear(self):
+    self._cameras = []
+
+
+class System:
+  _instance = None
+  _lock = threading.Lock()
+
+  @classmethod
+  def GetInstance(cls):
+    with cls._lock:
+      if cls._instance is None:
+        cls._instance = cls()
+      return cls._instance
+
+  def __init__(self):
+    self._cameras = [CameraPtr(serial) for serial in sim_clock.settings['camera serials']]
+
+  def GetCameras(self):
+    return CameraList(list(self._cameras))
+
+  def ReleaseInstance(self):
+    with System._lock:
+      System._instance = None
@@ -1,3 +1,9 @@
+from utils.encoder_profiles import ENCODER_PROFILES, DEFAULT_ENCODER_PROFILE
+from utils.raw_store import CAMERA_FILE_MODES
+from utils.audio_writer import AUDIO_FORMATS
+from utils.spectrogram import SPECTROGRAM_COLORMAPS
+from utils.preview import PREVIEW_ENCODINGS, PREVIEW_SCALES, PREVIEW_OVERLAYS, DEFAULT_PREVIEW_QUALITY
+
 serialNumbers = [17391304, 17391290, 19287342, 19412282]
 initialStatus = {  # just an example
     'initialization': {
@@ -24,12 +30,36 @@ initialStatus = {  # just an example
         'current': int(2.5e5),
         'mutable': False,
     },
+    'nidaq read time': {  # seconds of audio per read from the DAQ, see Nidaq.capture()
+        'allowedValues': {'min': .01, 'max': .5},
+        'category': 'Audio',
+        'current': .5,
+        'mutable': False,
+    },
     'frame rate': {
         'allowedValues': [10, 15, 20, 25, 30],
         'category': 'Video',
         'current': 15,
         'mutable': False,
     },
+    'encoder profile': {
+        'allowedValues': list(ENCODER_PROFILES),
+        'category': 'Video',
+        'current': DEFAULT_ENCODER_PROFILE,
+        'mutable': True,
+    },
+    'camera file mode': {
+        'allowedValues': list(CAMERA_FILE_MODES),
+        'category': 'Video',
+        'current': CAMERA_FILE_MODES[0],
+        'mutable': True,
+    },
+    'mic file format': {  # what the mic records straight to, see utils/audio_writer.py
+        'allowedValues': list(AUDIO_FORMATS),
+        'category': 'Audio',
+        'current': AUDIO_FORMATS[0],
+        'mutable': True,
+    },
     'recording': {
         'category': 'Acquisition',
         'current': False,
@@ -40,6 +70,11 @@ initialStatus = {  # just an example
         'current': False,
         'mutable': True,
     },
+    'call detection': {  # live USV detection on the nidaq audio, see utils/call_detector.py
+        'category': 'Audio',
+        'current': False,
+        'mutable': True,
+    },
     'LED':{
         'category':'LED',
         'current':False,
@@ -100,16 +135,27 @@ initialStatus = {  # just an example
                 'current': True,
                 'mutable': True
             },
+            'scrolling': {  # send only the new columns of each chunk, see utils/spectrogram.py
+                'category': 'Audio',
+                'current': False,
+                'mutable': True
+            },
+            'colormap': {  # gray sends one channel, the others rgb
+                'category': 'Audio',
+                'current': SPECTROGRAM_COLORMAPS[0],
+                'mutable': True,
+                'allowedValues': list(SPECTROGRAM_COLORMAPS)
+            },
             'default': {
                 'category': 'Audio',
                 'current': True,
                 'mutable': False
             },
-            'width': {
+            'width': {  # columns per chunk: samples per chunk // (window - overlap)
                 'category': 'Video',
-                'current': 478,
+                'current': 480,
                 'mutable': False,
-                'allowedValues': [478]
+                'allowedValues': [480]
             },
             'height': {  # same as frequency resolution...
                 'category': 'Video',
@@ -218,6 +264,43 @@ for i in range(4):
               'current': 1.25,
               'mutable': False,
               'allowedValues': [1.25]
+          },
+          # live preview sent over 'port', see utils/preview.py
+          'preview scale': {
+              'category': 'Video',
+              'current': 1,
+              'mutable': True,
+              'allowedValues': list(PREVIEW_SCALES)
+          },
+          'preview roi': {  # [x, y, width, height] in camera pixels, zeros for the whole frame
+              'category': 'Video',
+              'current': [0, 0, 0, 0],
+              'mutable': True,
+              'allowedValues': {'min': 0, 'max': 1280}
+          },
+          'preview encoding': {
+              'category': 'Video',
+              'current': 'raw',
+              'mutable': True,
+              'allowedValues': list(PREVIEW_ENCODINGS)
+          },
+          'preview quality': {
+              'category': 'Video',
+              'current': DEFAULT_PREVIEW_QUALITY,
+              'mutable': True,
+              'allowedValues': {'min': 0, 'max': 100}
+          },
+          'preview max fps': {  # 0 for every frame
+              'category': 'Video',
+              'current': 0,
+              'mutable': True,
+              'allowedValues': {'min': 0, 'max': 30}
+          },
+          'preview overlays': {  # 'metadata' needs the stream server, otherwise they stay burned in
+              'category': 'Video',
+              'current': 'burned',
+              'mutable': True,
+              'allowedValues': list(PREVIEW_OVERLAYS)
           }
           #   'displaying': {
           #       'category': 'Video',
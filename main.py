@@ -1,5 +1,6 @@
 # from setup import setup
 # from callbacks import initCallbacks
+import os
 import sys
 from socketApp import initServer
 
@@ -14,6 +15,11 @@ if __name__ == "__main__":
     if sys.argv[1] == 'mock':
       from mockSetup import setup
       from mockCallbacks import initCallbacks
+    elif sys.argv[1] == 'sim':
+      # the real acquisition code on simulated cameras, DAQ and mic, see drivers/
+      os.environ['BEHAVIOR_RIG_SIMULATE'] = '1'
+      from setup import setup
+      from callbacks import initCallbacks
     else:
       raise Exception('Unclear run type')
   else:
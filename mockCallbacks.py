@@ -6,3 +6,5 @@ def initCallbacks(ag, status):
 
   # override as needed
   status['spectrogram'].callback(lambda x: None)
+  status['call detection'].callback(lambda x: None)
+  status['analyzing'].callback(lambda x: None)
@@ -2,6 +2,9 @@
 from RigStatus import RigStatus
 from utils.tcp_utils import initTCP, getConnections, sendData, doShutdown
 from initialStatus import initialStatus
+from utils.metrics import Metrics
+from utils.preview import Preview
+from utils.event_log import EventLog
 import threading
 import numpy as np
 import socket
@@ -31,6 +34,9 @@ def setup():
       self.recipients = []
       self.imarray = np.zeros((1280, 1024), dtype=np.uint8)
       self.make_frame(0)
+      self.name = f'camera {self.device_serial_number}' if currStatus else 'nidaq'
+      self.metrics = Metrics()
+      self.preview = Preview()
 
     def display(self):
       i = 0
@@ -40,7 +46,10 @@ def setup():
         if len(self.recipients) == 0:
           continue
         else:
-          sendData(self.imarray.tobytes(), self.recipients)
+          start = time.perf_counter()
+          sendData(self.preview.encode(self.imarray), self.recipients)
+          self.metrics.observe('display send', time.perf_counter() - start)
+          self.metrics.count('displayed')
           i += 1
           self.make_frame(i)
 
@@ -62,9 +71,29 @@ def setup():
           currStatus[f'camera {i}'].current, (hostname, ports[i])) for i in range(4)]
       self.nidaq = FakeAcqObj([], (hostname, ports[-1]))
       self.children = self.cameras + [self.nidaq]
+      self.events = EventLog()
 
       self.threads = []
 
+    @property
+    def metrics(self):
+      return {child.name: child.metrics.snapshot for child in self.children}
+
+    def set_encoder_profile(self, profile):
+      self.encoder_profile = profile
+
+    def set_file_mode(self, mode):
+      self.file_mode = mode
+
+    def set_mic_file_format(self, file_format):
+      self.mic_file_format = file_format
+
+    def check_encoder(self, frame_rate):
+      return {}  # nothing is encoded in the mock setup
+
+    def set_preview(self, i, **settings):
+      self.cameras[i].preview.configure(**settings)
+
     def stop(self):
       self.running = False
       for i in range(5):
@@ -2,6 +2,9 @@ from flask import Flask
 from flask_socketio import SocketIO, emit
 from datetime import datetime
 
+METRICS_INTERVAL = 2  # seconds between metrics broadcasts
+EVENTS_INTERVAL = .2  # seconds between checks for new events, e.g. detected calls
+
 
 def initServer(ag, status):
   app = Flask(__name__)
@@ -35,6 +38,12 @@ def initServer(ag, status):
     elif request_type == 'current':
       return status.update
 
+    elif request_type == 'metrics':
+      return ag.metrics
+
+    elif request_type == 'events':
+      return ag.events.since()
+
     elif request_type == 'processing': #give me a handful of rootfilename
       return { #might request files 0 to 30, may have only recorded 29
           'first': args[0], #if args[0] == 0, then I want the most recent rootfilename
@@ -95,4 +104,22 @@ def initServer(ag, status):
     print(f'returning status change: {status.update}')
     return status.update
 
+  def broadcast_metrics():
+    while True:
+      socketio.sleep(METRICS_INTERVAL)
+      socketio.emit('metrics', ag.metrics, broadcast=True)
+
+  socketio.start_background_task(broadcast_metrics)
+
+  def broadcast_events():
+    last_id = 0
+    while True:
+      socketio.sleep(EVENTS_INTERVAL)
+      events = ag.events.since(last_id)
+      if events:
+        last_id = events[-1]['id']
+        socketio.emit('events', events, broadcast=True)
+
+  socketio.start_background_task(broadcast_events)
+
   return app, socketio
@@ -0,0 +1,65 @@
+import numpy as np
+
+from utils.call_detector import CallDetector
+
+# run with python -m pytest tests from the repository root
+
+SAMPLE_RATE = 250000
+LOUD = 10.  # tone amplitude about 19 dB above the unit noise in the call band, over ON_DB
+QUIET = 3.2  # about 9 dB, between OFF_DB and ON_DB
+
+
+def recording():
+  # 1 s of unit white noise with 60 kHz tones; (start, stop, amplitude) in seconds
+  tones = [
+      (.30, .32, LOUD), (.324, .35, LOUD),  # a 4 ms dip, shorter than MAX_GAP_TIME: one call
+      (.50, .55, QUIET),  # never reaches ON_DB: no call
+      (.70, .72, LOUD), (.72, .76, QUIET),  # stays above OFF_DB: one call until .76
+      (.85, .87, LOUD), (.89, .91, LOUD),  # a 20 ms gap: two calls
+  ]
+  samples = np.random.default_rng(0).normal(0, 1, SAMPLE_RATE)
+  t = np.arange(SAMPLE_RATE) / SAMPLE_RATE
+  for start, stop, amplitude in tones:
+    i = slice(int(start * SAMPLE_RATE), int(stop * SAMPLE_RATE))
+    samples[i] += amplitude * np.sin(2 * np.pi * 60e3 * t[i])
+  return samples.astype(np.float32)
+
+
+def detect(samples, chunk):
+  detector = CallDetector(SAMPLE_RATE)
+  events = []
+  for start in range(0, len(samples), chunk):
+    events += detector.process(samples[start:start + chunk], start)
+  return events + detector.close()
+
+
+def calls(events):
+  # (onset, offset) in seconds of every call
+  return [(e['onset sample'] / SAMPLE_RATE, e['time']) for e in events if e['event'] == 'call offset']
+
+
+def event_samples(events):
+  return [(e['event'], e['sample']) for e in events]
+
+
+def test_hysteresis_bridges_short_dips_and_holds_above_off_db():
+  events = detect(recording(), 25000)
+  assert [e['event'] for e in events] == ['call onset', 'call offset'] * 4
+  # to the resolution of a hop (1 ms) plus the window that still overlaps the tone
+  expected = [(.3, .35), (.7, .76), (.85, .87), (.89, .91)]
+  assert np.allclose(calls(events), expected, atol=.002)
+
+
+def test_events_do_not_depend_on_the_chunk_size():
+  samples = recording()
+  assert event_samples(detect(samples, 7919)) == event_samples(detect(samples, 25000))
+
+
+def test_skipped_chunks_truncate_the_call_in_progress():
+  samples = recording()
+  detector = CallDetector(SAMPLE_RATE)
+  events = detector.process(samples[:77500], 0)  # up to the middle of the first call
+  assert detector.next_sample == 77500
+  events += detector.process(samples[100000:125000], 100000)
+  assert events[-1]['event'] == 'call offset' and events[-1]['truncated']
+  assert events[-1]['sample'] == 77500
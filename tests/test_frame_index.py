@@ -0,0 +1,27 @@
+import numpy as np
+
+from utils.frame_index import FrameIndexWriter, find_gaps, frame_info, position_of, read_frame_index
+
+# run with python -m pytest tests from the repository root
+
+
+def write_index(path, frame_ids):
+  writer = FrameIndexWriter(str(path))
+  for i, frame_id in enumerate(frame_ids):
+    writer.append(frame_info(frame_id, 1000 * i, float(i)))
+  writer.close()
+  return read_frame_index(str(path))
+
+
+def test_find_gaps_reports_dropped_frames_before_each_position(tmp_path):
+  index = write_index(tmp_path / 'camera.frames', [5, 6, 7, 10, 11, 13])
+  assert list(index['position']) == [0, 1, 2, 3, 4, 5]
+  assert find_gaps(index) == [(3, 2), (5, 1)]  # 8 and 9 before position 3, 12 before position 5
+  assert position_of(index, 10) == 3
+  assert position_of(index, 12) is None
+
+
+def test_find_gaps_without_drops(tmp_path):
+  assert find_gaps(write_index(tmp_path / 'empty.frames', [])) == []
+  assert find_gaps(write_index(tmp_path / 'single.frames', [3])) == []
+  assert find_gaps(write_index(tmp_path / 'whole.frames', np.arange(100))) == []
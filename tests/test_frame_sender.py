@@ -0,0 +1,70 @@
+import socket
+import threading
+import time
+
+from utils.tcp_utils import FrameSender
+
+# run with python -m pytest tests from the repository root
+
+FRAME_BYTES = 1000
+
+
+def receive_frames(conn, timeout):
+  # the first byte of every frame is its number; returns once nothing came in for timeout seconds
+  conn.settimeout(timeout)
+  data = b''
+  try:
+    while True:
+      chunk = conn.recv(1 << 16)
+      if not chunk:
+        break
+      data += chunk
+  except socket.timeout:
+    pass
+  return [data[i] for i in range(0, len(data), FRAME_BYTES)]
+
+
+def reader(conn, timeout=.5):
+  # reads on a thread, so the client never falls behind: what it misses is down to the sender
+  frames = []
+  thread = threading.Thread(target=lambda: frames.extend(receive_frames(conn, timeout)))
+  thread.start()
+  return thread, frames
+
+
+def test_each_client_is_capped_and_gets_the_latest_frame():
+  sender = FrameSender(max_fps=10)
+  server_side, client_side = socket.socketpair()
+  sender.add(server_side, ('local', 0))
+  try:
+    thread, frames = reader(client_side)
+    start = time.time()
+    for i in range(100):  # 100 fps for a second
+      sender.send(bytes([i]) * FRAME_BYTES)
+      time.sleep(max(start + (i + 1) / 100 - time.time(), 0))
+    thread.join()
+    assert 9 <= len(frames) <= 12
+    assert frames == sorted(frames)
+    assert frames[-1] == 99  # the waiting frame still goes out once the interval is over
+    stats = next(iter(sender.stats.values()))
+    assert stats['delivered'] == len(frames)
+    assert stats['skipped'] == 100 - len(frames)
+  finally:
+    sender.close()
+    client_side.close()
+
+
+def test_no_cap_sends_as_fast_as_the_client_reads():
+  sender = FrameSender(max_fps=None)
+  server_side, client_side = socket.socketpair()
+  sender.add(server_side, ('local', 0))
+  try:
+    thread, frames = reader(client_side)
+    for i in range(50):
+      sender.send(bytes([i]) * FRAME_BYTES)
+      time.sleep(.01)
+    thread.join()
+    assert frames == list(range(50))
+  finally:
+    sender.close()
+    client_side.close()
@@ -0,0 +1,52 @@
+import cv2
+import numpy as np
+
+from utils.live_triangulation import triangulate_dlt
+
+# run with python -m pytest tests from the repository root
+
+
+def rig():
+  # three cameras around the origin, 5 units away, as [R|t] on normalized image coordinates
+  projections = []
+  for angle in (-.6, 0., .7):
+    rotation, _ = cv2.Rodrigues(np.array([.1, angle, 0.]))
+    projections.append(np.hstack([rotation, [[0.], [0.], [5.]]]))
+  return np.array(projections)
+
+
+def project(points_3d, projections):
+  homogeneous = np.hstack([points_3d, np.ones((len(points_3d), 1))])
+  image = np.einsum('cij,kj->cki', projections, homogeneous)
+  return image[:, :, :2] / image[:, :, 2:]
+
+
+KEYPOINTS = np.array([[0., 0., 0.], [.5, -.2, .3], [-.4, .6, -.1], [.2, .2, .8]])
+
+
+def test_triangulate_dlt_recovers_exact_points():
+  projections = rig()
+  valid = np.ones((3, len(KEYPOINTS)), dtype=bool)
+  assert np.allclose(triangulate_dlt(project(KEYPOINTS, projections), valid, projections), KEYPOINTS, atol=1e-9)
+
+
+def test_invalid_views_drop_out_and_single_views_give_nan():
+  projections = rig()
+  points = project(KEYPOINTS, projections)
+  valid = np.ones((3, len(KEYPOINTS)), dtype=bool)
+  valid[0, 1] = False  # keypoint 1 seen by two cameras
+  points[0, 1] = [50., -50.]  # what camera 0 reported for it must not matter
+  valid[:2, 2] = False  # keypoint 2 seen by one camera
+  points[1, 3] = np.nan  # an invalid view may hold nan, which must not spread to the others
+  valid[1, 3] = False
+  result = triangulate_dlt(points, valid, projections)
+  assert np.allclose(result[[0, 1, 3]], KEYPOINTS[[0, 1, 3]], atol=1e-9)
+  assert np.isnan(result[2]).all()
+
+
+def test_triangulate_dlt_under_noise():
+  projections = rig()
+  rng = np.random.default_rng(0)
+  points = project(KEYPOINTS, projections) + rng.normal(0, 1e-3, (3, len(KEYPOINTS), 2))  # ~1 px at f=1000
+  result = triangulate_dlt(points, np.ones((3, len(KEYPOINTS)), dtype=bool), projections)
+  assert np.abs(result - KEYPOINTS).max() < .02
@@ -0,0 +1,106 @@
+import copy
+import os
+import time
+
+os.environ['BEHAVIOR_RIG_SIMULATE'] = '1'  # before anything imports drivers
+
+import numpy as np
+
+from drivers import sim_clock
+sim_clock.configure(camera_serials=['17391304', '17391290'], width=320, height=256)  # two cameras to match
+
+from AcquisitionGroup import AcquisitionGroup
+from initialStatus import initialStatus
+from RigStatus import RigStatus
+from utils.frame_index import FRAME_INDEX_DTYPE, frame_info
+from utils.frame_pool import FramePool
+from utils.metrics import Metrics
+from utils.pose_service import PoseService
+from utils.ring_buffer import SharedFrameRing
+
+# run with python -m pytest tests from the repository root; the devices are simulated, see drivers/
+
+
+class FakeModel:
+  # stands in for DLCLive: one keypoint with full confidence
+  def init_inference(self, frame):
+    return self.get_pose(frame)
+
+  def get_pose(self, frame):
+    return np.array([[frame.shape[1] / 2, frame.shape[0] / 2, 1.]])
+
+  def close(self):
+    pass
+
+
+def wait_until(condition, timeout=5.):
+  deadline = time.time() + timeout
+  while not condition() and time.time() < deadline:
+    time.sleep(.01)
+  return condition()
+
+
+def test_shared_ring_carries_frame_info():
+  ring = SharedFrameRing((4, 6), np.uint8, n_slots=2, create=True, info_dtype=FRAME_INDEX_DTYPE)
+  reader = SharedFrameRing((4, 6), np.uint8, n_slots=2, name=ring.name, info_dtype=FRAME_INDEX_DTYPE)
+  pool = FramePool(1, (4, 6), np.uint8, info_dtype=FRAME_INDEX_DTYPE)
+  try:
+    for frame_id in (7, 10, 13):
+      frame = pool.acquire()
+      frame_info(frame_id, 0, time.time(), out=frame.info)
+      seq = ring.put(frame)
+      frame.release()
+    assert reader.info(seq)['frame_id'] == 13
+    assert reader.info(seq - 1)['frame_id'] == 10
+    assert reader.info(seq - 2) is None  # lapped
+    assert SharedFrameRing((4, 6), np.uint8, n_slots=2, name=ring.name).info(seq) is None  # no info_dtype
+  finally:
+    reader.close()
+    ring.close()
+
+
+def test_process_cameras_get_matched_poses():
+  ag = AcquisitionGroup(RigStatus(copy.deepcopy(initialStatus)), ports=5700, camera_processes=True)
+  poses = []
+  ag.poses.on_pose = lambda camera, data_count, info, pose: poses.append((camera.name, info))
+  ag.start()
+  ag.run()
+  try:
+    for camera in ag.cameras:
+      ag.poses.subscribe(camera, 'fake model', FakeModel)
+    assert wait_until(lambda: len({name for name, _ in poses}) == len(ag.cameras))
+    time.sleep(1)
+    assert ag.poses._thread is not None  # still serving
+  finally:
+    for camera in ag.cameras:
+      ag.poses.unsubscribe(camera)
+    ag.stop()
+    for camera in ag.cameras:
+      camera.close()
+
+  assert all(info is not None for _, info in poses)
+  frame_ids = {}
+  for name, info in poses:
+    frame_ids.setdefault(name, set()).add(int(info['frame_id']))
+  assert set.intersection(*frame_ids.values())  # the cameras were posed on the same triggers
+  assert not any(Metrics.snapshot.fget(camera.metrics)['counters'].get('pose errors') for camera in ag.cameras)
+
+
+def test_loop_error_is_reported_and_clears_the_thread():
+  class BrokenCamera:
+    name = 'broken camera'
+
+    def __init__(self):
+      self.metrics = Metrics()
+
+    @property
+    def data_count(self):
+      raise RuntimeError('no ring')
+
+  messages = []
+  service = PoseService(print=messages.append)
+  camera = BrokenCamera()
+  service.subscribe(camera, 'fake model', FakeModel)
+  assert wait_until(lambda: service._thread is None)
+  assert messages
+  assert camera.metrics.snapshot['counters']['pose errors'] == 1
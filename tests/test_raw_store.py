@@ -0,0 +1,53 @@
+import os
+
+import numpy as np
+import pytest
+
+from utils.raw_store import RawStoreReader, RawStoreWriter
+
+# run with python -m pytest tests from the repository root
+
+SHAPE = (4, 6)
+
+
+def frames(n):
+  return [np.full(SHAPE, i, dtype=np.uint8) for i in range(n)]
+
+
+def test_raw_store_round_trip(tmp_path):
+  path = str(tmp_path / 'camera.rawstore')
+  writer = RawStoreWriter(path, SHAPE, np.uint8, frame_rate=30, segment_frames=10)
+  for frame in frames(25):
+    writer.append(frame)
+  writer.close()
+  assert os.path.getsize(os.path.join(path, '00002.raw')) == 5 * np.prod(SHAPE)  # the unused tail is given back
+
+  reader = RawStoreReader(path)
+  assert reader.complete
+  assert len(reader) == 25
+  assert reader.shape == SHAPE and reader.dtype == np.uint8 and reader.frame_rate == 30
+  assert (reader[12] == 12).all()
+  assert (reader[-1] == 24).all()
+  with pytest.raises(IndexError):
+    reader[25]
+  block = reader.read(8, 23)  # across three segments
+  assert block.shape == (15,) + SHAPE
+  assert [int(frame[0, 0]) for frame in block] == list(range(8, 23))
+  assert [int(frame[0, 0]) for frame in reader] == list(range(25))
+  reader.close()
+
+
+def test_raw_store_shows_finished_segments_while_recording(tmp_path):
+  path = str(tmp_path / 'camera.rawstore')
+  writer = RawStoreWriter(path, SHAPE, np.uint8, segment_frames=10)
+  for frame in frames(12):
+    writer.append(frame)  # the 11th frame finishes the first segment
+  reader = RawStoreReader(path)
+  assert not reader.complete
+  assert len(reader) == 10
+  writer.close()
+  reader.refresh()
+  assert reader.complete
+  assert len(reader) == 12
+  assert (reader[11] == 11).all()
+  reader.close()
@@ -0,0 +1,108 @@
+import numpy as np
+import pytest
+
+from utils.ring_buffer import ChunkRing, FrameRing, SharedFrameRing
+
+# run with python -m pytest tests from the repository root
+
+
+def test_frame_ring_starts_empty():
+  ring = FrameRing(n_slots=4, shape=(2, 3))
+  assert ring.seq == 0
+  assert ring.latest() == (None, 0)
+  assert ring.get(0) is None
+  assert ring.get(1) is None
+
+
+def test_frame_ring_keeps_the_last_n_slots_frames():
+  ring = FrameRing(n_slots=4, shape=(2, 3))
+  for i in range(1, 7):
+    assert ring.write(np.full((2, 3), float(i)), timestamp=float(i)) == i
+  view, seq = ring.latest()
+  assert seq == 6 and (view == 6).all()
+  assert not view.flags.writeable
+  for seq in (1, 2):
+    assert ring.lapped(seq)
+    assert ring.get(seq) is None
+    assert ring.timestamp(seq) is None
+  for seq in range(3, 7):
+    assert not ring.lapped(seq)
+    assert (ring.get(seq) == seq).all()
+    assert ring.timestamp(seq) == seq
+  assert ring.get(7) is None  # not published yet
+
+
+def test_frame_ring_claim_laps_the_oldest_frame_before_publish():
+  ring = FrameRing(n_slots=4, shape=(2, 3))
+  for i in range(1, 5):
+    ring.write(np.full((2, 3), float(i)))
+  view = ring.get(1)
+  slot = ring.claim((2, 3), np.float64)
+  # the slot of frame 1 is being overwritten: a reader still holding its view must treat it as torn
+  assert ring.lapped(1)
+  assert ring.get(1) is None
+  assert ring.seq == 4  # nothing new is visible until publish()
+  slot[:] = 5
+  assert ring.publish() == 5
+  assert (view == 5).all()
+  assert (ring.latest()[0] == 5).all()
+
+
+def test_shared_frame_ring_laps_are_seen_by_an_attached_reader():
+  writer = SharedFrameRing((2, 3), np.uint8, n_slots=4, create=True)
+  reader = SharedFrameRing((2, 3), np.uint8, n_slots=4, name=writer.name)
+  published = []
+  writer.on_publish = published.append
+  try:
+    assert reader.latest() == (None, 0)
+    for i in range(1, 6):
+      writer.write(np.full((2, 3), i, dtype=np.uint8), timestamp=float(i))
+    assert published == [1, 2, 3, 4, 5]
+    view, seq = reader.latest()
+    assert seq == 5 and (view == 5).all()
+    assert reader.lapped(1) and reader.get(1) is None
+    assert (reader.get(2) == 2).all() and reader.timestamp(2) == 2
+    writer.claim((2, 3), np.uint8)  # frame 2's slot is being overwritten in the other process
+    assert reader.lapped(2) and reader.get(2) is None
+    assert reader.seq == 5
+    del view
+  finally:
+    reader.close()
+    writer.close()
+
+
+def test_shared_frame_ring_holds_one_format():
+  writer = SharedFrameRing((2, 3), np.uint8, n_slots=2, create=True)
+  try:
+    with pytest.raises(ValueError):
+      writer.write(np.zeros((3, 2), dtype=np.uint8))
+  finally:
+    writer.close()
+
+
+def test_chunk_ring_pops_in_order_and_drops_when_full():
+  ring = ChunkRing(3, 4)
+  assert ring.pop() is None
+  for i in range(4):
+    ring.push(np.full(4, i), flags=i)
+  assert ring.queued == 3
+  assert ring.dropped == 1  # the consumer was 3 chunks behind, so chunk 3 was dropped
+  for i in range(3):
+    chunk, _, flags = ring.pop()
+    assert (chunk == i).all() and flags == i
+    ring.release()
+  assert ring.pop() is None
+  assert ring.push(np.full(2, 9))  # room again; a short chunk keeps its length
+  chunk, _, _ = ring.pop()
+  assert len(chunk) == 2 and (chunk == 9).all()
+
+
+def test_chunk_ring_slot_stays_put_until_released():
+  ring = ChunkRing(2, 4)
+  ring.push(np.full(4, 1))
+  chunk, _, _ = ring.pop()
+  ring.push(np.full(4, 2))
+  assert not ring.push(np.full(4, 3))  # the popped slot is not free until release()
+  assert (chunk == 1).all()
+  ring.release()
+  assert ring.push(np.full(4, 3))
@@ -0,0 +1,40 @@
+import copy
+import os
+import threading
+import time
+
+os.environ['BEHAVIOR_RIG_SIMULATE'] = '1'  # before anything imports drivers
+
+from drivers import sim_clock
+
+from AcquisitionGroup import AcquisitionGroup
+from initialStatus import initialStatus
+from RigStatus import RigStatus
+
+# run with python -m pytest tests from the repository root; the devices are simulated, see drivers/
+
+STOP_TIMEOUT = 20.  # seconds stop() may take before the test counts it as hung
+
+
+def test_incomplete_frames_are_skipped():
+  sim_clock.configure(incomplete_probability=.2)
+  try:
+    ag = AcquisitionGroup(RigStatus(copy.deepcopy(initialStatus)), ports=5800)
+    ag.start()
+    ag.run()
+    time.sleep(2)
+    assert all(camera._has_runner for camera in ag.cameras)  # incomplete frames do not end the runner
+
+    stopper = threading.Thread(target=ag.stop, daemon=True)
+    stopper.start()
+    stopper.join(STOP_TIMEOUT)
+    assert not stopper.is_alive()
+  finally:
+    sim_clock.configure(incomplete_probability=0.)
+
+  for camera in ag.cameras:
+    counters = camera.metrics.snapshot['counters']
+    assert counters.get('incomplete', 0) > 0
+    assert counters.get('captured', 0) > 0
+    assert not counters.get('dropped')  # the ids of incomplete frames are still seen
+    camera.close()
@@ -0,0 +1,39 @@
+import pytest
+
+from utils.stream_server import StreamServer, _Subscriber
+
+# run with python -m pytest tests from the repository root
+
+
+@pytest.fixture
+def server():
+  server = StreamServer(('127.0.0.1', 0))
+  server.add_stream('camera')
+  server.add_stream('mic')
+  yield server
+  server.close()
+
+
+@pytest.mark.parametrize('line', [
+    b'[1, 2]',
+    b'"mic"',
+    b'{"subscribe": "mic"}',
+    b'{"subscribe": [["mic"]]}',
+    b'{"subscribe": [{"mic": 1}]}',
+    b'{"subscribe": [true]}',
+    b'{"subscribe": ["mic", "speaker"]}',
+    b'not json',
+])
+def test_malformed_requests_raise_value_error_and_change_nothing(server, line):
+  subscriber = _Subscriber('client')
+  with pytest.raises(ValueError):
+    server._request(subscriber, line)
+  assert subscriber.streams == set()
+
+
+def test_requests_take_names_and_ids(server):
+  subscriber = _Subscriber('client')
+  server._request(subscriber, b'{"subscribe": ["camera", 2]}')
+  assert subscriber.streams == {1, 2}
+  server._request(subscriber, b'{"unsubscribe": ["mic"]}')
+  assert subscriber.streams == {1}
@@ -0,0 +1,62 @@
+import os
+import threading
+
+import numpy as np
+
+from utils.metrics import Metrics
+from utils.writer import AsyncWriter
+
+# run with python -m pytest tests from the repository root
+
+INFO_DTYPE = np.dtype([('index', np.int64)])
+TIMEOUT = 5.
+
+
+class GatedWrite:
+  # write() that records what it gets and holds the writer thread on the first chunk until opened
+  def __init__(self):
+    self.written = []
+    self.started = threading.Event()
+    self.gate = threading.Event()
+
+  def __call__(self, buffer, info):
+    self.started.set()
+    assert self.gate.wait(TIMEOUT)
+    self.written.append((int(buffer[0]), None if info is None else int(info['index'])))
+
+
+def chunk(i):
+  return np.full(4, i, dtype=np.int32), np.array((i,), dtype=INFO_DTYPE)[()]
+
+
+def test_drop_oldest_keeps_the_newest_chunks():
+  write = GatedWrite()
+  metrics = Metrics()
+  writer = AsyncWriter(write, depth=2, policy='drop-oldest', metrics=metrics)
+  writer.submit(*chunk(0))
+  assert write.started.wait(TIMEOUT)  # the writer is busy with chunk 0, which holds one of the 2 buffers
+  for i in range(1, 4):
+    writer.submit(*chunk(i))  # 2 and 3 each reuse the buffer of the oldest queued chunk
+  assert writer.queued == 1
+  write.gate.set()
+  writer.close()
+  assert write.written == [(0, 0), (3, 3)]
+  assert metrics.snapshot['counters']['writer dropped'] == 2
+
+
+def test_spilled_chunks_are_replayed_in_order(tmp_path):
+  write = GatedWrite()
+  metrics = Metrics()
+  spill_path = str(tmp_path / 'writer.spill')
+  writer = AsyncWriter(write, depth=2, policy='spill', spill_path=spill_path, metrics=metrics)
+  writer.submit(*chunk(0))
+  assert write.started.wait(TIMEOUT)
+  for i in range(1, 6):
+    writer.submit(*chunk(i))  # 1 takes the free buffer, 2 to 5 go to disk
+  assert writer.queued == 5
+  assert metrics.snapshot['counters']['writer spilled'] == 4
+  write.gate.set()
+  writer.submit(*chunk(6))  # still after the spilled ones, whenever the writer catches up
+  writer.close()
+  assert write.written == [(i, i) for i in range(7)]
+  assert not os.path.exists(spill_path)
@@ -4,6 +4,7 @@ import scipy.signal as sig
 from nptdms import TdmsFile
 import os
 import scipy.io as sio
+import scipy.io.wavfile as wavfile
 
 sample_rate = 2.5e5
 
@@ -24,6 +25,28 @@ def read_audio(path, raw_data_flag=False):
             raw_data = None
         return data, raw_data
 
+# samples start .. stop - 1 of the first channel of a tdms, wav or flac recording, and its sample rate,
+# without reading the rest of the file
+def read_audio_range(path, start, stop):
+    extension = os.path.splitext(path)[1].lower()
+    if extension == '.tdms':
+        with TdmsFile.open(path) as file:
+            channel = file.groups()[0].channels()[0]
+            increment = channel.properties.get('wf_increment')
+            rate = 1 / increment if increment else sample_rate
+            start, stop = min(start, len(channel)), min(stop, len(channel))
+            data = channel.read_data(start, stop - start) if stop > start else np.zeros(0, dtype=np.float32)
+            return data, rate
+    if extension == '.wav':
+        rate, data = wavfile.read(path, mmap=True)
+    else:
+        import soundfile  # only needed for flac
+        data, rate = soundfile.read(path, start=start, stop=stop, dtype='float32', always_2d=True)
+        return data[:, 0], rate
+    if data.ndim > 1:
+        data = data[:, 0]
+    return np.array(data[start:stop]), rate
+
 # resampling
 def audio_resample(data:np.ndarray, old_samprate, new_samprate):
     new_sample_size = int(data.size * new_samprate/old_samprate)
@@ -0,0 +1,236 @@
+import json
+import os
+
+import numpy as np
+import scipy.fft
+from scipy import signal
+
+from utils.audio_processing import read_audio_range
+
+# a decimated summary of an audio recording for browsing it without loading it: a directory of
+# memory-mappable files next to the recording, written while recording (Mic and Nidaq) or afterwards
+# with build_pyramid().
+#
+#   <name>.pyramid/manifest.json     sample rate and the layout of the levels below
+#   <name>.pyramid/envelope0.raw     float32 (min, max, rms) of every ENVELOPE_BASE samples
+#   <name>.pyramid/envelope1.raw     the same for every LEVEL_FACTOR bins of envelope0, and so on
+#   <name>.pyramid/spectrogram0.raw  uint8 (columns, SPECTROGRAM_ROWS) power spectra of consecutive
+#                                    SPECTROGRAM_WINDOW sample windows, see decibels()
+#   <name>.pyramid/spectrogram1.raw  mean power of every LEVEL_FACTOR columns of spectrogram0, and so on
+#
+# level k holds one record per ENVELOPE_BASE * LEVEL_FACTOR**k (or SPECTROGRAM_WINDOW * LEVEL_FACTOR**k)
+# samples, so a viewer picks the coarsest level that still gives it a record per pixel, see
+# AudioPyramidReader.level(). At 250 kHz the coarsest levels hold a record per 34 s (envelope) and per
+# 134 s (spectrogram): a whole session is a few kB. Below the finest level, read the recording itself
+# with read_audio_range(). The last record of each level may cover fewer samples than the others.
+PYRAMID_EXT = '.pyramid'
+PYRAMID_VERSION = 1
+MANIFEST = 'manifest.json'
+ENVELOPE_BASE = 256  # samples per bin of envelope0, ~1 ms at 250 kHz
+SPECTROGRAM_WINDOW = 1024  # samples per column of spectrogram0, a multiple of ENVELOPE_BASE
+SPECTROGRAM_ROWS = 128  # frequency rows, each summing SPECTROGRAM_WINDOW // 2 // SPECTROGRAM_ROWS FFT bins
+SPECTROGRAM_DB = (-140., 20.)  # dB (re 1 input unit squared) stored as 0 and 255
+LEVEL_FACTOR = 8
+LEVELS = 6
+TILE_COLUMNS = 256  # spectrogram columns per tile, see AudioPyramidReader.tile()
+_EPS = 1e-30
+
+
+def pyramid_path(audio_path):
+  # e.g. 'Dodo_audio.tdms' -> 'Dodo_audio.pyramid'
+  return os.path.splitext(audio_path)[0] + PYRAMID_EXT
+
+
+def _level_path(path, kind, level):
+  return os.path.join(path, f'{kind}{level}.raw')
+
+
+def _write_manifest(path, manifest):
+  # replace rather than rewrite, so a reader never sees half a manifest
+  temp_path = os.path.join(path, MANIFEST + '.tmp')
+  with open(temp_path, 'w') as f:
+    json.dump(manifest, f)
+  os.replace(temp_path, os.path.join(path, MANIFEST))
+
+
+def decibels(image):
+  # the stored uint8 spectrogram levels in dB
+  low, high = SPECTROGRAM_DB
+  return low + image.astype(np.float32) * ((high - low) / 255)
+
+
+def spectrogram_rows(sample_rate):
+  # center frequency of each spectrogram row in Hz
+  bins = SPECTROGRAM_WINDOW // 2 // SPECTROGRAM_ROWS
+  return (np.arange(SPECTROGRAM_ROWS) * bins + (bins - 1) / 2) * sample_rate / SPECTROGRAM_WINDOW
+
+
+def _merge_envelope(records):
+  # (n * LEVEL_FACTOR or fewer, 3) -> one (min, max, rms) per group of LEVEL_FACTOR
+  groups = records.reshape(-1, min(len(records), LEVEL_FACTOR), 3)
+  return np.stack([groups[:, :, 0].min(axis=1), groups[:, :, 1].max(axis=1),
+                   np.sqrt((groups[:, :, 2] ** 2).mean(axis=1))], axis=1)
+
+
+def _merge_power(records):
+  return records.reshape(-1, min(len(records), LEVEL_FACTOR), records.shape[1]).mean(axis=1)
+
+
+class AudioPyramidWriter:
+  # write() takes the recording's samples (one channel) in chunks of any size, close() writes the rest
+
+  def __init__(self, path, sample_rate):
+    self.path = path
+    self.count = 0  # samples written
+    os.makedirs(path, exist_ok=True)
+    self._manifest = {
+        'version': PYRAMID_VERSION,
+        'sample rate': sample_rate,
+        'levels': LEVELS,
+        'envelope samples': [ENVELOPE_BASE * LEVEL_FACTOR ** k for k in range(LEVELS)],  # per bin
+        'spectrogram samples': [SPECTROGRAM_WINDOW * LEVEL_FACTOR ** k for k in range(LEVELS)],  # per column
+        'frequencies': spectrogram_rows(sample_rate).tolist(),  # Hz, center of each row
+        'decibels': list(SPECTROGRAM_DB),
+        'count': 0,  # samples, once complete
+        'complete': False,
+    }
+    _write_manifest(path, self._manifest)
+    self._files = {kind: [open(_level_path(path, kind, k), 'wb') for k in range(LEVELS)]
+                   for kind in ('envelope', 'spectrogram')}
+    self._pending = {'envelope': [np.zeros((0, 3), np.float32) for _ in range(LEVELS)],
+                     'spectrogram': [np.zeros((0, SPECTROGRAM_ROWS), np.float32) for _ in range(LEVELS)]}
+    self._carry = np.zeros(0, dtype=np.float32)
+    self._taper = signal.get_window('hann', SPECTROGRAM_WINDOW).astype(np.float32)
+    self._scale = 1 / self._taper.sum() ** 2  # a sine of amplitude a peaks at a**2 / 4
+
+  def write(self, samples):
+    samples = np.asarray(samples, dtype=np.float32).reshape(-1)
+    self.count += len(samples)
+    buffer = np.concatenate((self._carry, samples)) if len(self._carry) else samples
+    n = len(buffer) // SPECTROGRAM_WINDOW
+    self._carry = buffer[n * SPECTROGRAM_WINDOW:].copy()
+    if n == 0:
+      return
+    windows = buffer[:n * SPECTROGRAM_WINDOW].reshape(n, SPECTROGRAM_WINDOW)
+    self._append('envelope', 0, self._envelope(windows.reshape(-1, ENVELOPE_BASE)))
+    spectrum = scipy.fft.rfft(windows * self._taper, axis=1)[:, :SPECTROGRAM_WINDOW // 2]
+    power = spectrum.real ** 2 + spectrum.imag ** 2
+    self._append('spectrogram', 0, power.reshape(n, SPECTROGRAM_ROWS, -1).sum(axis=2) * self._scale)
+
+  @staticmethod
+  def _envelope(bins):
+    return np.stack([bins.min(axis=1), bins.max(axis=1), np.sqrt((bins ** 2).mean(axis=1))], axis=1)
+
+  def _append(self, kind, level, records):
+    # writes the records of this level and passes every full group of LEVEL_FACTOR on to the next
+    while len(records):
+      if kind == 'envelope':
+        self._files[kind][level].write(records.astype(np.float32).tobytes())
+      else:
+        levels = 10 * np.log10(records + _EPS)
+        low, high = SPECTROGRAM_DB
+        levels = np.clip((levels - low) * (255 / (high - low)), 0, 255).round().astype(np.uint8)
+        self._files[kind][level].write(levels.tobytes())
+      level += 1
+      if level == LEVELS:
+        return
+      pending = np.concatenate((self._pending[kind][level], records))
+      n = len(pending) // LEVEL_FACTOR * LEVEL_FACTOR
+      self._pending[kind][level] = pending[n:]
+      merge = _merge_envelope if kind == 'envelope' else _merge_power
+      records = merge(pending[:n]) if n else pending[:0]
+
+  def close(self):
+    # the samples left over make one more (shorter) envelope bin; they are too few for a spectrogram column
+    if len(self._carry):
+      bins = len(self._carry) // ENVELOPE_BASE
+      records = [self._envelope(self._carry[:bins * ENVELOPE_BASE].reshape(bins, ENVELOPE_BASE))]
+      if len(self._carry) % ENVELOPE_BASE:
+        records.append(self._envelope(self._carry[bins * ENVELOPE_BASE:][np.newaxis]))
+      self._append('envelope', 0, np.concatenate(records))
+      self._carry = self._carry[:0]
+    for kind in self._pending:
+      merge = _merge_envelope if kind == 'envelope' else _merge_power
+      for level in range(1, LEVELS):
+        pending = self._pending[kind][level]
+        if len(pending):
+          self._pending[kind][level] = pending[:0]
+          self._append(kind, level, merge(pending))
+      for f in self._files[kind]:
+        f.close()
+    self._manifest['count'] = self.count
+    self._manifest['complete'] = True
+    _write_manifest(self.path, self._manifest)
+
+
+class AudioPyramidReader:
+  # read-only, memory-mapped access to a pyramid; works while it is still being written, every call sees
+  # the records written so far
+  #   reader = AudioPyramidReader(pyramid_path('Dodo_audio.wav'))
+  #   level = reader.level('envelope', stop - start, 1000)
+  #   envelope = reader.envelope(level, start, stop)  # (bins, 3): min, max, rms
+
+  def __init__(self, path):
+    self.path = path
+    with open(os.path.join(path, MANIFEST)) as f:
+      manifest = json.load(f)
+    if manifest['version'] != PYRAMID_VERSION:
+      raise Exception(f'{path} is not a version {PYRAMID_VERSION} audio pyramid')
+    self.sample_rate = manifest['sample rate']
+    self.levels = manifest['levels']
+    self.samples = {'envelope': manifest['envelope samples'], 'spectrogram': manifest['spectrogram samples']}
+    self.frequencies = np.array(manifest['frequencies'])
+    self._maps = {}
+
+  def _map(self, kind, level):
+    path = _level_path(self.path, kind, level)
+    shape = (3,) if kind == 'envelope' else (SPECTROGRAM_ROWS,)
+    dtype = np.dtype(np.float32 if kind == 'envelope' else np.uint8)
+    n = os.path.getsize(path) // (dtype.itemsize * shape[0])
+    cached = self._maps.get((kind, level))
+    if cached is None or len(cached) != n:
+      cached = np.memmap(path, dtype=dtype, mode='r', shape=(n,) + shape) if n else np.zeros((0,) + shape, dtype)
+      self._maps[kind, level] = cached
+    return cached
+
+  def level(self, kind, span, pixels):
+    # the coarsest level with at least `pixels` records over `span` samples, or the finest
+    for level in reversed(range(self.levels)):
+      if span / self.samples[kind][level] >= pixels:
+        return level
+    return 0
+
+  def _records(self, kind, level, start, stop):
+    # the records of a level that cover samples start .. stop - 1
+    samples = self.samples[kind][level]
+    return self._map(kind, level)[start // samples:-(-stop // samples)]
+
+  def envelope(self, level, start, stop):
+    return self._records('envelope', level, start, stop)
+
+  def spectrogram(self, level, start, stop):
+    # uint8 (columns, rows), lowest frequency first; decibels() turns it into dB
+    return self._records('spectrogram', level, start, stop)
+
+  def tile(self, level, i):
+    # spectrogram columns i * TILE_COLUMNS .. (i + 1) * TILE_COLUMNS - 1 of a level
+    return self._map('spectrogram', level)[i * TILE_COLUMNS:(i + 1) * TILE_COLUMNS]
+
+  def close(self):
+    self._maps = {}
+
+
+def build_pyramid(audio_file, path=None, chunk_time=1.):
+  # writes the pyramid of an existing recording (tdms, wav or flac), chunk by chunk
+  _, sample_rate = read_audio_range(audio_file, 0, 0)
+  writer = AudioPyramidWriter(path or pyramid_path(audio_file), sample_rate)
+  chunk = int(chunk_time * sample_rate)
+  start = 0
+  while True:
+    samples, _ = read_audio_range(audio_file, start, start + chunk)
+    if len(samples) == 0:
+      break
+    writer.write(samples)
+    start += len(samples)
+  writer.close()
+  return writer.path
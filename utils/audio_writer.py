@@ -0,0 +1,117 @@
+import os
+import struct
+
+import numpy as np
+import nptdms
+
+# one audio file kept open for the whole recording, written in segments of SEGMENT_TIME seconds.
+# Before, the mic reopened its TDMS file and wrote a new segment for every PortAudio callback.
+#   'tdms'  as before, readable with utils.audio_processing.read_audio
+#   'wav'   32-bit float WAV, what ProcessingGroup.audio_processing used to convert the TDMS file into.
+#           The sizes in the header are filled in by close(); the format caps the file at 4 GB
+#   'flac'  24-bit lossless, needs the soundfile package
+AUDIO_FORMATS = ('tdms', 'wav', 'flac')
+SEGMENT_TIME = .5  # seconds of audio per segment written to the file
+
+_WAV_FLOAT = 3  # WAVE_FORMAT_IEEE_FLOAT
+_WAV_HEADER = struct.Struct('<4sI4s4sIHHIIHHH4sII4sI')  # RIFF, fmt (18 bytes), fact and data chunk headers
+_WAV_MAX_BYTES = 0xFFFFFFFF
+
+
+def audio_path(filepath, file_format):
+  # e.g. 'Dodo_audio.tdms' -> 'Dodo_audio.wav'
+  return os.path.splitext(filepath)[0] + '.' + file_format
+
+
+class _WavFile:
+  def __init__(self, path, sample_rate, channels):
+    self._file = open(path, 'wb')
+    self._sample_rate = sample_rate
+    self._channels = channels
+    self._bytes = 0
+    self._write_header()
+
+  def _write_header(self):
+    data_bytes = min(self._bytes, _WAV_MAX_BYTES - _WAV_HEADER.size)
+    block_align = 4 * self._channels
+    self._file.write(_WAV_HEADER.pack(
+        b'RIFF', _WAV_HEADER.size - 8 + data_bytes, b'WAVE',
+        b'fmt ', 18, _WAV_FLOAT, self._channels, self._sample_rate, self._sample_rate * block_align, block_align, 32, 0,
+        b'fact', 4, data_bytes // block_align,
+        b'data', data_bytes))
+
+  def write(self, samples):
+    self._file.write(samples.astype('<f4', copy=False).tobytes())
+    self._bytes += samples.nbytes
+
+  def close(self):
+    self._file.seek(0)
+    self._write_header()
+    self._file.close()
+
+
+class _FlacFile:
+  def __init__(self, path, sample_rate, channels):
+    import soundfile  # only needed for flac
+    self._channels = channels
+    self._file = soundfile.SoundFile(path, 'w', samplerate=sample_rate, channels=channels, format='FLAC',
+                                     subtype='PCM_24')
+
+  def write(self, samples):
+    np.clip(samples, -1, 1, out=samples)  # our own segment buffer, so clip in place
+    self._file.write(samples.reshape(-1, self._channels))
+
+  def close(self):
+    self._file.close()
+
+
+class _TdmsFile:
+  def __init__(self, path, group_name, channel_name):
+    self._group_name = group_name
+    self._channel_name = channel_name
+    self._file = nptdms.TdmsWriter(path, 'a')
+    self._file.open()
+
+  def write(self, samples):
+    self._file.write_segment([nptdms.ChannelObject(self._group_name, self._channel_name, samples, properties={})])
+
+  def close(self):
+    self._file.close()
+
+
+class AudioWriter:
+  # used from the mic's AsyncWriter thread: write() copies each chunk into the current segment and
+  # writes the segment once it is full; close() writes what is left
+
+  def __init__(self, path, file_format, sample_rate, channels=1, group_name=None, channel_name=None):
+    if file_format not in AUDIO_FORMATS:
+      raise ValueError(f'Unknown audio format {file_format}, expected one of {AUDIO_FORMATS}')
+    self.path = path
+    self.file_format = file_format
+    if file_format == 'tdms':
+      self._file = _TdmsFile(path, group_name, channel_name)
+    elif file_format == 'wav':
+      self._file = _WavFile(path, sample_rate, channels)
+    else:
+      self._file = _FlacFile(path, sample_rate, channels)
+    self._segment = np.empty(int(SEGMENT_TIME * sample_rate) * channels, dtype=np.float32)
+    self._filled = 0
+
+  def write(self, data):
+    data = data.reshape(-1)
+    while len(data):
+      n = min(len(data), len(self._segment) - self._filled)
+      self._segment[self._filled:self._filled + n] = data[:n]
+      self._filled += n
+      data = data[n:]
+      if self._filled == len(self._segment):
+        self.flush()
+
+  def flush(self):
+    if self._filled:
+      self._file.write(self._segment[:self._filled])
+      self._filled = 0
+
+  def close(self):
+    self.flush()
+    self._file.close()
@@ -0,0 +1,140 @@
+import numpy as np
+import scipy.fft
+from scipy import signal
+
+# streaming ultrasonic vocalization detector for the Nidaq audio, run live by Nidaq.do_process()
+#
+# every FRAME_TIME window (hopping by half of it) gets two features from one batched real FFT:
+#   band energy    power in CALL_BAND, in dB above a running noise floor
+#   entropy        spectral entropy within the band, normalized to [0, 1]: tonal calls are low,
+#                  broadband clicks and noise close to 1
+# a call starts when the band energy rises ON_DB above the floor in a frame with entropy below
+# MAX_ENTROPY, and ends once it has stayed below OFF_DB for MAX_GAP_TIME (hysteresis). Its onset is
+# dated back to where the energy first rose above OFF_DB. Calls shorter than MIN_CALL_TIME are dropped.
+# The floor follows the band energy of the frames outside calls.
+#
+# times are sample indices on the DAQ's sample clock (sample 0 is the first sample of the run), to
+# the resolution of one hop
+CALL_BAND = (30e3, 110e3)  # Hz, mouse USVs
+FRAME_TIME = .002  # seconds per analysis window
+ON_DB = 12
+OFF_DB = 6
+MAX_ENTROPY = .8
+MIN_CALL_TIME = .005  # seconds
+MAX_GAP_TIME = .01  # seconds
+FLOOR_TIME = 1.  # seconds over which the noise floor adapts
+_EPS = 1e-20
+
+
+class CallDetector:
+
+  def __init__(self, sample_rate, band=CALL_BAND, frame_time=FRAME_TIME, on_db=ON_DB, off_db=OFF_DB,
+               max_entropy=MAX_ENTROPY, min_call_time=MIN_CALL_TIME, max_gap_time=MAX_GAP_TIME):
+    self.sample_rate = sample_rate
+    self.window = int(frame_time * sample_rate)
+    self.hop = self.window // 2
+    self.on_db = on_db
+    self.off_db = off_db
+    self.max_entropy = max_entropy
+    self.min_frames = max(1, int(round(min_call_time * sample_rate / self.hop)))
+    self.max_gap_frames = max(1, int(round(max_gap_time * sample_rate / self.hop)))
+    self._floor_weight = self.hop / (FLOOR_TIME * sample_rate)
+
+    self._taper = signal.get_window('hann', self.window).astype(np.float32)
+    frequencies = scipy.fft.rfftfreq(self.window, 1 / sample_rate)
+    self._band = (frequencies >= band[0]) & (frequencies <= band[1])
+    if self._band.sum() < 2:
+      raise ValueError(f'The call band {band} Hz holds no frequencies at a sample rate of {sample_rate} Hz')
+    self._frequencies = frequencies[self._band]
+
+    self._carry = np.zeros(0, dtype=np.float32)
+    self._next_sample = None  # first sample of the next chunk, if it continues the last one
+    self._floor = None  # running noise floor in dB
+    self._call = None  # the call in progress, see _frame()
+    self._quiet = 0  # frames since the call in progress was last above OFF_DB
+    self._rise = None  # first sample of the current run of frames above OFF_DB, outside calls
+
+  @property
+  def next_sample(self):
+    # first sample of the chunk that would continue the last one, None before the first chunk
+    return self._next_sample
+
+  def process(self, samples, start_sample):
+    # samples is the next chunk and start_sample the index of its first sample; returns the
+    # [{'event': 'call onset' or 'call offset', 'sample', ...}] that the chunk completed
+    samples = np.asarray(samples, dtype=np.float32).reshape(-1)
+    events = []
+    if self._next_sample is not None and start_sample != self._next_sample:
+      # chunks were skipped: the carried samples do not belong in front of these
+      events += self._end_call(self._next_sample, truncated=True)
+      self._carry = self._carry[:0]
+      self._rise = None
+    buffer = np.concatenate((self._carry, samples))
+    buffer_start = start_sample - len(self._carry)
+    self._next_sample = start_sample + len(samples)
+
+    n = (len(buffer) - self.window) // self.hop + 1 if len(buffer) >= self.window else 0
+    if n > 0:
+      frames = np.lib.stride_tricks.sliding_window_view(buffer, self.window)[::self.hop][:n]
+      spectrum = scipy.fft.rfft(frames * self._taper, axis=1)[:, self._band]
+      power = spectrum.real ** 2 + spectrum.imag ** 2
+      band_power = power.sum(axis=1) + _EPS
+      energy = 10 * np.log10(band_power)
+      p = power / band_power[:, np.newaxis]
+      entropy = -(p * np.log(p + _EPS)).sum(axis=1) / np.log(power.shape[1])
+      peak = self._frequencies[power.argmax(axis=1)]
+      if self._floor is None:
+        self._floor = float(np.median(energy))
+      for i in range(n):
+        events += self._frame(buffer_start + i * self.hop, energy[i], entropy[i], peak[i])
+    self._carry = buffer[n * self.hop:]
+    return events
+
+  def _frame(self, sample, energy, entropy, peak):
+    level = energy - self._floor
+    call = self._call
+    if call is None:
+      if level < self.off_db:
+        self._rise = None
+      elif self._rise is None:
+        self._rise = sample
+      if level >= self.on_db and entropy <= self.max_entropy:
+        self._call = {'onset': self._rise, 'frames': 1, 'announced': False, 'peak level': level,
+                      'peak frequency': peak}
+        self._quiet = 0
+        self._rise = None
+      else:
+        self._floor += self._floor_weight * (energy - self._floor)
+      return []
+
+    if level >= self.off_db:
+      call['frames'] += 1
+      self._quiet = 0
+      if level > call['peak level']:
+        call['peak level'], call['peak frequency'] = level, peak
+    else:
+      self._quiet += 1
+      if self._quiet >= self.max_gap_frames:
+        return self._end_call(sample - self._quiet * self.hop + self.window)  # end of the last loud window
+    if not call['announced'] and call['frames'] >= self.min_frames:
+      call['announced'] = True
+      return [{'event': 'call onset', 'sample': call['onset'], 'time': call['onset'] / self.sample_rate}]
+    return []
+
+  def _end_call(self, end_sample, truncated=False):
+    # end_sample is the first sample after the call
+    call, self._call = self._call, None
+    if call is None or not call['announced']:
+      return []
+    event = {'event': 'call offset', 'sample': end_sample, 'time': end_sample / self.sample_rate,
+             'onset sample': call['onset'], 'duration': (end_sample - call['onset']) / self.sample_rate,
+             'peak frequency': float(call['peak frequency']), 'peak level': float(call['peak level'])}
+    if truncated:
+      event['truncated'] = True
+    return [event]
+
+  def close(self):
+    # ends a call still in progress at the last sample seen
+    if self._next_sample is None:
+      return []
+    return self._end_call(self._next_sample, truncated=True)
@@ -3,6 +3,7 @@ import os
 import threading
 
 DLC_LIVE_MODEL_PATH=r'C:\Users\SchwartzLab\PycharmProjects\bahavior_rig\DLC\Alec_second_try-Devon-2020-12-07\exported-models\DLC_Alec_second_try_resnet_50_iteration-0_shuffle-1'
+DLC_LIVE_SIDE_MODEL_PATH=None  # no live model exported for the side cameras yet, so they are not analyzed live
 TOP_THRESHOLD=0.85
 SIDE_THRESHOLD=0.5
 
@@ -0,0 +1,117 @@
+import os
+import shutil
+import subprocess
+import tempfile
+import threading
+import time
+
+import ffmpeg
+import numpy as np
+
+# named ffmpeg output settings for the camera videos, selectable with status['encoder profile']
+# 'container' forces a file extension when the profile's codec does not fit the requested one
+ENCODER_PROFILES = {
+    'x265': {  # what Camera always used: small files, but the most expensive encoder by far
+        'container': None,
+        'output': {'vcodec': 'libx265'},
+    },
+    'x265 tuned': {
+        'container': None,
+        'output': {'vcodec': 'libx265', 'preset': 'ultrafast', 'tune': 'zerolatency', 'crf': 24,
+                   'x265-params': 'log-level=error'},
+    },
+    'x264 ultrafast': {
+        'container': None,
+        'output': {'vcodec': 'libx264', 'preset': 'ultrafast', 'crf': 18},
+    },
+    'lossless fast': {  # intra-only ffv1: every frame is a keyframe, so seeking is exact
+        'container': None,
+        'output': {'vcodec': 'ffv1', 'level': 3, 'g': 1, 'slices': 4},
+    },
+    'raw': {  # no compression at all, limited only by disk bandwidth
+        'container': '.avi',  # raw gray frames do not survive a round trip through .MOV
+        'output': {'vcodec': 'rawvideo'},
+    },
+}
+DEFAULT_ENCODER_PROFILE = 'x265'
+BENCHMARK_TIME = 2  # seconds each encoder runs in benchmark()
+BENCHMARK_FRAMES = 16  # distinct synthetic frames cycled through during benchmark()
+SENSOR_NOISE = 8  # standard deviation of the noise added to the synthetic frames, in gray levels
+LOW_PRIORITY_NICENESS = 19
+
+
+def profile_path(filepath, profile):
+  # the path the video is actually written to with this profile
+  container = ENCODER_PROFILES[profile]['container']
+  if container is None or filepath.lower().endswith(container):
+    return filepath
+  return os.path.splitext(filepath)[0] + container
+
+
+def open_encoder(filepath, width, height, frame_rate, profile=DEFAULT_ENCODER_PROFILE, low_priority=False):
+  # ffmpeg process taking raw gray frames on stdin
+  # low_priority leaves the cpu to everything else, for encoding that is allowed to lag (see raw_store.Transcoder)
+  stream = ffmpeg \
+      .input('pipe:', format='rawvideo', pix_fmt='gray', s=f'{width}x{height}', framerate=frame_rate) \
+      .output(profile_path(filepath, profile), **ENCODER_PROFILES[profile]['output']) \
+      .overwrite_output() \
+      .global_args('-loglevel', 'error')
+  if not low_priority:
+    return stream.run_async(pipe_stdin=True, quiet=True)
+
+  pipes = {'stdin': subprocess.PIPE, 'stdout': subprocess.PIPE, 'stderr': subprocess.PIPE}
+  if os.name == 'nt':
+    return subprocess.Popen(stream.compile(), creationflags=subprocess.IDLE_PRIORITY_CLASS, **pipes)
+  process = subprocess.Popen(stream.compile(), **pipes)
+  os.setpriority(os.PRIO_PROCESS, process.pid, LOW_PRIORITY_NICENESS)
+  return process
+
+
+def synthetic_frames(width, height, n=BENCHMARK_FRAMES):
+  # a bright blob moving over a static gradient, plus sensor noise; noise is what makes encoders work
+  rng = np.random.default_rng(0)
+  y, x = np.mgrid[:height, :width]
+  background = 64 + 64 * x / width
+  frames = []
+  for i in range(n):
+    cx, cy = width * (.2 + .6 * i / n), height / 2
+    blob = 100 * np.exp(-((x - cx) ** 2 + (y - cy) ** 2) / (2 * (height / 10) ** 2))
+    frame = background + blob + rng.normal(0, SENSOR_NOISE, (height, width))
+    frames.append(np.clip(frame, 0, 255).astype(np.uint8))
+  return frames
+
+
+def benchmark(profile, width, height, streams=1, seconds=BENCHMARK_TIME):
+  # sustainable frame rate of a profile on this machine: `streams` encoders (one per camera) are fed
+  # as fast as they accept frames; the slowest one counts, including the time to flush at the end
+  frames = synthetic_frames(width, height)
+  directory = tempfile.mkdtemp(prefix='encoder_benchmark_')
+  results = [None] * streams
+
+  def feed(i):
+    path = profile_path(os.path.join(directory, f'{i}.MOV'), profile)
+    encoder = open_encoder(path, width, height, 30, profile)
+    start = time.perf_counter()
+    count = 0
+    try:
+      while time.perf_counter() - start < seconds:
+        encoder.stdin.write(frames[count % len(frames)].tobytes())
+        count += 1
+      encoder.stdin.close()
+    except BrokenPipeError:  # the encoder is not available in this ffmpeg build
+      results[i] = (0., 0.)
+      return
+    finally:
+      encoder.wait()
+    results[i] = (count / (time.perf_counter() - start), os.path.getsize(path) / count)
+
+  threads = [threading.Thread(target=feed, args=(i,), name=f'encoder benchmark {i}') for i in range(streams)]
+  for thread in threads:
+    thread.start()
+  for thread in threads:
+    thread.join()
+  shutil.rmtree(directory, ignore_errors=True)
+  return {
+      'fps': min(fps for fps, _ in results),
+      'bytes per frame': float(np.mean([size for _, size in results])),
+  }
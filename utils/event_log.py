@@ -0,0 +1,45 @@
+import collections
+import json
+import threading
+import time
+
+EVENT_HISTORY = 1000  # events kept in memory for clients that ask what they missed
+
+
+class EventLog:
+  # events of a session, e.g. the live call detections of utils/call_detector.py: kept in memory
+  # for the GUI (see socketApp.py) and, while recording, appended to a json lines file
+  # every event gets an increasing 'id' and the host time it was logged, 'logged'
+
+  def __init__(self, history=EVENT_HISTORY):
+    self._lock = threading.Lock()
+    self._events = collections.deque(maxlen=history)
+    self._next_id = 1
+    self._file = None
+
+  def open(self, path):
+    with self._lock:
+      if self._file is not None:
+        self._file.close()
+      self._file = open(path, 'a')
+
+  def close(self):
+    with self._lock:
+      if self._file is not None:
+        self._file.close()
+        self._file = None
+
+  def append(self, event):
+    with self._lock:
+      event = {'id': self._next_id, 'logged': time.time(), **event}
+      self._next_id += 1
+      self._events.append(event)
+      if self._file is not None:
+        self._file.write(json.dumps(event) + '\n')
+        self._file.flush()
+    return event
+
+  def since(self, event_id=0):
+    # the events after event_id that are still in memory
+    with self._lock:
+      return [event for event in self._events if event['id'] > event_id]
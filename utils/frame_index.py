@@ -0,0 +1,75 @@
+import os
+import numpy as np
+
+# one fixed-size record per saved frame, in the order the frames were encoded
+# record N describes encoded frame N, so seeking to a frame never needs the video itself
+FRAME_INDEX_DTYPE = np.dtype([
+    ('frame_id', '<u8'),  # camera frame counter (chunk data), gaps mean dropped frames
+    ('device_time', '<u8'),  # camera timestamp in ns
+    ('host_time', '<f8'),  # time.time() when the frame was received by the PC
+    ('position', '<u8'),  # index of the frame in the encoded stream
+])
+FRAME_INDEX_MAGIC = b'BRFRAMES'
+FRAME_INDEX_VERSION = 1
+FRAME_INDEX_HEADER = np.dtype([('magic', 'S8'), ('version', '<u4'), ('record_size', '<u4')])
+FRAME_INDEX_EXT = '.frames'
+
+
+def frame_index_path(video_path):
+  return os.path.splitext(video_path)[0] + FRAME_INDEX_EXT
+
+
+def frame_info(frame_id, device_time, host_time, out=None):
+  # metadata for one captured frame; position is filled in when the frame is encoded
+  # out is a preallocated record to fill in, e.g. PooledFrame.info
+  info = np.zeros((), dtype=FRAME_INDEX_DTYPE) if out is None else out
+  info['frame_id'] = frame_id
+  info['device_time'] = device_time
+  info['host_time'] = host_time
+  return info
+
+
+class FrameIndexWriter:
+  def __init__(self, path):
+    self.path = path
+    self.count = 0
+    self._file = open(path, 'wb')
+    header = np.zeros((), dtype=FRAME_INDEX_HEADER)
+    header['magic'] = FRAME_INDEX_MAGIC
+    header['version'] = FRAME_INDEX_VERSION
+    header['record_size'] = FRAME_INDEX_DTYPE.itemsize
+    self._file.write(header.tobytes())
+
+  def append(self, info):
+    # info comes from frame_info(); its position is the number of frames appended before it
+    info['position'] = self.count
+    self._file.write(info.tobytes())
+    self.count += 1
+
+  def close(self):
+    self._file.close()
+
+
+def read_frame_index(path):
+  # memory-mapped records, so opening a long session costs nothing until records are touched
+  header = np.fromfile(path, dtype=FRAME_INDEX_HEADER, count=1)[0]
+  if header['magic'] != FRAME_INDEX_MAGIC or header['record_size'] != FRAME_INDEX_DTYPE.itemsize:
+    raise Exception(f'{path} is not a version {FRAME_INDEX_VERSION} frame index')
+  if os.path.getsize(path) == FRAME_INDEX_HEADER.itemsize:
+    return np.zeros(0, dtype=FRAME_INDEX_DTYPE)
+  return np.memmap(path, dtype=FRAME_INDEX_DTYPE, mode='r', offset=FRAME_INDEX_HEADER.itemsize)
+
+
+def find_gaps(index):
+  # (position, missing) pairs: `missing` camera frames were dropped right before encoded frame `position`
+  steps = np.diff(index['frame_id'].astype(np.int64))
+  where = np.nonzero(steps != 1)[0]
+  return [(int(index['position'][i + 1]), int(steps[i] - 1)) for i in where]
+
+
+def position_of(index, frame_id):
+  # encoded position of a camera frame id, or None if that frame was dropped
+  i = np.searchsorted(index['frame_id'], frame_id)
+  if i < len(index) and index['frame_id'][i] == frame_id:
+    return int(index['position'][i])
+  return None
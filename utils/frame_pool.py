@@ -0,0 +1,53 @@
+import threading
+
+import numpy as np
+
+
+class PooledFrame:
+  # a preallocated frame that is passed around by reference instead of being copied
+  # every holder calls retain() when it keeps the frame and release() when it is done with it;
+  # the frame goes back to its pool once nobody holds it
+  __slots__ = ('array', 'info', '_pool', '_refs')
+
+  def __init__(self, pool, shape, dtype, info_dtype):
+    self.array = np.empty(shape, dtype=dtype)
+    self.info = np.zeros((), dtype=info_dtype) if info_dtype is not None else None  # metadata travelling with the frame
+    self._pool = pool
+    self._refs = 0
+
+  def retain(self):
+    with self._pool._cond:
+      self._refs += 1
+
+  def release(self):
+    with self._pool._cond:
+      self._refs -= 1
+      if self._refs == 0:
+        self._pool._free.append(self)
+        self._pool._cond.notify()
+
+
+class FramePool:
+  # fixed set of PooledFrames, allocated once; acquire() blocks while every frame is held somewhere,
+  # which puts back-pressure on the producer exactly like a full writer queue would
+
+  def __init__(self, n_frames, shape, dtype=np.uint8, info_dtype=None):
+    self.size = n_frames
+    self.shape = tuple(shape)
+    self.dtype = np.dtype(dtype)
+    self._cond = threading.Condition()
+    self._free = [PooledFrame(self, self.shape, self.dtype, info_dtype) for _ in range(n_frames)]
+
+  @property
+  def free(self):
+    with self._cond:
+      return len(self._free)
+
+  def acquire(self, timeout=None):
+    # a free frame, held once by the caller, or None on timeout
+    with self._cond:
+      if not self._cond.wait_for(lambda: self._free, timeout):
+        return None
+      frame = self._free.pop()
+      frame._refs = 1
+      return frame
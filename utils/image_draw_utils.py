@@ -1,5 +1,6 @@
 import PIL
 import cv2
+import numpy as np
 import colorcet as cc
 from utils.dlc_utils import TOP_THRESHOLD
 
@@ -36,4 +37,33 @@ def draw_dots(frame, pose=None):
 					y=pose[i,1]
 					cv2.circle(frame, (int(x),int(y)), 6, 255, -1)
 				except Exception as e:
-					print(e)
\ No newline at end of file
+					print(e)
+
+def dots_overlay(pose, threshold=TOP_THRESHOLD, radius=6, color=255):
+	# the dots draw_dots() would draw, as an overlay item for draw_overlay() or a client
+	return {'type': 'points', 'points': np.asarray(pose, dtype=float)[:, :3].tolist(),
+	        'threshold': threshold, 'radius': radius, 'color': color}
+
+
+def text_overlay(text, position, scale, color):
+	return {'type': 'text', 'text': text, 'position': list(position), 'scale': scale,
+	        'color': color if np.isscalar(color) else list(color)}
+
+
+def draw_overlay(frame, overlay):
+	# rasterizes the items of an overlay, e.g. from Camera.overlay(), into frame
+	for item in overlay['items']:
+		if item['type'] == 'points':
+			for x, y, likelihood in item['points']:
+				if likelihood > item['threshold']:
+					cv2.circle(frame, (int(x), int(y)), item['radius'], item['color'], -1)
+		elif item['type'] == 'markers':
+			corners = [np.array(c, dtype=np.float32).reshape(1, 4, 2) for c in item['corners']]
+			ids = None if item['ids'] is None else np.array(item['ids'], dtype=np.int32).reshape(-1, 1)
+			cv2.aruco.drawDetectedMarkers(frame, corners, ids, borderColor=item['color'])
+		elif item['type'] == 'chessboard':
+			corners = np.array(item['corners'], dtype=np.float32).reshape(-1, 1, 2)
+			cv2.drawChessboardCorners(frame, tuple(item['pattern']), corners, item['found'])
+		elif item['type'] == 'text':
+			color = item['color'] if np.isscalar(item['color']) else tuple(item['color'])
+			cv2.putText(frame, item['text'], tuple(item['position']), cv2.FONT_HERSHEY_PLAIN, item['scale'], color, 2)
@@ -0,0 +1,191 @@
+import glob
+import os
+import threading
+import time
+
+import cv2
+import numpy as np
+import toml
+
+from utils.metrics import Metrics
+from utils.path_operation_utils import global_config_path as GLOBAL_CONFIG_PATH
+
+# 3D keypoints while DLC Live runs, the live counterpart of triangulation_utils.reconstruct_3d() and
+# kalman_filter.triangulate_kalman(). The pose service hands every pose to add_pose(); poses are
+# matched across cameras by the camera frame id, which counts hardware triggers and so is the same on
+# every camera for the same exposure. Once every active camera has sent its pose for that frame or a
+# later one (or a pose MAX_DELAY_FRAMES later has come in), the frame is
+#   undistorted     with the cached intrinsics, to normalized image coordinates
+#   triangulated    by DLT for all keypoints at once: one batched SVD of (keypoints, 2 * cameras, 4)
+#   filtered        by one forward step of a constant velocity Kalman filter per keypoint
+# and the result goes to on_points(). Keypoints below SCORE_THRESHOLD, or seen by fewer than two
+# cameras, count as missing: the filter then only predicts, for up to MAX_COAST_FRAMES frames.
+#
+# coordinates are in the units of the extrinsic calibration, in the frame of its camera 0
+BODYPARTS = ('snout', 'leftear', 'rightear', 'tailbase')  # rows of the DLC Live pose, in the model's order
+SCORE_THRESHOLD = .7  # as triangulation_utils.THRESHOLD
+EXTRINSIC_CORRECTIONS = {1: [-.9, -1.6, -.55351041]}  # translations replaced by hand, as in reconstruct_3d()
+MAX_DELAY_FRAMES = 10  # frames a pose waits for the other cameras
+STALE_FRAMES = 30  # a camera that sent nothing for this many frames is no longer waited for
+MAX_COAST_FRAMES = 15  # frames a keypoint is predicted without measurements before it is dropped
+PROCESS_NOISE = 50.  # white acceleration noise, units**2 / s**3
+MEASUREMENT_NOISE = .1  # variance of a triangulated point, units**2
+INITIAL_SPEED_VARIANCE = 100.  # units**2 / s**2
+
+
+def load_rig_calibration(config_path=GLOBAL_CONFIG_PATH):
+  # {serial number: {'camera_mat', 'dist_coeff', 'fisheye', 'extrinsic'}} from the config dir, with the
+  # extrinsics numbered in the order of the sorted intrinsic files, like kalman_filter.get_cam_mat()
+  intrinsic_paths = sorted(glob.glob(os.path.join(config_path, 'config_intrinsic_*.toml')))
+  extrinsics = toml.load(os.path.join(config_path, 'config_extrinsic.toml'))['extrinsic']
+  calibration = {}
+  for i, path in enumerate(intrinsic_paths):
+    intrinsic = toml.load(path)
+    serial = str(intrinsic.get('camera_serial_number', os.path.basename(path)[len('config_intrinsic_'):-len('.toml')]))
+    extrinsic = np.array(extrinsics[str(i)], dtype=float)[:3]
+    if i in EXTRINSIC_CORRECTIONS:
+      extrinsic[:, 3] = EXTRINSIC_CORRECTIONS[i]
+    dist = np.array(intrinsic['dist_coeff'], dtype=float).reshape(-1)
+    calibration[serial] = {'camera_mat': np.array(intrinsic['camera_mat'], dtype=float), 'dist_coeff': dist,
+                           'fisheye': len(dist) == 4, 'extrinsic': extrinsic}
+  return calibration
+
+
+def undistort(points, calibration):
+  # (n, 2) pixel coordinates -> (n, 2) normalized image coordinates
+  points = np.ascontiguousarray(points, dtype=np.float64).reshape(-1, 1, 2)
+  if calibration['fisheye']:
+    return cv2.fisheye.undistortPoints(points, calibration['camera_mat'], calibration['dist_coeff']).reshape(-1, 2)
+  return cv2.undistortPoints(points, calibration['camera_mat'], calibration['dist_coeff']).reshape(-1, 2)
+
+
+def triangulate_dlt(points, valid, projections):
+  # points (cameras, keypoints, 2) normalized, valid (cameras, keypoints), projections (cameras, 3, 4)
+  # -> (keypoints, 3), nan where fewer than two cameras are valid
+  rows = np.concatenate([points[:, :, 0, np.newaxis] * projections[:, np.newaxis, 2] - projections[:, np.newaxis, 0],
+                         points[:, :, 1, np.newaxis] * projections[:, np.newaxis, 2] - projections[:, np.newaxis, 1]])
+  weights = np.concatenate([valid, valid]).astype(float)  # rows of invalid views drop out of the fit
+  a = np.nan_to_num(rows * weights[:, :, np.newaxis]).transpose(1, 0, 2)  # (keypoints, 2 * cameras, 4)
+  _, _, vh = np.linalg.svd(a)
+  homogeneous = vh[:, -1]
+  p3d = homogeneous[:, :3] / homogeneous[:, 3:]
+  p3d[valid.sum(axis=0) < 2] = np.nan
+  return p3d
+
+
+class KeypointFilter:
+  # forward-only constant velocity Kalman filter, one (position, velocity) state per keypoint
+
+  def __init__(self, n_keypoints):
+    self.x = np.full((n_keypoints, 6), np.nan)
+    self.P = np.zeros((n_keypoints, 6, 6))
+    self.missed = np.zeros(n_keypoints, dtype=int)
+
+  def step(self, z, dt):
+    # z is (keypoints, 3) with nan for missing measurements; returns the filtered positions
+    F = np.eye(6)
+    F[:3, 3:] = dt * np.eye(3)
+    q = PROCESS_NOISE * np.block([[dt ** 3 / 3 * np.eye(3), dt ** 2 / 2 * np.eye(3)],
+                                  [dt ** 2 / 2 * np.eye(3), dt * np.eye(3)]])
+    self.x = self.x @ F.T
+    self.P = F @ self.P @ F.T + q
+
+    measured = ~np.isnan(z).any(axis=1)
+    tracked = ~np.isnan(self.x[:, 0])
+    new = measured & ~tracked
+    self.x[new] = np.concatenate([z[new], np.zeros((new.sum(), 3))], axis=1)
+    self.P[new] = np.diag([MEASUREMENT_NOISE] * 3 + [INITIAL_SPEED_VARIANCE] * 3)
+
+    update = measured & tracked
+    if update.any():
+      P = self.P[update]
+      S = P[:, :3, :3] + MEASUREMENT_NOISE * np.eye(3)
+      K = P[:, :, :3] @ np.linalg.inv(S)  # (n, 6, 3)
+      innovation = z[update] - self.x[update, :3]
+      self.x[update] += (K @ innovation[:, :, np.newaxis])[:, :, 0]
+      self.P[update] = P - K @ P[:, :3, :]
+
+    self.missed[measured] = 0
+    self.missed[~measured] += 1
+    lost = self.missed > MAX_COAST_FRAMES
+    self.x[lost] = np.nan
+    return self.x[:, :3].copy()
+
+
+class LiveTriangulator:
+  # add_pose() is PoseService's on_pose; on_points(result) receives every triangulated frame:
+  #   {'frame id', 'host time', 'bodyparts', 'points' (filtered), 'raw' (triangulated), 'cameras' (per keypoint)}
+  # with nan for keypoints that are not known
+
+  def __init__(self, frame_rate, calibration=None, bodyparts=BODYPARTS, on_points=None):
+    self.frame_rate = frame_rate
+    self.calibration = load_rig_calibration() if calibration is None else calibration
+    self.bodyparts = list(bodyparts)
+    self.on_points = on_points
+    self.metrics = Metrics()
+    self.latest = None  # the last result passed to on_points
+    self._lock = threading.Lock()
+    self._pending = {}  # frame id: {serial: (pose, host time)}
+    self._last_seen = {}  # serial: newest frame id
+    self._last_frame = None  # frame id of the last triangulated frame
+    self._filter = KeypointFilter(len(self.bodyparts))
+
+  def reset(self):
+    # before every recording, from AcquisitionGroup.start()
+    self.metrics.reset()
+    with self._lock:
+      self._pending = {}
+      self._last_seen = {}
+      self._last_frame = None
+      self._filter = KeypointFilter(len(self.bodyparts))
+
+  def add_pose(self, camera, data_count, info, pose):
+    serial = str(camera.device_serial_number)
+    if info is None or serial not in self.calibration:
+      return
+    frame_id = int(info['frame_id'])
+    with self._lock:
+      self._last_seen[serial] = max(frame_id, self._last_seen.get(serial, frame_id))
+      if self._last_frame is not None and frame_id <= self._last_frame:
+        self.metrics.count('late poses')
+        return
+      self._pending.setdefault(frame_id, {})[serial] = (np.asarray(pose, dtype=float), float(info['host_time']))
+      newest = max(self._last_seen.values())
+      active = {s for s, f in self._last_seen.items() if f >= newest - STALE_FRAMES}
+      results = []
+      for frame in sorted(self._pending):
+        # every camera sends its poses in frame order, so once all of them are past a frame it is final
+        seen = self._pending[frame]
+        final = all(self._last_seen[s] > frame or s in seen for s in active)
+        if not ((final and len(seen) >= 2) or frame < newest - MAX_DELAY_FRAMES):
+          break
+        if not active <= set(seen):
+          self.metrics.count('incomplete frames')
+        results.append(self._solve(frame, self._pending.pop(frame)))
+    for result in results:
+      if result is not None and self.on_points is not None:
+        self.on_points(result)
+
+  def _solve(self, frame_id, poses):
+    start = time.perf_counter()
+    serials = sorted(poses)
+    n = len(self.bodyparts)
+    points = np.empty((len(serials), n, 2))
+    valid = np.zeros((len(serials), n), dtype=bool)
+    for i, serial in enumerate(serials):
+      pose = poses[serial][0][:n]
+      points[i] = undistort(pose[:, :2], self.calibration[serial])
+      valid[i] = (pose[:, 2] >= SCORE_THRESHOLD) & np.isfinite(pose[:, :2]).all(axis=1)
+    projections = np.stack([self.calibration[serial]['extrinsic'] for serial in serials])
+    raw = triangulate_dlt(points, valid, projections)
+    dt = (frame_id - self._last_frame) / self.frame_rate if self._last_frame is not None else 1 / self.frame_rate
+    filtered = self._filter.step(raw, dt)
+    self._last_frame = frame_id
+    host_time = min(pose_time for _, pose_time in poses.values())  # the first camera to capture it
+
+    self.metrics.observe('triangulate', time.perf_counter() - start)
+    self.metrics.observe('pose 3d latency', time.time() - host_time)  # capture to 3D keypoints
+    self.metrics.count('frames')
+    self.latest = {'frame id': frame_id, 'host time': host_time, 'bodyparts': self.bodyparts,
+                   'points': filtered, 'raw': raw, 'cameras': valid.sum(axis=0)}
+    return self.latest
@@ -0,0 +1,101 @@
+import bisect
+import math
+import threading
+import time
+
+# histogram bin edges in milliseconds, the last bin catches everything above
+HISTOGRAM_EDGES_MS = (.1, .2, .5, 1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000)
+
+
+class Histogram:
+  # fixed-bin latency histogram, cheap enough to update once per frame
+  # expected to have a single writer; snapshots taken from other threads may be off by one sample
+
+  def __init__(self, edges=HISTOGRAM_EDGES_MS):
+    self.edges = edges
+    self.reset()
+
+  def reset(self):
+    self.bins = [0] * (len(self.edges) + 1)
+    self.count = 0
+    self.total = 0.
+    self.total_sq = 0.
+    self.max = 0.
+
+  def observe(self, ms):
+    self.bins[bisect.bisect_left(self.edges, ms)] += 1
+    self.count += 1
+    self.total += ms
+    self.total_sq += ms * ms
+    if ms > self.max:
+      self.max = ms
+
+  def percentile(self, q):
+    # upper edge of the bin holding the q-th percentile
+    if self.count == 0:
+      return 0.
+    target = q / 100 * self.count
+    seen = 0
+    for edge, n in zip(self.edges, self.bins):
+      seen += n
+      if seen >= target:
+        return min(edge, self.max)
+    return self.max
+
+  @property
+  def snapshot(self):
+    if self.count == 0:
+      return {'count': 0}
+    mean = self.total / self.count
+    return {
+        'count': self.count,
+        'mean': mean,
+        'std': math.sqrt(max(self.total_sq / self.count - mean * mean, 0.)),
+        'max': self.max,
+        'p50': self.percentile(50),
+        'p95': self.percentile(95),
+        'edges': list(self.edges),
+        'bins': list(self.bins),
+    }
+
+
+class Metrics:
+  # per-child counters, gauges and latency histograms
+  # times are passed in seconds and reported in milliseconds
+
+  def __init__(self):
+    self._lock = threading.Lock()
+    self.reset()
+
+  def reset(self):
+    with self._lock:
+      self._counters = {}
+      self._gauges = {}
+      self._histograms = {}
+      self._since = time.time()
+
+  def count(self, name, n=1):
+    self._counters[name] = self._counters.get(name, 0) + n
+
+  def gauge(self, name, value):
+    self._gauges[name] = value
+
+  def observe(self, name, seconds):
+    histogram = self._histograms.get(name)
+    if histogram is None:
+      with self._lock:
+        histogram = self._histograms.setdefault(name, Histogram())
+    histogram.observe(seconds * 1e3)
+
+  @property
+  def snapshot(self):
+    with self._lock:
+      elapsed = time.time() - self._since
+      counters = dict(self._counters)
+      return {
+          'elapsed': elapsed,
+          'counters': counters,
+          'rates': {k: v / elapsed for k, v in counters.items()} if elapsed > 0 else {},
+          'gauges': dict(self._gauges),
+          'histograms': {k: v.snapshot for k, v in self._histograms.items()},
+      }
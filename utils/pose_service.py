@@ -0,0 +1,167 @@
+import threading
+import time
+
+import numpy as np
+
+from utils.ring_buffer import RING_SLOTS
+
+# DLC Live for all cameras from one thread. Each camera used to run its own DLCLive in its own
+# run_processing() thread, so on CPU the models competed for the same cores and all of them slowed down.
+#
+# the service goes round the subscribed cameras and takes the newest frame of every camera that has
+# one due (update_each camera frames after the last one it used), then runs them grouped by model, so the
+# cameras of one model run back to back. Frames published in the meantime are skipped, never queued.
+# Where the frames carry camera frame ids, every camera in a round uses the frame with the same id
+# (the newest that all of them still have), so their poses describe the same trigger. Frames are
+# counted by that id too: a camera publishes only the last of every FRAME_BUFFER frames it captures,
+# so its sequence numbers step by several frames. Frames without an id are counted by sequence number.
+# DLCLive has no batch call and keeps state per camera (dynamic cropping follows the last pose), so
+# every camera keeps its own DLCLive; what they share is the thread, so one model runs at a time.
+#
+# per camera, in its metrics:
+#   'pose'          seconds of inference per frame
+#   'pose latency'  from the frame being published to its pose being in camera.results
+#   'pose skipped'  camera frames that were newer than due, on top of the update_each interval
+#
+# on_pose(camera, data_count, info, pose) is called after every pose, e.g. LiveTriangulator.add_pose()
+WAIT_TIMEOUT = .05  # longest wait for a new frame while none is due, in case a camera stops publishing
+
+
+class PoseService:
+  # subscribe() from Camera.prepare_processing(), unsubscribe() from Camera.end_processing()
+  # the thread runs while there are subscribers
+
+  def __init__(self, update_each=1, print=print, on_pose=None):
+    self.update_each = update_each
+    self.print = print
+    self.on_pose = on_pose
+    self._lock = threading.Lock()  # guards _subscribers and _thread
+    self._inference_lock = threading.Lock()  # held while a model runs, so unsubscribe() can close it
+    self._subscribers = {}  # camera: its model and the state of its stream, see subscribe()
+    self._thread = None
+
+  def subscribe(self, camera, model_path, open_model):
+    # open_model() returns the camera's DLCLive; it is called in the service thread before the first frame
+    with self._lock:
+      self._subscribers[camera] = {'model path': model_path, 'open model': open_model, 'model': None,
+                                   'last frame': None, 'frame': None, 'closed': False}
+      if self._thread is None:
+        self._thread = threading.Thread(target=self._run, name='pose service')
+        self._thread.start()
+
+  def unsubscribe(self, camera):
+    with self._lock:
+      subscriber = self._subscribers.pop(camera, None)
+    if subscriber is None:
+      return
+    with self._inference_lock:
+      subscriber['closed'] = True
+      if subscriber['model'] is not None:
+        subscriber['model'].close()
+
+  @property
+  def subscribers(self):
+    with self._lock:
+      return list(self._subscribers)
+
+  def _run(self):
+    try:
+      self._serve()
+    except Exception as e:
+      # the errors of one camera are handled in _serve(), this is the loop itself: report it to every
+      # subscriber, the next subscribe() starts a new thread
+      self.print(f'DLC Live stopped for all cameras: {e}')
+      for camera in self.subscribers:
+        camera.metrics.count('pose errors')
+    finally:
+      with self._lock:
+        if self._thread is threading.current_thread():
+          self._thread = None
+
+  def _serve(self):
+    while True:
+      with self._lock:
+        if not self._subscribers:
+          self._thread = None
+          return
+        # the camera that is furthest behind is the next one to have a frame due
+        behind = min(self._subscribers, key=lambda camera: self._subscribers[camera]['last frame'] or 0)
+        due = [(camera, subscriber) for camera, subscriber in self._subscribers.items()
+               if camera.data_count > 0 and (subscriber['last frame'] is None or
+               self._frame_number(camera, camera.data_count) >= subscriber['last frame'] + self.update_each)]
+      if not due:
+        behind.wait_for_data(behind.data_count, WAIT_TIMEOUT)
+        continue
+      due.sort(key=lambda item: item[1]['model path'])
+      try:
+        counts = self._align([camera for camera, _ in due])
+      except Exception as e:
+        self.print(f'DLC Live could not match frames across cameras: {e}')
+        counts = {camera: camera.data_count for camera, _ in due}
+      with self._inference_lock:
+        for camera, subscriber in due:
+          if not subscriber['closed']:
+            try:
+              self._infer(camera, subscriber, counts[camera])
+            except Exception as e:
+              camera.metrics.count('pose errors')
+              self.print(f'DLC Live failed on {camera.name}: {e}')
+
+  @staticmethod
+  def _frame_number(camera, data_count):
+    # the camera frame id of a published frame, or its sequence number if it carries none
+    info = camera.data_info(data_count)
+    return data_count if info is None else int(info['frame_id'])
+
+  @staticmethod
+  def _align(cameras):
+    # {camera: data_count} of the frame each camera should use: its newest, or the newest frame id
+    # that every camera still holds
+    counts = {camera: camera.data_count for camera in cameras}
+    ids = {}
+    for camera, count in counts.items():
+      ids[camera] = {}
+      for seq in range(max(count - RING_SLOTS + 1, 1), count + 1):
+        info = camera.data_info(seq)
+        if info is not None:
+          ids[camera][int(info['frame_id'])] = seq
+    common = set.intersection(*(set(frames) for frames in ids.values()))
+    if len(cameras) < 2 or not common:
+      return counts
+    target = max(common)
+    return {camera: ids[camera][target] for camera in cameras}
+
+  def _infer(self, camera, subscriber, data_count):
+    data = camera.data_at(data_count)
+    if data is None:
+      return
+    published = camera.data_time(data_count)
+    info = camera.data_info(data_count)
+    # the ring recycles the frame after a few more captures, sooner than a pose may take
+    if subscriber['frame'] is None or subscriber['frame'].shape != data.shape:
+      subscriber['frame'] = np.empty_like(data)
+    frame = subscriber['frame']
+    np.copyto(frame, data)
+    if camera.data_lapped(data_count):
+      return  # overwritten while being copied, try the next one
+
+    frame_number = data_count if info is None else int(info['frame_id'])
+    last_frame = subscriber['last frame']
+    if last_frame is not None and frame_number > last_frame + self.update_each:
+      camera.metrics.count('pose skipped', frame_number - last_frame - self.update_each)
+    subscriber['last frame'] = frame_number
+
+    start = time.perf_counter()
+    model = subscriber['model']
+    if model is None:
+      model = subscriber['model'] = subscriber['open model']()
+      model.init_inference(frame=frame)
+    pose = model.get_pose(frame)
+    camera.metrics.observe('pose', time.perf_counter() - start)
+
+    camera.results_and_count = pose, data_count
+    camera.metrics.count('poses')
+    if published is not None:
+      camera.metrics.observe('pose latency', time.time() - published)
+    if self.on_pose is not None:
+      self.on_pose(camera, data_count, info, pose)
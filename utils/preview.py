@@ -0,0 +1,106 @@
+import struct
+import time
+
+import cv2
+import numpy as np
+
+# what display() sends to the clients of a stream, set per camera with status['camera i']['preview ...']
+# 'raw' sends the frame's uint8 bytes exactly as before, so existing clients keep working, as long as
+# the frame keeps the shape they know from the status; frames of any other shape (a crop or a scale
+# set, see Preview.reshapes) are preceded by RAW_HEADER. The image encodings send each frame as a
+# 4-byte big-endian length followed by the encoded image
+PREVIEW_ENCODINGS = ('raw', 'jpeg', 'webp', 'png')
+PREVIEW_SCALES = (1, 2, 4, 8)  # downscale factors
+# 'burned' draws the overlays (DLC points, markers, status text) into the frames; 'metadata' leaves the
+# frames clean and sends the overlays as json on the child's overlay stream, for the client to draw
+PREVIEW_OVERLAYS = ('burned', 'metadata')
+PREVIEW_HEADER = struct.Struct('>I')  # length of the encoded image that follows
+RAW_HEADER = struct.Struct('>IHHH')  # length, height, width and channels of the raw frame that follows
+DEFAULT_PREVIEW_QUALITY = 80
+
+_EXTENSIONS = {'jpeg': '.jpg', 'webp': '.webp', 'png': '.png'}
+
+
+def _encode_params(encoding, quality):
+  if encoding == 'jpeg':
+    return [cv2.IMWRITE_JPEG_QUALITY, quality]
+  if encoding == 'webp':
+    return [cv2.IMWRITE_WEBP_QUALITY, max(quality, 1)]  # 100 and above is lossless
+  # png is always lossless: quality only trades compression effort (0 = most, 9 = least) for speed
+  return [cv2.IMWRITE_PNG_COMPRESSION, round((100 - quality) * 9 / 100)]
+
+
+def length_prefixed(payload, encoding, shape=None):
+  # what is sent on a child's own display port: the bare bytes for raw frames of the shape the clients
+  # expect, RAW_HEADER and the bytes for raw frames of another shape (pass it), length-prefixed otherwise
+  if encoding == 'raw':
+    if shape is None:
+      return payload
+    channels = shape[2] if len(shape) > 2 else 1
+    return RAW_HEADER.pack(len(payload), shape[0], shape[1] if len(shape) > 1 else 1, channels) + payload
+  return PREVIEW_HEADER.pack(len(payload)) + payload
+
+
+class Preview:
+  # turns a displayed frame into the bytes sent to every client: ROI crop, downscale, encode
+  # display() calls encode() once per frame and sends the result to all recipients
+
+  def __init__(self, scale=1, roi=None, encoding='raw', quality=DEFAULT_PREVIEW_QUALITY, max_fps=0,
+               overlays='burned'):
+    self._last_sent = 0
+    self._settings = None
+    self.configure(scale, roi, encoding, quality, max_fps, overlays)
+
+  def configure(self, scale=1, roi=None, encoding='raw', quality=DEFAULT_PREVIEW_QUALITY, max_fps=0,
+                overlays='burned'):
+    # roi is [x, y, width, height] in full resolution pixels, a width or height of 0 extends to the edge
+    # max_fps of 0 sends every frame the displayer picks up
+    if encoding not in PREVIEW_ENCODINGS:
+      raise ValueError(f'Unknown preview encoding {encoding}, expected one of {PREVIEW_ENCODINGS}')
+    if scale not in PREVIEW_SCALES:
+      raise ValueError(f'Unknown preview scale {scale}, expected one of {PREVIEW_SCALES}')
+    if overlays not in PREVIEW_OVERLAYS:
+      raise ValueError(f'Unknown preview overlays {overlays}, expected one of {PREVIEW_OVERLAYS}')
+    roi = None if roi is None or not any(roi) else tuple(int(v) for v in roi)
+    # replaced as a whole, so the displayer never sees half of an update
+    self._settings = (scale, roi, encoding, int(quality), max_fps, overlays)
+
+  @property
+  def settings(self):
+    scale, roi, encoding, quality, max_fps, overlays = self._settings
+    return {'scale': scale, 'roi': roi, 'encoding': encoding, 'quality': quality, 'max_fps': max_fps,
+            'overlays': overlays}
+
+  @property
+  def reshapes(self):
+    # whether render() changes the shape of the frames, so raw frames need RAW_HEADER
+    scale, roi = self._settings[:2]
+    return roi is not None or scale > 1
+
+  def due(self):
+    # whether the next frame should be sent, given max_fps
+    max_fps = self._settings[4]
+    return not max_fps or time.time() - self._last_sent >= 1 / max_fps
+
+  def render(self, frame):
+    # (payload bytes, encoding, cropped and scaled uint8 image), all from the same settings
+    scale, roi, encoding, quality, _, _ = self._settings
+    self._last_sent = time.time()
+    image = np.asarray(frame, dtype=np.uint8)
+    if image.ndim >= 2:
+      if roi is not None:
+        x, y, width, height = roi
+        image = image[y:y + height if height else None, x:x + width if width else None]
+      if scale > 1:
+        image = cv2.resize(image, (max(image.shape[1] // scale, 1), max(image.shape[0] // scale, 1)),
+                           interpolation=cv2.INTER_AREA)
+    if encoding == 'raw':
+      return image.tobytes(), encoding, image
+    ok, encoded = cv2.imencode(_EXTENSIONS[encoding], image, _encode_params(encoding, quality))
+    if not ok:
+      raise Exception(f'Could not encode a {image.shape} preview as {encoding}')
+    return encoded.tobytes(), encoding, image
+
+  def encode(self, frame):
+    payload, encoding, image = self.render(frame)
+    return length_prefixed(payload, encoding, image.shape if self.reshapes else None)
@@ -0,0 +1,229 @@
+import json
+import os
+import shutil
+import threading
+import time
+
+import numpy as np
+
+from utils.encoder_profiles import DEFAULT_ENCODER_PROFILE, open_encoder, profile_path
+from utils.frame_index import frame_index_path, read_frame_index
+
+# a raw store is a directory of fixed-size segment files holding frames exactly as captured, plus a
+# manifest. Frames are copied into memory-mapped segments, so recording costs a memcpy per frame and
+# the page cache does the writing; encoding happens later, see Transcoder.
+#
+#   <name>.rawstore/manifest.json   shape, dtype, frame rate, frames per segment, frame count
+#   <name>.rawstore/00000.raw       frames 0 .. SEGMENT_FRAMES - 1
+#   <name>.frames                   frame index, shared with the video transcoded from the store
+RAW_STORE_EXT = '.rawstore'
+RAW_STORE_VERSION = 1
+MANIFEST = 'manifest.json'
+SEGMENT_FRAMES = 300  # frames per segment file, 10 s at 30 fps
+TRANSCODE_CHUNK = 32  # frames handed to the encoder per write
+CAMERA_FILE_MODES = ('encode', 'raw store')  # Camera.file_mode: encode while recording, or record raw and transcode after
+
+
+def raw_store_path(video_path):
+  return os.path.splitext(video_path)[0] + RAW_STORE_EXT
+
+
+def _segment_path(path, segment):
+  return os.path.join(path, f'{segment:05d}.raw')
+
+
+def _write_manifest(path, manifest):
+  # replace rather than rewrite, so a reader never sees half a manifest
+  temp_path = os.path.join(path, MANIFEST + '.tmp')
+  with open(temp_path, 'w') as f:
+    json.dump(manifest, f)
+  os.replace(temp_path, os.path.join(path, MANIFEST))
+
+
+class RawStoreWriter:
+  def __init__(self, path, shape, dtype=np.uint8, frame_rate=30, segment_frames=SEGMENT_FRAMES):
+    self.path = path
+    self.count = 0
+    self._shape = tuple(shape)
+    self._dtype = np.dtype(dtype)
+    self._segment = None
+    os.makedirs(path, exist_ok=True)
+    self._manifest = {
+        'version': RAW_STORE_VERSION,
+        'shape': list(self._shape),
+        'dtype': self._dtype.str,
+        'frame rate': frame_rate,
+        'segment frames': segment_frames,
+        'count': 0,  # frames in finished segments while recording, all frames once complete
+        'complete': False,
+    }
+    _write_manifest(path, self._manifest)
+
+  def append(self, frame):
+    segment_frames = self._manifest['segment frames']
+    i = self.count % segment_frames
+    if i == 0:
+      self._finish_segment()
+      self._segment = np.memmap(_segment_path(self.path, self.count // segment_frames), dtype=self._dtype,
+                                mode='w+', shape=(segment_frames,) + self._shape)
+    self._segment[i] = frame
+    self.count += 1
+
+  def _finish_segment(self):
+    if self._segment is not None:
+      self._segment.flush()
+      self._segment = None
+      self._manifest['count'] = self.count
+      _write_manifest(self.path, self._manifest)
+
+  def close(self):
+    self._finish_segment()
+    segment_frames = self._manifest['segment frames']
+    if self.count % segment_frames:
+      # give back the unused tail of the last segment
+      frame_bytes = int(np.prod(self._shape)) * self._dtype.itemsize
+      os.truncate(_segment_path(self.path, self.count // segment_frames), (self.count % segment_frames) * frame_bytes)
+    self._manifest['count'] = self.count
+    self._manifest['complete'] = True
+    _write_manifest(self.path, self._manifest)
+
+
+class RawStoreReader:
+  # read-only access to a raw store, e.g. for post-processing before (or instead of) transcoding
+  # while the store is still being recorded, only frames of finished segments are visible; call refresh()
+  def __init__(self, path):
+    self.path = path
+    self._segments = {}
+    self.refresh()
+    self.shape = tuple(self._manifest['shape'])
+    self.dtype = np.dtype(self._manifest['dtype'])
+    self.frame_rate = self._manifest['frame rate']
+    self._segment_frames = self._manifest['segment frames']
+
+  def refresh(self):
+    with open(os.path.join(self.path, MANIFEST)) as f:
+      self._manifest = json.load(f)
+    if self._manifest['version'] != RAW_STORE_VERSION:
+      raise Exception(f'{self.path} is not a version {RAW_STORE_VERSION} raw store')
+    self._segments = {k: v for k, v in self._segments.items() if len(v) == self._segment_frames}
+
+  @property
+  def complete(self):
+    return self._manifest['complete']
+
+  @property
+  def frame_index(self):
+    return read_frame_index(frame_index_path(self.path))
+
+  def __len__(self):
+    return self._manifest['count']
+
+  def _segment(self, segment):
+    if segment not in self._segments:
+      self._segments[segment] = np.memmap(_segment_path(self.path, segment), dtype=self.dtype, mode='r').reshape(
+          (-1,) + self.shape)
+    return self._segments[segment]
+
+  def __getitem__(self, i):
+    # read-only view of frame i, straight from the page cache
+    if i < 0:
+      i += len(self)
+    if not 0 <= i < len(self):
+      raise IndexError(f'frame {i} is not in {self.path}, which has {len(self)} frames')
+    return self._segment(i // self._segment_frames)[i % self._segment_frames]
+
+  def read(self, start, stop):
+    # frames start .. stop - 1 as one array; chunks never cross a segment boundary so this is a view when possible
+    stop = min(stop, len(self))
+    chunks = []
+    while start < stop:
+      segment, offset = divmod(start, self._segment_frames)
+      n = min(stop - start, self._segment_frames - offset)
+      chunks.append(self._segment(segment)[offset:offset + n])
+      start += n
+    if len(chunks) == 1:
+      return chunks[0]
+    return np.concatenate(chunks) if chunks else np.empty((0,) + self.shape, dtype=self.dtype)
+
+  def __iter__(self):
+    for i in range(len(self)):
+      yield self[i]
+
+  def close(self):
+    self._segments = {}
+
+
+def transcode(store_path, video_path, profile=DEFAULT_ENCODER_PROFILE, progress=None, low_priority=True):
+  # encode a complete raw store into a video; progress(done, total) is called as frames are encoded
+  reader = RawStoreReader(store_path)
+  if not reader.complete:
+    raise Exception(f'{store_path} is still being recorded')
+  height, width = reader.shape
+  encoder = open_encoder(video_path, width, height, reader.frame_rate, profile, low_priority=low_priority)
+  total = len(reader)
+  try:
+    for start in range(0, total, TRANSCODE_CHUNK):
+      encoder.stdin.write(reader.read(start, start + TRANSCODE_CHUNK).tobytes())
+      if progress is not None:
+        progress(min(start + TRANSCODE_CHUNK, total), total)
+    encoder.stdin.close()
+  except BrokenPipeError:
+    pass  # the encoder died, its error is reported below
+  reader.close()
+  error = encoder.stderr.read().decode(errors='replace')
+  if encoder.wait() != 0:
+    raise Exception(f'Transcoding {store_path} failed: {error}')
+  return profile_path(video_path, profile)
+
+
+class Transcoder:
+  # transcodes raw stores in the background once they are complete: one thread and one low priority
+  # encoder per store, so the stores of all cameras are encoded in parallel
+  def __init__(self, delete_raw=True, print=print):
+    self.delete_raw = delete_raw
+    self.print = print
+    self._lock = threading.Lock()
+    self._progress = {}  # video path: (done, total)
+    self._threads = []
+
+  def submit(self, store_path, video_path, profile=DEFAULT_ENCODER_PROFILE):
+    thread = threading.Thread(target=self._transcode, args=(store_path, video_path, profile),
+                              name=f'transcode {os.path.basename(video_path)}')
+    with self._lock:
+      self._progress[video_path] = (0, None)
+      self._threads = [t for t in self._threads if t.is_alive()] + [thread]
+    thread.start()
+
+  def _transcode(self, store_path, video_path, profile):
+    def progress(done, total):
+      with self._lock:
+        self._progress[video_path] = (done, total)
+
+    start = time.time()
+    try:
+      path = transcode(store_path, video_path, profile, progress)
+      self.print(f'transcoded {store_path} to {path} in {time.time() - start:.1f} s')
+      if self.delete_raw:
+        shutil.rmtree(store_path)
+    except Exception as e:
+      self.print(f'{e}. The raw store is kept.')
+    finally:
+      with self._lock:
+        del self._progress[video_path]
+
+  @property
+  def progress(self):
+    # {video path: (frames done, total frames or None if not started)} of the stores still being transcoded
+    with self._lock:
+      return dict(self._progress)
+
+  @property
+  def busy(self):
+    with self._lock:
+      return any(t.is_alive() for t in self._threads)
+
+  def wait(self):
+    with self._lock:
+      threads = list(self._threads)
+    for thread in threads:
+      thread.join()
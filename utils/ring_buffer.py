@@ -0,0 +1,280 @@
+import threading
+import time
+from multiprocessing import shared_memory
+import numpy as np
+
+RING_SLOTS = 4  # number of frames kept before the writer starts overwriting
+SHARED_HEADER_BYTES = 4096  # [seq, write_seq], the publish times and the frame infos, padded to a page
+
+
+class FrameRing:
+  # preallocated ring of frames tagged with monotonic sequence numbers
+  # the writer copies (or captures directly) into the next slot, readers get read-only views
+  # sequence numbers start at 1, so 0 always means "nothing published yet"
+
+  def __init__(self, n_slots=RING_SLOTS, shape=None, dtype=np.float64):
+    self.n_slots = n_slots
+    self._lock = threading.Lock()
+    self._slots = None
+    self._views = None
+    self._times = np.zeros(n_slots)  # host time at which each slot was published
+    self._seq = 0  # last published sequence number
+    self._write_seq = 0  # sequence number currently being written (== _seq when idle)
+    self._held = [None] * n_slots  # PooledFrames published with put()
+    if shape is not None:
+      self._allocate(shape, dtype)
+
+  def _allocate(self, shape, dtype):
+    self._slots = [np.empty(shape, dtype=dtype) for _ in range(self.n_slots)]
+    self._views = []
+    for slot in self._slots:
+      view = slot.view()
+      view.flags.writeable = False
+      self._views.append(view)
+
+  @property
+  def seq(self):
+    return self._seq
+
+  def claim(self, shape, dtype):
+    # returns the writable slot for the next sequence number
+    # the previous contents of this slot are invalid from now on
+    with self._lock:
+      if self._slots is None or self._slots[0].shape != tuple(shape) or self._slots[0].dtype != dtype:
+        # first frame, or the producer changed format: (re)allocate once
+        self._allocate(shape, dtype)
+      self._write_seq = self._seq + 1
+      return self._slots[self._write_seq % self.n_slots]
+
+  def publish(self, timestamp=None):
+    # make the slot returned by claim() visible to readers
+    with self._lock:
+      self._times[self._write_seq % self.n_slots] = time.time() if timestamp is None else timestamp
+      self._seq = self._write_seq
+      return self._seq
+
+  def write(self, data, timestamp=None):
+    data = np.asarray(data)
+    slot = self.claim(data.shape, data.dtype)
+    np.copyto(slot, data)
+    return self.publish(timestamp)
+
+  def put(self, frame, timestamp=None):
+    # publish a utils.frame_pool.PooledFrame by reference instead of copying it into a slot
+    # the ring holds the frame until it is lapped, so readers' views stay valid exactly as long as with write()
+    # a ring is fed either with put() or with claim()/write(), not both
+    frame.retain()
+    view = frame.array.view()
+    view.flags.writeable = False
+    with self._lock:
+      if self._slots is not None or self._views is None:
+        self._slots = None  # the ring never copies, so slots preallocated by the constructor are not needed
+        self._views = [None] * self.n_slots
+      self._write_seq = self._seq + 1
+      i = self._write_seq % self.n_slots
+      lapped, self._held[i] = self._held[i], frame
+      self._views[i] = view
+      self._times[i] = time.time() if timestamp is None else timestamp
+      self._seq = self._write_seq
+      seq = self._seq
+    if lapped is not None:
+      lapped.release()  # only now may the pool hand it out again
+    return seq
+
+  def clear(self):
+    # give back the frames held by put()
+    with self._lock:
+      held, self._held = self._held, [None] * self.n_slots
+    for frame in held:
+      if frame is not None:
+        frame.release()
+
+  def latest(self):
+    # read-only view of the newest frame and its sequence number
+    with self._lock:
+      if self._seq == 0:
+        return None, 0
+      return self._views[self._seq % self.n_slots], self._seq
+
+  def get(self, seq):
+    # read-only view of frame seq, or None if it was not published yet or has been overwritten
+    with self._lock:
+      if seq <= 0 or seq > self._seq or self._lapped(seq):
+        return None
+      return self._views[seq % self.n_slots]
+
+  def info(self, seq):
+    # copy of the info of frame seq if it was published with put(), None if it is no longer in the ring
+    with self._lock:
+      if seq <= 0 or seq > self._seq or self._lapped(seq):
+        return None
+      frame = self._held[seq % self.n_slots]
+      return None if frame is None or frame.info is None else frame.info.copy()
+
+  def timestamp(self, seq):
+    # publish time of frame seq, or None if it is no longer in the ring
+    with self._lock:
+      if seq <= 0 or seq > self._seq or self._lapped(seq):
+        return None
+      return self._times[seq % self.n_slots]
+
+  def lapped(self, seq):
+    # True once the writer has started overwriting the slot that held frame seq
+    # readers should check this after they are done with a view to know whether it was torn
+    with self._lock:
+      return self._lapped(seq)
+
+  def _lapped(self, seq):
+    return self._write_seq >= seq + self.n_slots
+
+
+class ChunkRing:
+  # single-producer single-consumer queue of fixed-size chunks, for a real-time callback such as the
+  # PortAudio one: push() copies into a preallocated slot and bumps a counter, without locks or
+  # allocations, and the consumer thread pop()s the chunks in order.
+  # _pushed is only written by the producer and _popped only by the consumer, so each side just reads
+  # the other's counter. When the consumer falls n_slots behind, push() drops the new chunk and counts it.
+
+  def __init__(self, n_slots, chunk_size, dtype=np.float32):
+    self.n_slots = n_slots
+    self._slots = np.zeros((n_slots, chunk_size), dtype=dtype)
+    self._lengths = np.zeros(n_slots, dtype=np.int64)
+    self._times = np.zeros(n_slots)  # time.perf_counter() when each chunk was pushed
+    self._flags = np.zeros(n_slots, dtype=np.int64)  # e.g. the callback's status flags
+    self._pushed = 0
+    self._popped = 0
+    self.dropped = 0  # chunks lost because the ring was full
+
+  @property
+  def queued(self):
+    return self._pushed - self._popped
+
+  def push(self, data, flags=0):
+    # producer only; False if the chunk was dropped
+    if self._pushed - self._popped >= self.n_slots:
+      self.dropped += 1
+      return False
+    i = self._pushed % self.n_slots
+    n = min(len(data), self._slots.shape[1])
+    self._slots[i, :n] = data[:n]
+    self._lengths[i] = n
+    self._times[i] = time.perf_counter()
+    self._flags[i] = flags
+    self._pushed += 1  # publishes the slot
+    return True
+
+  def pop(self):
+    # consumer only: (chunk, push time, flags) of the oldest chunk, or None if there is none
+    # chunk is a view into the slot, valid until release()
+    if self._popped == self._pushed:
+      return None
+    i = self._popped % self.n_slots
+    return self._slots[i, :self._lengths[i]], self._times[i], self._flags[i]
+
+  def release(self):
+    # consumer only: hand the slot returned by pop() back to the producer
+    self._popped += 1
+
+
+class SharedFrameRing(FrameRing):
+  # FrameRing whose slots live in a named shared memory block, so another process can read frames without pickling
+  # exactly one process writes and creates the block (create=True); readers attach with the same name, shape and dtype
+  # the writer bumps _write_seq before touching a slot and _seq after, so readers detect laps exactly like FrameRing
+  # with info_dtype (the same on both sides), put() also copies each PooledFrame.info into the header for info()
+  _slots = None
+
+  def __init__(self, shape, dtype=np.uint8, n_slots=RING_SLOTS, name=None, create=False, info_dtype=None):
+    self.n_slots = n_slots
+    self._lock = threading.Lock()
+    self._shape = tuple(shape)
+    self._dtype = np.dtype(dtype)
+    self._create = create
+    self.on_publish = None  # optional callback(seq), e.g. to wake readers in another process
+
+    frame_bytes = int(np.prod(self._shape)) * self._dtype.itemsize
+    size = SHARED_HEADER_BYTES + frame_bytes * n_slots
+    self._shm = shared_memory.SharedMemory(name=name, create=create, size=size)
+    self.name = self._shm.name
+
+    self._header = np.ndarray((2,), dtype=np.int64, buffer=self._shm.buf)
+    self._times = np.ndarray((n_slots,), dtype=np.float64, buffer=self._shm.buf, offset=16)
+    self._infos = None
+    if info_dtype is not None:
+      info_dtype = np.dtype(info_dtype)
+      offset = 16 + 8 * n_slots
+      if offset + info_dtype.itemsize * n_slots > SHARED_HEADER_BYTES:
+        raise ValueError(f'{n_slots} frame infos of {info_dtype.itemsize} bytes do not fit in the shared header')
+      self._infos = np.ndarray((n_slots,), dtype=info_dtype, buffer=self._shm.buf, offset=offset)
+    if create:
+      self._header[:] = 0
+      self._times[:] = 0
+      if self._infos is not None:
+        self._infos[:] = np.zeros((), dtype=self._infos.dtype)
+    self._allocate(self._shape, self._dtype)
+
+  @property
+  def _seq(self):
+    return int(self._header[0])
+
+  @_seq.setter
+  def _seq(self, seq):
+    self._header[0] = seq
+
+  @property
+  def _write_seq(self):
+    return int(self._header[1])
+
+  @_write_seq.setter
+  def _write_seq(self, seq):
+    self._header[1] = seq
+
+  def _allocate(self, shape, dtype):
+    if self._slots is not None:
+      raise ValueError(f'shared frame ring holds {self._shape} {self._dtype} frames, got {tuple(shape)} {dtype}')
+    frame_bytes = int(np.prod(self._shape)) * self._dtype.itemsize
+    self._slots = [np.ndarray(self._shape, dtype=self._dtype, buffer=self._shm.buf,
+                              offset=SHARED_HEADER_BYTES + i * frame_bytes) for i in range(self.n_slots)]
+    self._views = []
+    for slot in self._slots:
+      view = slot.view()
+      view.flags.writeable = False
+      self._views.append(view)
+
+  def publish(self, timestamp=None):
+    seq = FrameRing.publish(self, timestamp)
+    if self.on_publish is not None:
+      self.on_publish(seq)
+    return seq
+
+  def put(self, frame, timestamp=None):
+    # the other process cannot see the pool, so the frame (and its info) is copied into shared memory
+    slot = self.claim(frame.array.shape, frame.array.dtype)
+    np.copyto(slot, frame.array)
+    if self._infos is not None and frame.info is not None:
+      self._infos[self._write_seq % self.n_slots] = frame.info
+    return self.publish(timestamp)
+
+  def info(self, seq):
+    # copy of the info put() stored with frame seq, None without info_dtype or once the frame is lapped
+    if self._infos is None:
+      return None
+    with self._lock:
+      if seq <= 0 or seq > self._seq or self._lapped(seq):
+        return None
+      info = self._infos[seq % self.n_slots].copy()
+      # the writer is in another process: a lap that started while copying may have torn the record
+      return None if self._lapped(seq) else info
+
+  def clear(self):
+    pass
+
+  def close(self):
+    # views handed out to readers must be gone before the block can be released
+    self._slots = self._views = None
+    self._header = self._times = self._infos = None
+    try:
+      self._shm.close()
+    except BufferError:
+      return
+    if self._create:
+      self._shm.unlink()
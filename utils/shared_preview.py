@@ -0,0 +1,178 @@
+import os
+import re
+import time
+import multiprocessing
+from multiprocessing import resource_tracker, shared_memory
+
+import numpy as np
+
+# the newest preview frame of a child in named shared memory, for clients on the acquisition PC:
+# they copy the frame straight out of the block instead of receiving it over a localhost socket.
+#
+# two blocks per child: a small header block named preview_block_name(child name), and a data block
+# holding the image, named after the header plus a generation number. The data block is replaced by
+# a larger one (next generation) when the preview grows, e.g. after the ROI is widened.
+#
+# the header is a seqlock: the writer makes SEQ odd, writes, and makes it even again; a reader that
+# sees the same even SEQ before and after its copy has a consistent frame. Readers stamp READER_TIME
+# on every read, so the writer only works while somebody is actually reading.
+SEQ, GENERATION, FRAME_SEQ, TIMESTAMP, LENGTH, READER_TIME, NDIM = range(7)
+SHAPE = 8  # shape takes header[SHAPE:SHAPE + MAX_DIMS]
+MAX_DIMS = 4
+HEADER_FIELDS = SHAPE + MAX_DIMS
+READER_TIMEOUT = 1  # seconds after the last read that the writer keeps writing
+POLL_TIME = .005  # seconds between checks while a reader waits for a new frame
+
+_created = set()  # blocks created by writers in this process
+
+
+def preview_block_name(child_name):
+  # e.g. 'camera 17391304' -> 'brpreview_camera_17391304'
+  return 'brpreview_' + re.sub(r'\W', '_', child_name)
+
+
+def _attach(name):
+  shm = shared_memory.SharedMemory(name=name)
+  if os.name == 'posix' and multiprocessing.parent_process() is None and name not in _created:
+    # attaching registers the block with this process's resource tracker, which would unlink it
+    # when the reader exits; only the writer owns it. Child processes share their parent's tracker,
+    # and so does a writer in this process, where the writer's registration must stay
+    resource_tracker.unregister(shm._name, 'shared_memory')
+  return shm
+
+
+def _create(name, size):
+  try:
+    shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+  except FileExistsError:  # left behind by a crashed session
+    stale = shared_memory.SharedMemory(name=name)
+    stale.close()
+    stale.unlink()
+    shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+  _created.add(name)
+  return shm
+
+
+def _unlink(shm):
+  shm.close()
+  shm.unlink()
+  _created.discard(shm.name)
+
+
+class SharedPreviewWriter:
+  # used by AcquisitionObject.display(); only one writer per name
+
+  def __init__(self, child_name):
+    self.name = preview_block_name(child_name)
+    self._shm = _create(self.name, HEADER_FIELDS * 8)
+    self._header = np.ndarray((HEADER_FIELDS,), dtype=np.float64, buffer=self._shm.buf)
+    self._header[:] = 0
+    self._data_shm = None
+    self._data = None
+
+  @property
+  def has_readers(self):
+    return time.time() - self._header[READER_TIME] < READER_TIMEOUT
+
+  def write(self, image, frame_seq, timestamp):
+    image = np.ascontiguousarray(image, dtype=np.uint8)
+    if image.ndim > MAX_DIMS:
+      raise ValueError(f'Previews can have at most {MAX_DIMS} dimensions, not {image.ndim}')
+    header = self._header
+    header[SEQ] += 1  # odd: writing
+    if self._data is None or image.nbytes > len(self._data):
+      self._grow(image.nbytes)
+    self._data[:image.nbytes] = image.reshape(-1)
+    header[FRAME_SEQ] = frame_seq
+    header[TIMESTAMP] = timestamp
+    header[LENGTH] = image.nbytes
+    header[NDIM] = image.ndim
+    header[SHAPE:SHAPE + MAX_DIMS] = image.shape + (0,) * (MAX_DIMS - image.ndim)
+    header[SEQ] += 1  # even: consistent
+
+  def _grow(self, nbytes):
+    old = self._data_shm
+    generation = int(self._header[GENERATION]) + 1
+    self._data_shm = _create(f'{self.name}_{generation}', nbytes)
+    self._data = np.ndarray((nbytes,), dtype=np.uint8, buffer=self._data_shm.buf)
+    self._header[GENERATION] = generation
+    if old is not None:
+      # readers still mapping it keep their mapping, they switch at their next read
+      _unlink(old)
+
+  def close(self):
+    self._header = self._data = None
+    for shm in (self._shm, self._data_shm):
+      if shm is not None:
+        _unlink(shm)
+    self._shm = self._data_shm = None
+
+
+class SharedPreviewReader:
+  # for a client on the same machine:
+  #   reader = SharedPreviewReader('camera 17391304')
+  #   frame_seq, timestamp, image = reader.wait(last_seq)
+  # raises FileNotFoundError while the acquisition is not running
+
+  def __init__(self, child_name):
+    self.name = preview_block_name(child_name)
+    self._shm = _attach(self.name)
+    self._header = np.ndarray((HEADER_FIELDS,), dtype=np.float64, buffer=self._shm.buf)
+    self._generation = 0
+    self._data_shm = None
+    self._data = None
+    self._header[READER_TIME] = time.time()  # ask the writer to start
+
+  def read(self, out=None):
+    # (frame_seq, timestamp, image) of the newest frame, or None before the first one
+    # image is a copy, into out if it has the right size
+    header = self._header
+    while True:
+      seq = header[SEQ]
+      if seq % 2:
+        time.sleep(0)  # the writer is in the middle of a frame
+        continue
+      header[READER_TIME] = time.time()
+      generation = int(header[GENERATION])
+      if generation == 0:
+        return None
+      if generation != self._generation:
+        try:
+          self._open(generation)
+        except FileNotFoundError:
+          continue  # replaced again in the meantime
+      shape = tuple(int(v) for v in header[SHAPE:SHAPE + int(header[NDIM])])
+      frame_seq, timestamp, length = int(header[FRAME_SEQ]), header[TIMESTAMP], int(header[LENGTH])
+      if out is None or out.shape != shape:
+        out = np.empty(shape, dtype=np.uint8)
+      try:
+        out.reshape(-1)[:] = self._data[:length]
+      except ValueError:
+        continue  # the header changed under us, the sequence check below would fail anyway
+      if header[SEQ] == seq:
+        return frame_seq, timestamp, out
+
+  def wait(self, last_seq, timeout=None, out=None):
+    # like read(), for the first frame newer than last_seq; None on timeout
+    end = None if timeout is None else time.time() + timeout
+    while self._header[FRAME_SEQ] <= last_seq or self._header[GENERATION] == 0:
+      if end is not None and time.time() > end:
+        return None
+      self._header[READER_TIME] = time.time()
+      time.sleep(POLL_TIME)
+    return self.read(out)
+
+  def _open(self, generation):
+    if self._data_shm is not None:
+      self._data = None
+      self._data_shm.close()
+    self._data_shm = _attach(f'{self.name}_{generation}')
+    self._data = np.ndarray((self._data_shm.size,), dtype=np.uint8, buffer=self._data_shm.buf)
+    self._generation = generation
+
+  def close(self):
+    self._header = self._data = None
+    for shm in (self._shm, self._data_shm):
+      if shm is not None:
+        shm.close()
+    self._shm = self._data_shm = None
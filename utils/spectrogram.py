@@ -0,0 +1,155 @@
+import numpy as np
+import scipy.fft
+from scipy import signal, sparse
+
+SPECTROGRAM_WINDOW = ('tukey', .25)  # scipy.signal.spectrogram's default
+SPECTROGRAM_COLORMAPS = ('gray', 'viridis', 'magma', 'inferno')  # gray sends one channel, the others rgb
+LEVEL_PERCENTILES = (5, 99.5)  # what maps to black and to full scale in scrolling mode
+LEVEL_SMOOTHING = .1  # weight of each new chunk's percentiles in the running levels
+_EPS = 1e-20  # keeps log10 finite for silent input
+
+
+def interpolation_matrix(x, xq):
+  # sparse (len(xq), len(x)) matrix that interpolates values at x (increasing) linearly onto xq;
+  # like np.interp, points outside x take the value at the nearest end
+  j = np.clip(np.searchsorted(x, xq, side='right') - 1, 0, len(x) - 2)
+  w = np.clip((xq - x[j]) / (x[j + 1] - x[j]), 0, 1)
+  rows = np.repeat(np.arange(len(xq)), 2)
+  cols = np.stack([j, j + 1], axis=1).reshape(-1)
+  weights = np.stack([1 - w, w], axis=1).reshape(-1)
+  return sparse.csr_matrix((weights, (rows, cols)), shape=(len(xq), len(x)))
+
+
+def colormap_lut(name):
+  # (256, 3) uint8 rgb lookup table, None for gray
+  if name not in SPECTROGRAM_COLORMAPS:
+    raise ValueError(f'Unknown colormap {name}, expected one of {SPECTROGRAM_COLORMAPS}')
+  if name == 'gray':
+    return None
+  from matplotlib import colormaps
+  return (colormaps[name](np.linspace(0, 1, 256))[:, :3] * 255).round().astype(np.uint8)
+
+
+def spectrogram_frequencies(settings):
+  # the display rows from status['spectrogram'], in Hz
+  low = settings['minimum frequency'].current
+  high = settings['maximum frequency'].current
+  n = int(settings['frequency resolution'].current)
+  if settings['log scaling'].current:
+    return np.logspace(np.log10(low), np.log10(high), num=n)
+  return np.linspace(low, high, num=n)
+
+
+class Spectrogram:
+  # incremental short-time Fourier transform behind the Mic and Nidaq previews
+  #
+  # push() takes each new chunk of samples and returns the newest `columns` columns as a uint8 image
+  # (frequencies x time, scaled to 0-255). Samples of a window that is not complete yet are carried
+  # over to the next chunk, so nothing is lost at chunk boundaries. Each chunk costs one batched real
+  # FFT of its windows and one sparse matmul that maps the FFT bins onto the display frequencies.
+  #
+  # with scrolling=True, push() returns only the columns computed from this chunk, for the client to
+  # append to what it shows. They are scaled in dB between running percentiles of the history
+  # (LEVEL_PERCENTILES) instead of each chunk's own min and max, so the picture does not flicker
+  # from chunk to chunk. The newest `columns` columns stay available with image()
+  #
+  # a colormap other than gray turns the 0-255 levels into rgb through a lookup table
+  #
+  # the number of new columns varies from chunk to chunk with the carried-over samples, and rgb triples
+  # the bytes, so in either mode the frames differ from the 'width' x 'height' of the status: see reshapes
+  #
+  # the plan is fixed: to change settings, build a new Spectrogram and replace the old one
+
+  def __init__(self, sample_rate, window, overlap, frequencies, columns, freq_correct=False, flip=False,
+               scrolling=False, colormap='gray'):
+    if not 0 <= overlap < window:
+      raise ValueError(f'The overlap must be shorter than the window ({window} samples), not {overlap}')
+    self.sample_rate = sample_rate
+    self.window = window
+    self.hop = window - overlap
+    self.frequencies = np.asarray(frequencies, dtype=float)
+    self.columns = columns
+    self.flip = flip  # highest frequency in the first row
+    self.scrolling = scrolling
+    self._lut = colormap_lut(colormap)
+    self._levels = None  # running (low, high) in log10 power, see LEVEL_PERCENTILES
+
+    self._taper = signal.get_window(SPECTROGRAM_WINDOW, window).astype(np.float32)
+    matrix = interpolation_matrix(scipy.fft.rfftfreq(window, 1 / sample_rate), self.frequencies)
+    if freq_correct:
+      matrix = sparse.diags(self.frequencies) @ matrix  # corrects for 1/f noise by multiplying with f
+    self._matrix = matrix.tocsr().astype(np.float32)
+
+    self._carry = np.zeros(0, dtype=np.float32)
+    self._columns = np.zeros((len(self.frequencies), columns), dtype=np.float32)  # newest column last
+    self._last_seq = None
+
+  @property
+  def reshapes(self):
+    # whether push() returns images of another shape than frequencies x columns of one channel, so a
+    # raw preview has to carry the shape, see utils/preview.py
+    return self.scrolling or self._lut is not None
+
+  def push(self, samples, seq=None):
+    # samples is the next chunk, seq its sequence number: after a gap the carried-over samples are
+    # dropped instead of being joined to samples they did not precede
+    samples = np.asarray(samples, dtype=np.float32).reshape(-1)
+    if seq is None or self._last_seq is None or seq != self._last_seq + 1:
+      self._carry = self._carry[:0]
+    self._last_seq = seq
+
+    buffer = np.concatenate((self._carry, samples))
+    n = (len(buffer) - self.window) // self.hop + 1 if len(buffer) >= self.window else 0
+    if n > 0:
+      segments = np.lib.stride_tricks.sliding_window_view(buffer, self.window)[::self.hop][:n]
+      spectrum = scipy.fft.rfft(segments * self._taper, axis=1)
+      power = spectrum.real ** 2 + spectrum.imag ** 2  # (n, bins)
+      new = self._matrix @ power.T  # (frequencies, n)
+      shown = min(n, self.columns)
+      self._columns[:, :self.columns - shown] = self._columns[:, shown:]
+      self._columns[:, self.columns - shown:] = new[:, n - shown:]
+    self._carry = buffer[n * self.hop:]
+    if self.scrolling:
+      return self._scroll(new if n > 0 else self._columns[:, :0])
+    return self.image()
+
+  def image(self):
+    image = self._columns - self._columns.min()
+    peak = image.max()
+    if peak > 0:
+      image *= 255 / peak
+    return self._render(image.astype(np.uint8))
+
+  def _scroll(self, new):
+    levels = np.log10(new + _EPS)
+    if levels.size:
+      low, high = np.percentile(levels, LEVEL_PERCENTILES)
+      if self._levels is None:
+        self._levels = (low, high)
+      else:
+        self._levels = tuple((1 - LEVEL_SMOOTHING) * old + LEVEL_SMOOTHING * value
+                             for old, value in zip(self._levels, (low, high)))
+    if self._levels is None:
+      return self._render(np.zeros(new.shape, dtype=np.uint8))
+    low, high = self._levels
+    levels -= low
+    levels *= 255 / max(high - low, _EPS)
+    np.clip(levels, 0, 255, out=levels)
+    return self._render(levels.astype(np.uint8))
+
+  def _render(self, image):
+    if self.flip:
+      image = image[::-1]
+    if self._lut is not None:
+      image = self._lut[image]
+    return image
+
+
+def spectrogram_from_settings(sample_rate, run_rate, settings, flip=False):
+  # plan for status['spectrogram'], one chunk of 1 / run_rate seconds wide
+  window = int(settings['pixel duration'].current * sample_rate)
+  overlap = int(settings['pixel fractional overlap'].current * window)
+  columns = int(sample_rate // run_rate) // (window - overlap)
+  return Spectrogram(sample_rate, window, overlap, spectrogram_frequencies(settings), columns,
+                     freq_correct=settings['noise correction'].current, flip=flip,
+                     scrolling=settings['scrolling'].current, colormap=settings['colormap'].current)
@@ -0,0 +1,291 @@
+import asyncio
+import concurrent.futures
+import json
+import socket
+import struct
+import threading
+
+import numpy as np
+
+from utils.tcp_utils import DeliveryStats
+
+# one TCP port for all children: every child publishes its display frames as a stream, a client
+# subscribes to any subset of the streams over a single connection.
+#
+# server to client, a frame is a FRAME_HEADER followed by `length` payload bytes:
+#   magic       b'BRS1'
+#   stream id   uint16, CONTROL_STREAM for messages from the server
+#   seq         uint64, the child's frame sequence number (gaps are frames the client skipped)
+#   timestamp   float64, capture time in seconds since the epoch
+#   encoding    uint8, see ENCODINGS
+#   dtype       4 bytes, numpy dtype string of the decoded frame, e.g. b'|u1'
+#   ndim, shape uint8 and 4 x uint32, shape of the decoded frame (unused dimensions are 0)
+#   length      uint32, payload bytes
+# right after connecting, the client gets a control frame with the json {'streams': {id: name}}
+#
+# client to server, one json object per line:
+#   {"subscribe": [ids or names]}    add streams
+#   {"unsubscribe": [ids or names]}  remove streams
+#
+# like FrameSender, the newest frame wins: a client that is still busy with a stream's last frame
+# skips the frames in between instead of slowing down the children or the other clients
+FRAME_MAGIC = b'BRS1'
+FRAME_HEADER = struct.Struct('<4sHQdB4sB4II')
+CONTROL_STREAM = 0
+ENCODINGS = {'raw': 0, 'jpeg': 1, 'webp': 2, 'png': 3, 'json': 255}
+MAX_DIMS = 4
+WRITE_BUFFER_HIGH = 1 << 16  # bytes queued on a client's socket before its writer waits
+READ_LIMIT = 1 << 16  # longest request line a client may send
+CLOSE_TIMEOUT = 2  # seconds close() waits for the event loop, which may already be gone at interpreter exit
+
+
+def frame_header(stream_id, seq, timestamp, encoding, dtype, shape, length):
+  shape = tuple(shape)
+  if len(shape) > MAX_DIMS:
+    raise ValueError(f'Frames can have at most {MAX_DIMS} dimensions, not {len(shape)}')
+  return FRAME_HEADER.pack(FRAME_MAGIC, stream_id, seq, timestamp, ENCODINGS[encoding],
+                           np.dtype(dtype).str.encode(), len(shape), *(shape + (0,) * (MAX_DIMS - len(shape))),
+                           length)
+
+
+def parse_header(header):
+  magic, stream_id, seq, timestamp, encoding, dtype, ndim, *shape, length = FRAME_HEADER.unpack(header)
+  if magic != FRAME_MAGIC:
+    raise ValueError('Not a stream frame, the connection is out of sync')
+  return {
+      'stream id': stream_id,
+      'seq': seq,
+      'timestamp': timestamp,
+      'encoding': {v: k for k, v in ENCODINGS.items()}[encoding],
+      'dtype': np.dtype(dtype.rstrip(b'\0').decode()),
+      'shape': tuple(shape[:ndim]),
+      'length': length,
+  }
+
+
+class _Subscriber:
+  def __init__(self, peer):
+    self.peer = peer
+    self.streams = set()
+    self.pending = {}  # stream id: (header, payload) of the newest frame not yet written
+    self.stats = {}  # stream id: DeliveryStats
+    self.wake = asyncio.Event()
+
+
+class Stream:
+  # what a child publishes through, returned by StreamServer.add_stream()
+
+  def __init__(self, server, stream_id, name):
+    self._server = server
+    self.id = stream_id
+    self.name = name
+
+  def __len__(self):
+    # number of subscribed clients
+    return self._server._subscriber_count(self.id)
+
+  def wait_for_subscribers(self, timeout=None):
+    return self._server._wait_for_subscribers(self.id, timeout)
+
+  def send(self, payload, seq, timestamp, encoding, dtype, shape):
+    # payload is bytes shared by all subscribers, it must not change afterwards
+    self._server._publish(frame_header(self.id, seq, timestamp, encoding, dtype, shape, len(payload)), payload, self.id)
+
+  @property
+  def stats(self):
+    # {'host:port': {'delivered fps', 'delivered', 'bytes', 'skipped'}} for every subscribed client
+    return self._server._stats(self.id)
+
+
+class StreamServer:
+  # single asyncio event loop thread serving every stream on one port
+
+  def __init__(self, address):
+    self.address = address
+    self._streams = {}  # id: name
+    self._subscribers = set()  # changed in the loop thread only, under _cond
+    self._counts = {}  # stream id: subscribed clients, read by the children
+    self._cond = threading.Condition()
+    self._loop = asyncio.new_event_loop()
+    self._server = None
+    self._ready = threading.Event()
+    self._thread = threading.Thread(target=self._run, name='stream server', daemon=True)
+    self._thread.start()
+    self._ready.wait()
+    if self._server is None:
+      raise Exception(f'Could not start the stream server on {address}')
+
+  def add_stream(self, name):
+    stream_id = len(self._streams) + 1  # 0 is CONTROL_STREAM
+    self._streams[stream_id] = name
+    return Stream(self, stream_id, name)
+
+  def _run(self):
+    asyncio.set_event_loop(self._loop)
+    try:
+      host, port = self.address
+      self._server = self._loop.run_until_complete(asyncio.start_server(
+          self._serve, host, port, limit=READ_LIMIT, reuse_address=True))
+    finally:
+      self._ready.set()
+    self._loop.run_forever()
+
+  async def _serve(self, reader, writer):
+    sock = writer.get_extra_info('socket')
+    sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    writer.transport.set_write_buffer_limits(high=WRITE_BUFFER_HIGH)
+    peer = writer.get_extra_info('peername')
+    subscriber = _Subscriber(f'{peer[0]}:{peer[1]}')
+    print(f'Added stream client {subscriber.peer} on {self.address}')
+    catalog = json.dumps({'streams': self._streams}).encode()
+    writer.write(frame_header(CONTROL_STREAM, 0, 0., 'json', np.uint8, (len(catalog),), len(catalog)) + catalog)
+    with self._cond:
+      self._subscribers.add(subscriber)
+    sender = asyncio.ensure_future(self._send(subscriber, writer))
+    try:
+      while True:
+        try:
+          line = await reader.readline()
+          if not line:
+            break
+          self._request(subscriber, line)
+        except ValueError as e:  # bad request, or a line longer than READ_LIMIT
+          print(f'Ignored request from stream client {subscriber.peer}: {e}')
+    except ConnectionError:
+      pass
+    finally:
+      with self._cond:
+        self._subscribers.discard(subscriber)
+      self._update_counts()
+      sender.cancel()
+      writer.close()
+      print(f'Stream client {subscriber.peer} disconnected from {self.address}')
+
+  def _request(self, subscriber, line):
+    # the whole request is checked before any of it is applied; anything malformed raises ValueError
+    request = json.loads(line)
+    if not isinstance(request, dict):
+      raise ValueError(f'A request is a json object, not {type(request).__name__}')
+    ids = {v: k for k, v in self._streams.items()}
+    changes = []
+    for key in ('subscribe', 'unsubscribe'):
+      streams = request.get(key, [])
+      if not isinstance(streams, list) or not all(
+          isinstance(stream, (str, int)) and not isinstance(stream, bool) for stream in streams):
+        raise ValueError(f'{key} takes a list of stream ids or names')
+      for stream in streams:
+        stream_id = ids.get(stream, stream)
+        if stream_id not in self._streams:
+          raise ValueError(f'Unknown stream {stream}')
+        changes.append((key, stream_id))
+    with self._cond:
+      for key, stream_id in changes:
+        if key == 'subscribe':
+          subscriber.streams.add(stream_id)
+          subscriber.stats.setdefault(stream_id, DeliveryStats())
+        else:
+          subscriber.streams.discard(stream_id)
+          subscriber.pending.pop(stream_id, None)
+    self._update_counts()
+
+  def _update_counts(self):
+    counts = {stream_id: sum(stream_id in s.streams for s in self._subscribers) for stream_id in self._streams}
+    with self._cond:
+      self._counts = counts
+      self._cond.notify_all()
+
+  async def _send(self, subscriber, writer):
+    try:
+      while True:
+        await subscriber.wake.wait()
+        subscriber.wake.clear()
+        while subscriber.pending:
+          stream_id = next(iter(subscriber.pending))  # oldest stream first
+          header, payload = subscriber.pending.pop(stream_id)
+          writer.write(header)
+          writer.write(payload)
+          await writer.drain()  # waits while the socket is full; newer frames replace pending ones meanwhile
+          stats = subscriber.stats[stream_id]
+          stats.bytes += len(header) + len(payload)
+          stats.frame_delivered()
+    except ConnectionError:
+      pass  # _serve notices too and cleans up
+
+  def _publish(self, header, payload, stream_id):
+    # called from the children's display threads
+    if self._counts.get(stream_id):
+      self._loop.call_soon_threadsafe(self._deliver, header, payload, stream_id)
+
+  def _deliver(self, header, payload, stream_id):
+    for subscriber in self._subscribers:
+      if stream_id in subscriber.streams:
+        if stream_id in subscriber.pending:
+          subscriber.stats[stream_id].skipped += 1
+        subscriber.pending[stream_id] = (header, payload)
+        subscriber.wake.set()
+
+  def _subscriber_count(self, stream_id):
+    with self._cond:
+      return self._counts.get(stream_id, 0)
+
+  def _wait_for_subscribers(self, stream_id, timeout):
+    with self._cond:
+      return self._cond.wait_for(lambda: self._counts.get(stream_id, 0) > 0, timeout)
+
+  def _stats(self, stream_id):
+    with self._cond:
+      return {s.peer: s.stats[stream_id].snapshot for s in self._subscribers if stream_id in s.streams}
+
+  def close(self):
+    async def shutdown():
+      self._server.close()
+    with self._cond:
+      self._counts = {}
+      self._cond.notify_all()
+    if self._server is not None and self._loop.is_running():
+      try:
+        asyncio.run_coroutine_threadsafe(shutdown(), self._loop).result(CLOSE_TIMEOUT)
+      except concurrent.futures.TimeoutError:
+        pass
+      self._loop.call_soon_threadsafe(self._loop.stop)
+      self._thread.join(CLOSE_TIMEOUT)
+
+
+class StreamClient:
+  # blocking client for StreamServer, e.g. for scripts and benchmarks
+  #   client = StreamClient(('localhost', 5100))
+  #   client.subscribe(['camera 17391304'])
+  #   header, payload = client.read()
+
+  def __init__(self, address):
+    self._sock = socket.create_connection(address)
+    self._sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    header, payload = self.read()
+    self.streams = {int(k): v for k, v in json.loads(payload)['streams'].items()}
+
+  def subscribe(self, streams):
+    self._request({'subscribe': list(streams)})
+
+  def unsubscribe(self, streams):
+    self._request({'unsubscribe': list(streams)})
+
+  def _request(self, request):
+    self._sock.sendall(json.dumps(request).encode() + b'\n')
+
+  def _read_exactly(self, n):
+    data = bytearray(n)
+    view = memoryview(data)
+    while view:
+      received = self._sock.recv_into(view)
+      if not received:
+        raise ConnectionError('Stream server closed the connection')
+      view = view[received:]
+    return data
+
+  def read(self):
+    # (parsed header, payload bytes) of the next frame
+    header = parse_header(self._read_exactly(FRAME_HEADER.size))
+    return header, self._read_exactly(header['length'])
+
+  def close(self):
+    self._sock.close()
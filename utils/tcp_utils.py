@@ -1,4 +1,12 @@
+import collections
+import select
 import socket
+import threading
+import time
+
+SENDER_TIMEOUT = .5  # longest time in seconds the sender thread sleeps before re-checking its clients
+SEND_FPS_WINDOW = 2  # seconds over which a client's delivered fps is measured
+CLIENT_MAX_FPS = 30  # default for FrameSender: most frames a second any one client is sent
 
 
 def initTCP(address):
@@ -37,7 +45,7 @@ def sendData(data, recipients):
       # while bytes_sent < bytes_to_send:
       #   bytes_sent += conn.send(data[bytes_sent:])
       conn.send(data)
-    except (ConnectionAbortedError, ConnectionResetError):
+    except (ConnectionAbortedError, ConnectionResetError, BrokenPipeError):
       # conn.shutdown(socket.SHUT_RDWR)
       print(
           f'Recipient {addr} disconnected from socket serving on {conn.getsockname()}')
@@ -55,3 +63,171 @@ def doShutdown(sock, recipients):
     conn.close()
   # sock.shutdown(socket.SHUT_RD)  # this is just a listener socket, no writes
   sock.close()
+
+
+class DeliveryStats:
+  # frames and bytes delivered to one client, and frames it skipped because it was still busy
+  def __init__(self):
+    self.delivered = 0
+    self.bytes = 0
+    self.skipped = 0
+    self.times = collections.deque()  # delivery times within SEND_FPS_WINDOW
+
+  def frame_delivered(self):
+    self.delivered += 1
+    now = time.time()
+    self.times.append(now)
+    while self.times[0] < now - SEND_FPS_WINDOW:
+      self.times.popleft()
+
+  @property
+  def snapshot(self):
+    times = self.times
+    fps = (len(times) - 1) / (times[-1] - times[0]) if len(times) > 1 and times[-1] > times[0] else 0.
+    return {'delivered fps': fps, 'delivered': self.delivered, 'bytes': self.bytes, 'skipped': self.skipped}
+
+
+class _Client:
+  def __init__(self, conn, addr, min_interval=0.):
+    self.conn = conn
+    self.addr = addr
+    self.waiting = None  # newest frame not yet started
+    self.sending = None  # memoryview of the rest of the frame going out
+    self.min_interval = min_interval  # seconds between the starts of two frames
+    self.next_start = 0.  # earliest time the waiting frame may start
+    self.stats = DeliveryStats()
+
+  def next_frame(self, now):
+    # only start a new frame once the previous one is fully out, so the stream is never corrupted,
+    # and no sooner than min_interval after the previous one started
+    if self.sending is None and self.waiting is not None and now >= self.next_start:
+      self.sending, self.waiting = memoryview(self.waiting), None
+      # keeps the cadence, so a frame that came in a little late does not push back the ones after it
+      self.next_start = max(self.next_start, now - self.min_interval) + self.min_interval
+
+  def held(self, now):
+    # seconds until the waiting frame may start, if the rate limit is what holds it back
+    if self.sending is None and self.waiting is not None and now < self.next_start:
+      return self.next_start - now
+    return None
+
+  def sent(self, n):
+    self.sending = self.sending[n:]
+    self.stats.bytes += n
+    if not len(self.sending):
+      self.sending = None
+      self.stats.frame_delivered()
+
+
+class FrameSender:
+  # sends frames to any number of clients, each at its own pace: latest frame wins
+  # every client has at most one frame going out and one waiting; send() replaces the waiting frame,
+  # so a client that falls behind skips stale frames instead of holding up the others or being dropped.
+  # a frame that has started going out is always finished, partial sends continue where they stopped
+  # each client is also sent at most max_fps frames a second (None: as fast as it reads); frames
+  # sent in between replace the waiting one and count as skipped, like those of a slow client
+
+  def __init__(self, name=None, max_fps=CLIENT_MAX_FPS):
+    self.max_fps = max_fps
+    self._lock = threading.Lock()
+    self._clients = []
+    self._wake_r, self._wake_w = socket.socketpair()
+    self._wake_r.setblocking(False)
+    self._wake_w.setblocking(False)
+    self._closing = False
+    self._thread = threading.Thread(target=self._run, name=name, daemon=True)
+    self._thread.start()
+
+  def __len__(self):
+    with self._lock:
+      return len(self._clients)
+
+  def add(self, conn, addr):
+    conn.setblocking(False)
+    with self._lock:
+      self._clients.append(_Client(conn, addr, 1 / self.max_fps if self.max_fps else 0.))
+    self._wake()
+
+  def send(self, data):
+    # data is bytes shared by all clients, it must not change afterwards
+    with self._lock:
+      for client in self._clients:
+        if client.waiting is not None:
+          client.stats.skipped += 1
+        client.waiting = data
+    self._wake()
+
+  @property
+  def stats(self):
+    # {'host:port': {'delivered fps', 'delivered', 'bytes', 'skipped'}} for every connected client
+    with self._lock:
+      return {f'{client.addr[0]}:{client.addr[1]}': client.stats.snapshot for client in self._clients}
+
+  def _wake(self):
+    try:
+      self._wake_w.send(b'\0')
+    except BlockingIOError:
+      pass  # already awake
+
+  def _drop(self, client, reason):
+    print(f'Recipient {client.addr} {reason}')
+    with self._lock:
+      self._clients.remove(client)
+    client.conn.close()
+
+  def _run(self):
+    while True:
+      with self._lock:
+        if self._closing:
+          return
+        clients = list(self._clients)
+        now = time.time()
+        timeout = SENDER_TIMEOUT
+        for client in clients:
+          client.next_frame(now)
+          held = client.held(now)
+          if held is not None:
+            timeout = min(timeout, held)
+      sending = [client.conn for client in clients if client.sending is not None]
+      readable, writable, _ = select.select([self._wake_r] + [client.conn for client in clients], sending, [],
+                                            timeout)
+      if self._wake_r in readable:
+        try:
+          while self._wake_r.recv(4096):
+            pass
+        except BlockingIOError:
+          pass
+
+      for client in clients:
+        if client.conn in readable:
+          # clients do not send anything, so readable means closed (or stray bytes to discard)
+          try:
+            if not client.conn.recv(4096):
+              self._drop(client, 'disconnected')
+              continue
+          except BlockingIOError:
+            pass
+          except OSError:
+            self._drop(client, 'disconnected')
+            continue
+        if client.conn in writable:
+          try:
+            n = client.conn.send(client.sending)
+          except BlockingIOError:
+            continue
+          except OSError:
+            self._drop(client, 'disconnected')
+            continue
+          with self._lock:
+            client.sent(n)
+
+  def close(self):
+    with self._lock:
+      self._closing = True
+    self._wake()
+    self._thread.join()
+    for client in self._clients:
+      client.conn.close()
+    self._clients = []
+    self._wake_r.close()
+    self._wake_w.close()
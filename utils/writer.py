@@ -0,0 +1,214 @@
+import collections
+import os
+import threading
+import time
+
+import numpy as np
+
+WRITER_DEPTH = 64  # number of preallocated buffers between the capture loop and the writer thread
+WRITER_POLICIES = ('block', 'drop-oldest', 'spill')
+IOV_MAX = os.sysconf('SC_IOV_MAX') if 'SC_IOV_MAX' in getattr(os, 'sysconf_names', {}) else 16  # buffers per writev()
+
+
+def write_buffers(file, buffers):
+  # write arrays to a binary file object without serializing them to bytes first: one writev() system
+  # call for the whole batch where the platform has it, one write() per buffer otherwise
+  views = [memoryview(buffer).cast('B') for buffer in buffers]
+  if not hasattr(os, 'writev'):  # windows
+    for view in views:
+      file.write(view)
+    return
+  file.flush()
+  fd = file.fileno()
+  while views:
+    written = os.writev(fd, views[:IOV_MAX])
+    while views and written >= len(views[0]):
+      written -= len(views[0])
+      views.pop(0)
+    if written:
+      views[0] = views[0][written:]  # partial write
+
+
+class AsyncWriter:
+  # moves file writes off the capture loop: submit() copies a chunk into a preallocated buffer and
+  # returns, a writer thread calls write(buffer, info) in order. info is an optional numpy record
+  # describing the chunk (e.g. frame_index.frame_info) that travels with it.
+  # submit_frame() queues a utils.frame_pool.PooledFrame by reference instead, without any copy.
+  #
+  # with batch=n, the writer calls write(buffers, infos) with up to n queued chunks at once, e.g. to
+  # hand them to write_buffers() in a single system call
+  #
+  # when all buffers are in use, policy decides what submit() does:
+  #   'block'       wait for the writer to free a buffer (back-pressure onto the capture loop)
+  #   'drop-oldest' discard the oldest queued chunk and reuse its buffer
+  #   'spill'       append the chunk to spill_path on disk; the writer replays spilled chunks in order
+  #                 once it has drained the queue, so nothing is lost or reordered
+
+  def __init__(self, write, depth=WRITER_DEPTH, policy='block', spill_path=None, metrics=None, name=None,
+               batch=None):
+    if policy not in WRITER_POLICIES:
+      raise ValueError(f'Unknown writer policy {policy}, expected one of {WRITER_POLICIES}')
+    if policy == 'spill' and spill_path is None:
+      raise ValueError('The spill policy needs a spill_path')
+    self._write = write
+    self.depth = depth
+    self.policy = policy
+    self.batch = batch
+    self.metrics = metrics
+
+    self._cond = threading.Condition()
+    self._queue = collections.deque()  # (buffer, info, PooledFrame or None)
+    self._free = []
+    self._shape = None
+    self._dtype = None
+
+    self._spill_path = spill_path
+    self._spill_in = None  # append handle used by submit()
+    self._spill_out = None  # read handle used by the writer thread
+    self._spilled = 0  # chunks on disk not yet written
+
+    self._closing = False
+    self._thread = threading.Thread(target=self._run, name=name, daemon=True)
+    self._thread.start()
+
+  def _allocate(self, shape, dtype):
+    self._shape = shape
+    self._dtype = dtype
+    self._free = [np.empty(shape, dtype=dtype) for _ in range(self.depth)]
+
+  @property
+  def queued(self):
+    with self._cond:
+      return len(self._queue) + self._spilled
+
+  def submit(self, data, info=None):
+    data = np.asarray(data)
+    with self._cond:
+      if self._closing:
+        raise Exception('Writer is closed')
+      if data.shape != self._shape or data.dtype != self._dtype:
+        # first chunk, or the producer changed format: wait for the writer to finish the old buffers
+        self._cond.wait_for(lambda: len(self._queue) == 0 and self._spilled == 0)
+        self._allocate(data.shape, data.dtype)
+
+      if self._spilled > 0 or (not self._free and self.policy == 'spill'):
+        # keep spilling until the writer has caught up, otherwise chunks would be reordered
+        self._spill(data, info)
+      else:
+        if not self._free:
+          if self.policy == 'block':
+            start = time.perf_counter()
+            self._cond.wait_for(lambda: len(self._free) > 0)
+            self._observe('writer blocked', time.perf_counter() - start)
+          else:  # drop-oldest
+            while not self._free:
+              self._drop_oldest()
+        buffer = self._free.pop()
+        np.copyto(buffer, data)
+        self._queue.append((buffer, info, None))
+      self._gauge('writer queue', len(self._queue) + self._spilled)
+      self._cond.notify_all()
+
+  def submit_frame(self, frame, info=None):
+    # queue a PooledFrame without copying it; the writer holds the frame until it has been written
+    with self._cond:
+      if self._closing:
+        raise Exception('Writer is closed')
+      if self._spilled > 0 or (len(self._queue) >= self.depth and self.policy == 'spill'):
+        self._spill(frame.array, info)
+      else:
+        if len(self._queue) >= self.depth:
+          if self.policy == 'block':
+            start = time.perf_counter()
+            self._cond.wait_for(lambda: len(self._queue) < self.depth)
+            self._observe('writer blocked', time.perf_counter() - start)
+          else:  # drop-oldest
+            self._drop_oldest()
+        frame.retain()
+        self._queue.append((frame.array, info, frame))
+      self._gauge('writer queue', len(self._queue) + self._spilled)
+      self._cond.notify_all()
+
+  def _drop_oldest(self):
+    self._recycle(self._queue.popleft())
+    self._count('writer dropped')
+
+  def _recycle(self, item):
+    buffer, _, frame = item
+    if frame is not None:
+      frame.release()
+    elif buffer.shape == self._shape and buffer.dtype == self._dtype:
+      self._free.append(buffer)  # unless the pool was reallocated while we were writing
+
+  def _spill(self, data, info):
+    if self._spill_in is None:
+      self._spill_in = open(self._spill_path, 'wb')
+      self._spill_out = open(self._spill_path, 'rb')
+    np.lib.format.write_array(self._spill_in, data, allow_pickle=False)
+    np.lib.format.write_array(self._spill_in, np.empty(0) if info is None else np.asarray(info)[np.newaxis],
+                              allow_pickle=False)
+    self._spill_in.flush()
+    self._spilled += 1
+    self._count('writer spilled')
+
+  def _run(self):
+    while True:
+      with self._cond:
+        self._cond.wait_for(lambda: self._queue or self._spilled or self._closing)
+        if self._queue:
+          items, spilled = [self._queue.popleft() for _ in range(min(self.batch or 1, len(self._queue)))], False
+        elif self._spilled:
+          items, spilled = None, True
+        else:
+          return  # closing and fully drained
+
+      if spilled:
+        # only this thread reads the spill file, and the record was flushed before _spilled was bumped
+        buffer = np.lib.format.read_array(self._spill_out, allow_pickle=False)
+        info = np.lib.format.read_array(self._spill_out, allow_pickle=False)
+        info = info[0] if len(info) else None
+        items = [(buffer, info, None)]
+
+      start = time.perf_counter()
+      if self.batch:
+        self._write([buffer for buffer, _, _ in items], [info for _, info, _ in items])
+      else:
+        self._write(*items[0][:2])
+      self._observe('write', time.perf_counter() - start)
+
+      with self._cond:
+        if spilled:
+          self._spilled -= 1
+          if self._spilled == 0:
+            # caught up: start the spill file over
+            self._spill_in.seek(0)
+            self._spill_in.truncate()
+            self._spill_out.seek(0)
+        else:
+          for item in items:
+            self._recycle(item)
+        self._gauge('writer queue', len(self._queue) + self._spilled)
+        self._cond.notify_all()
+
+  def close(self):
+    # writes everything still queued or spilled, then stops the writer thread
+    with self._cond:
+      self._closing = True
+      self._cond.notify_all()
+    self._thread.join()
+    if self._spill_in is not None:
+      self._spill_in.close()
+      self._spill_out.close()
+      os.remove(self._spill_path)
+
+  def _count(self, name):
+    if self.metrics is not None:
+      self.metrics.count(name)
+
+  def _gauge(self, name, value):
+    if self.metrics is not None:
+      self.metrics.gauge(name, value)
+
+  def _observe(self, name, seconds):
+    if self.metrics is not None:
+      self.metrics.observe(name, seconds)